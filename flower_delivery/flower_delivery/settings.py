@@ -74,6 +74,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'orders.context_processors.cart',
             ],
         },
     },
@@ -89,6 +90,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Журнал WAL: сайт, диспетчер уведомлений и процессы бота читают базу, не блокируя друг друга
+            'init_command': 'PRAGMA journal_mode=WAL;',
+            # Пишущая транзакция сразу берет блокировку, вместо ошибки "database is locked" при ее повышении
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -154,6 +161,46 @@ MESSAGE_TAGS = {
 }
 
 CART_SESSION_ID = 'cart'
+CART_COUNT_SESSION_ID = 'cart_count'  # Количество товаров рядом с корзиной, для счетчика в меню
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_TELEGRAM_ID = os.getenv('ADMIN_TELEGRAM_ID')
+
+# Очередь уведомлений Telegram (telegram_bot.outbox)
+OUTBOX_BATCH_SIZE = 20  # Сколько уведомлений диспетчер забирает за раз
+OUTBOX_POLL_INTERVAL = 1.0  # Пауза между опросами пустой очереди, секунды
+OUTBOX_LEASE_SECONDS = 60  # На сколько захваченное уведомление скрывается от других диспетчеров
+OUTBOX_MAX_ATTEMPTS = 8  # После стольких неудачных попыток уведомление считается недоставленным
+OUTBOX_BASE_RETRY_DELAY = 5  # Первая задержка перед повтором, секунды
+OUTBOX_MAX_RETRY_DELAY = 3600  # Максимальная задержка перед повтором, секунды
+
+# Общий клиент Telegram (telegram_bot.notifier)
+TELEGRAM_MAX_CONCURRENT_REQUESTS = 10  # Одновременных запросов к Bot API из одного процесса
+TELEGRAM_KEEPALIVE_TIMEOUT = 60  # Сколько секунд держать простаивающее соединение открытым
+TELEGRAM_GLOBAL_RATE = 30  # Планировщик отправки: не больше стольких сообщений в секунду от бота
+TELEGRAM_CHAT_RATE = 1  # Не больше стольких сообщений в секунду в один чат
+TELEGRAM_RETRY_AFTER_ATTEMPTS = 3  # Сколько раз повторять запрос после ответа 429 с retry_after
+TELEGRAM_ORDERS_PAGE_SIZE = 15  # Заказов на странице /orders и /orders_status (сообщение не длиннее 4096 символов)
+
+# Отчет по продажам (orders.reports)
+SALES_REPORT_PAGE_SIZE = 31  # Периодов на одной странице отчета
+
+# Профиль пользователя
+PROFILE_ORDERS_PAGE_SIZE = 10  # Заказов на странице каждого статуса
+
+# Хранилище корзины (orders.cart): 'orders.cart.SessionCartStore' - в сессии,
+# 'orders.cart.DatabaseCartStore' - в таблице CartItem для авторизованных пользователей
+CART_STORE = 'orders.cart.SessionCartStore'
+
+# Режим вебхука Telegram-бота (manage.py run_webhook)
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')  # Публичный адрес вебхука для setWebhook
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')  # Секретный токен, которым Telegram подписывает запросы
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook/'  # Путь, на который локальный сервер принимает обновления
+TELEGRAM_WEBHOOK_HOST = '127.0.0.1'
+TELEGRAM_WEBHOOK_PORT = 8081
+TELEGRAM_WEBHOOK_WORKERS = 1  # Процессов сервера, слушающих один порт
+TELEGRAM_WEBHOOK_MAX_CONCURRENT_UPDATES = 50  # Обновлений, обрабатываемых одновременно в одном процессе
+
+# Хранилище состояний диалогов бота (telegram_bot.storage.DatabaseStorage)
+TELEGRAM_FSM_TTL = 7 * 24 * 60 * 60  # Через сколько секунд без изменений состояние диалога забывается
+TELEGRAM_FSM_BATCH_DELAY = 0.005  # Сколько секунд копить обращения к базе, чтобы выполнить их одним запросом
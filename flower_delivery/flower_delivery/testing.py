@@ -0,0 +1,78 @@
+# flower_delivery/testing.py
+
+import asyncio
+import shutil
+import tempfile
+from aiogram.client.session.base import BaseSession
+from django.db import connection
+from django.test import override_settings
+
+
+class QueryPlanMixin:
+    """
+    Проверки плана выполнения запросов для тестов.
+
+    План получаем через QuerySet.explain(), который в SQLite выполняет
+    EXPLAIN QUERY PLAN. Строка вида "SCAN orders_order" без USING INDEX
+    означает полный просмотр таблицы.
+    """
+
+    def get_query_plan(self, queryset):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Проверка плана рассчитана на EXPLAIN QUERY PLAN в SQLite')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index=None):
+        """Запрос к таблице модели идет по индексу (по имени index, если оно задано)"""
+        plan = self.get_query_plan(queryset)
+        table = queryset.model._meta.db_table
+        for line in plan.splitlines():
+            words = line.replace('TABLE ', '').split()
+            if 'SCAN' in words and table in words and 'USING' not in words:
+                self.fail(f'Полный просмотр таблицы {table}:\n{plan}')
+        if index is not None:
+            self.assertIn(f'INDEX {index}', plan, f'Запрос не использует индекс {index}:\n{plan}')
+
+
+class TemporaryMediaMixin:
+    """
+    Временный MEDIA_ROOT на время тестов класса.
+
+    Загруженные в тестах изображения не остаются в media/ проекта:
+    каталог удаляется после тестов класса.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=cls.media_root)
+        override.enable()
+        cls.addClassCleanup(override.disable)
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+
+
+class FakeBotSession(BaseSession):
+    """
+    HTTP-сессия бота без обращения к Telegram.
+
+    Запоминает вызванные методы Bot API и отвечает на них через latency секунд,
+    имитируя задержку сети. Используется в тестах и нагрузочных замерах.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
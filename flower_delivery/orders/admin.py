@@ -30,22 +30,27 @@ class OrderAdmin(admin.ModelAdmin):
 
     colored_status.short_description = 'Статус'
 
+    def transition(self, request, queryset, status):
+        # Один UPDATE на все заказы и одна пачка уведомлений для покупателей
+        changed = queryset.transition(status)
+        self.message_user(request, f'Статус изменен у {len(changed)} заказов.')
+
     def mark_as_accepted(self, request, queryset):
-        queryset.update(status='accepted')
+        self.transition(request, queryset, 'accepted')
     mark_as_accepted.short_description = 'Отметить выбранные заказы как "Принят к работе"'
 
     def mark_as_in_progress(self, request, queryset):
-        queryset.update(status='in_progress')
+        self.transition(request, queryset, 'in_progress')
     mark_as_in_progress.short_description = 'Отметить выбранные заказы как "Находится в работе"'
 
     def mark_as_in_delivery(self, request, queryset):
-        queryset.update(status='in_delivery')
+        self.transition(request, queryset, 'in_delivery')
     mark_as_in_delivery.short_description = 'Отметить выбранные заказы как "В доставке"'
 
     def mark_as_completed(self, request, queryset):
-        queryset.update(status='completed')
+        self.transition(request, queryset, 'completed')
     mark_as_completed.short_description = 'Отметить выбранные заказы как "Выполнен"'
 
     def mark_as_canceled(self, request, queryset):
-        queryset.update(status='canceled')
+        self.transition(request, queryset, 'canceled')
     mark_as_canceled.short_description = 'Отметить выбранные заказы как "Отменен"'
@@ -2,63 +2,321 @@
 
 from decimal import Decimal
 from django.conf import settings
+from django.db.models import Sum
+from django.utils.module_loading import import_string
 from products.models import Product
+from .models import CartItem
+
+
+def to_cents(price):
+    """Цена в копейках целым числом"""
+    return int(Decimal(price).quantize(Decimal('0.01')) * 100)
+
+
+class CartLine:
+    """
+    Строка корзины: ID продукта, количество и цена в копейках на момент добавления.
+
+    Хранит типизированные данные отдельно от сессии. В сессию строка попадает
+    компактным списком [id, количество, копейки].
+    """
+    __slots__ = ('product_id', 'quantity', 'price_cents', 'product')
+
+    def __init__(self, product_id, quantity, price_cents, product=None):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.price_cents = price_cents
+        self.product = product
+
+    @property
+    def price(self):
+        return Decimal(self.price_cents).scaleb(-2)
+
+    @property
+    def total_cents(self):
+        return self.price_cents * self.quantity
+
+    @property
+    def total_price(self):
+        return Decimal(self.total_cents).scaleb(-2)
+
+    def to_session(self):
+        return [self.product_id, self.quantity, self.price_cents]
+
+    def __repr__(self):
+        return f'CartLine({self.product_id}, {self.quantity}, {self.price_cents})'
+
+
+def load_lines(payload):
+    """
+    Строки корзины из данных сессии: словарь {ID продукта: CartLine}.
+
+    Понимает и прежний формат {"id": {"quantity": ..., "price": "..."}},
+    чтобы не терять корзины, сохраненные до перехода на компактный формат.
+    """
+    if not payload:
+        return {}
+    if isinstance(payload, dict):
+        return {
+            int(product_id): CartLine(int(product_id), int(item['quantity']), to_cents(item['price']))
+            for product_id, item in payload.items()
+        }
+    return {
+        product_id: CartLine(product_id, quantity, price_cents)
+        for product_id, quantity, price_cents in payload
+    }
+
+
+class SessionCartStore:
+    """Корзина в сессии под ключом CART_SESSION_ID, при каждом изменении список строк пишется целиком"""
+    requires_user = False
+
+    def __init__(self, session, user=None):
+        self.session = session
+
+    def load(self):
+        return load_lines(self.session.get(settings.CART_SESSION_ID))
+
+    def count(self):
+        count = self.session.get(settings.CART_COUNT_SESSION_ID)
+        if count is None:
+            # Корзина сохранена до появления счетчика
+            count = sum(line.quantity for line in self.load().values())
+        return count
+
+    def save(self, lines, changed, removed):
+        self.session[settings.CART_SESSION_ID] = [line.to_session() for line in lines.values()]
+        self.session[settings.CART_COUNT_SESSION_ID] = sum(line.quantity for line in lines.values())
+        self.session.modified = True
+
+    def clear(self):
+        cart = self.session.pop(settings.CART_SESSION_ID, None)
+        count = self.session.pop(settings.CART_COUNT_SESSION_ID, None)
+        if cart is not None or count is not None:
+            self.session.modified = True
+
+
+class DatabaseCartStore:
+    """
+    Корзина авторизованного пользователя в таблице CartItem.
+
+    Строки загружаются вместе с продуктами одним запросом. При сохранении
+    измененные строки записываются одним upsert, удаленные - одним DELETE;
+    сессия не меняется. Корзина доступна с любого устройства пользователя.
+    """
+    requires_user = True
+
+    def __init__(self, session, user):
+        self.user = user
+
+    def load(self):
+        items = CartItem.objects.filter(user=self.user).select_related('product').order_by('id')
+        return {
+            item.product_id: CartLine(item.product_id, item.quantity, item.price_cents, item.product)
+            for item in items
+        }
+
+    def count(self):
+        return CartItem.objects.filter(user=self.user).aggregate(count=Sum('quantity'))['count'] or 0
+
+    def save(self, lines, changed, removed):
+        items = [
+            CartItem(
+                user=self.user, product_id=product_id,
+                quantity=lines[product_id].quantity, price_cents=lines[product_id].price_cents,
+            )
+            for product_id in changed if product_id in lines
+        ]
+        if items:
+            CartItem.objects.bulk_create(
+                items,
+                update_conflicts=True,
+                unique_fields=['user', 'product'],
+                update_fields=['quantity', 'price_cents', 'updated_at'],
+            )
+        if removed:
+            CartItem.objects.filter(user=self.user, product_id__in=removed).delete()
+
+    def clear(self):
+        CartItem.objects.filter(user=self.user).delete()
+
+
+def get_cart_store(session, user=None):
+    """
+    Хранилище корзины из настройки CART_STORE.
+
+    Хранилищу, которому нужен пользователь, анонимный посетитель не подходит:
+    его корзина остается в сессии до входа на сайт.
+    """
+    store_class = import_string(settings.CART_STORE)
+    if store_class.requires_user and (user is None or not user.is_authenticated):
+        return SessionCartStore(session)
+    return store_class(session, user)
+
+
+def get_cart_count(request):
+    """
+    Количество товаров в корзине для счетчика в меню, без загрузки строк корзины.
+
+    Без cookie сессии корзины быть не может, и хранилище сессий не трогаем вовсе.
+    """
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return 0
+    return get_cart_store(request.session, getattr(request, 'user', None)).count()
+
+
+def merge_session_cart(session, user):
+    """
+    Переносим корзину из сессии в хранилище пользователя после входа.
+
+    Количество одинаковых продуктов складывается, цена остается той, что
+    уже сохранена у пользователя. Продукты, удаленные из каталога, пропускаются.
+    """
+    session_store = SessionCartStore(session)
+    session_lines = session_store.load()
+    if not session_lines:
+        return
+    store = get_cart_store(session, user)
+    if isinstance(store, SessionCartStore):
+        return  # Корзина и так хранится в сессии
+    existing = set(Product.objects.filter(id__in=session_lines).values_list('id', flat=True))
+    lines = store.load()
+    for product_id, line in session_lines.items():
+        if product_id not in existing:
+            continue
+        if product_id in lines:
+            lines[product_id].quantity += line.quantity
+        else:
+            lines[product_id] = line
+    store.save(lines, existing, set())
+    session_store.clear()
+
 
 class Cart:
     def __init__(self, request):
         """Инициализируем корзину"""
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.store = get_cart_store(request.session, getattr(request, 'user', None))
+        self.lines = self.store.load()
+        # Измененные и удаленные с последнего сохранения строки, чтобы хранилище писало только их
+        self._changed = set()
+        self._removed = set()
+        # Продукты загружаются из базы один раз за запрос, при первом переборе
+        self._products_loaded = False
 
     def add(self, product, quantity=1, override_quantity=False):
         """Добавить продукт в корзину или обновить его количество"""
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            # Сохраняем только ID продукта и цену как строку (не сам объект Product)
-            self.cart[product_id] = {'quantity': 0, 'price': str(product.price)}
-        if override_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
-        self.save()
+        if self._add(product, quantity, override_quantity):
+            self.save()
+
+    def add_many(self, items, override_quantity=False):
+        """Добавить несколько продуктов: items - пары (продукт, количество), корзина сохраняется один раз"""
+        changed = False
+        for product, quantity in items:
+            changed = self._add(product, quantity, override_quantity) or changed
+        if changed:
+            self.save()
+
+    def update_many(self, quantities):
+        """
+        Установить количество сразу для нескольких строк корзины.
+
+        quantities - словарь {ID продукта: количество}, количество 0 и меньше
+        удаляет строку. Продукты не загружаются, корзина сохраняется один раз.
+        """
+        changed = False
+        for product_id, quantity in quantities.items():
+            line = self.lines.get(product_id)
+            if line is None:
+                continue
+            if quantity <= 0:
+                del self.lines[product_id]
+                self._removed.add(product_id)
+                self._changed.discard(product_id)
+                changed = True
+            elif line.quantity != quantity:
+                line.quantity = quantity
+                self._changed.add(product_id)
+                changed = True
+        if changed:
+            self.save()
+        return changed
+
+    def _add(self, product, quantity, override_quantity):
+        """Меняем строку корзины, возвращаем True, если данные для хранилища изменились"""
+        line = self.lines.get(product.id)
+        if line is None:
+            # Запоминаем цену на момент добавления, сам объект Product в сессию не попадает
+            line = self.lines[product.id] = CartLine(product.id, 0, to_cents(product.price))
+        line.product = product
+        previous_quantity = line.quantity
+        line.quantity = quantity if override_quantity else line.quantity + quantity
+        if previous_quantity == line.quantity:
+            return False
+        self._changed.add(product.id)
+        self._removed.discard(product.id)
+        return True
 
     def save(self):
-        """Обновляем сессию cart и отмечаем как изменённую"""
-        # Перекопируем данные в сессию, оставляя только примитивные типы данных
-        self.session[settings.CART_SESSION_ID] = {key: {'quantity': value['quantity'], 'price': value['price']} for key, value in self.cart.items()}
-        self.session.modified = True
+        """Передаем хранилищу строки корзины и то, что изменилось с прошлого сохранения"""
+        self.store.save(self.lines, self._changed, self._removed)
+        self._changed = set()
+        self._removed = set()
 
     def remove(self, product):
         """Удаление товара из корзины"""
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
+        if self.lines.pop(product.id, None) is not None:
+            self._removed.add(product.id)
+            self._changed.discard(product.id)
             self.save()
 
+    def _load_products(self):
+        missing = [line.product_id for line in self.lines.values() if line.product is None]
+        if missing and not self._products_loaded:
+            products = Product.objects.in_bulk(missing)
+            for product_id in missing:
+                self.lines[product_id].product = products.get(product_id)
+            # Продукты, удаленные из каталога, убираем из хранилища, чтобы счетчик в меню их не учитывал
+            deleted = [product_id for product_id in missing if product_id not in products]
+            for product_id in deleted:
+                del self.lines[product_id]
+                self._removed.add(product_id)
+                self._changed.discard(product_id)
+            if deleted:
+                self.save()
+        self._products_loaded = True
+
     def __iter__(self):
-        """Перебор элементов в корзине и получение продуктов из базы данных"""
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-        for product in products:
-            cart_item = cart[str(product.id)]
-            # Добавляем объект продукта для отображения, но не сохраняем его в сессии
-            cart_item['product'] = product
-            cart_item['total_price'] = Decimal(cart_item['price']) * cart_item['quantity']
-            yield cart_item
+        """Перебор строк корзины с продуктами; удаленные из каталога продукты пропускаются"""
+        self._load_products()
+        return (line for line in list(self.lines.values()) if line.product is not None)
 
     def __len__(self):
-        """Подсчет всех товаров в корзине"""
-        return sum(item['quantity'] for item in self.cart.values())
+        """Подсчет всех товаров в корзине; удаленные из каталога продукты не учитываются, как и в __iter__"""
+        return sum(line.quantity for line in self)
 
     def get_total_price(self):
         """Подсчет общей стоимости товаров в корзине"""
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return Decimal(sum(line.total_cents for line in self)).scaleb(-2)
+
+    def summary(self):
+        """Состояние корзины для AJAX-клиентов: количество товаров, сумма и строки"""
+        return {
+            'count': len(self),
+            'total_price': str(self.get_total_price()),
+            'lines': [
+                {
+                    'product_id': line.product_id,
+                    'quantity': line.quantity,
+                    'price': str(line.price),
+                    'total_price': str(line.total_price),
+                }
+                for line in self
+            ],
+        }
 
     def clear(self):
-        """Удаление корзины из сессии"""
-        del self.session[settings.CART_SESSION_ID]
-        self.session.modified = True
+        """Удаление корзины из хранилища"""
+        self.store.clear()
+        self.lines = {}
+        self._changed = set()
+        self._removed = set()
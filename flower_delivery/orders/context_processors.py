@@ -0,0 +1,9 @@
+# orders/context_processors.py
+
+from django.utils.functional import SimpleLazyObject
+from .cart import get_cart_count
+
+
+def cart(request):
+    """Количество товаров в корзине для всех шаблонов; считается, только если шаблон его выводит"""
+    return {'cart_count': SimpleLazyObject(lambda: get_cart_count(request))}
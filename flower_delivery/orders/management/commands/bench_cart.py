@@ -0,0 +1,64 @@
+# orders/management/commands/bench_cart.py
+
+import time
+from types import SimpleNamespace
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from orders.cart import Cart
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет число запросов и процессорное время обработки корзины разного размера. '
+        'Тестовые продукты создаются в транзакции, которая откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 20, 200],
+            help='Количество строк в корзине',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Сколько раз повторить обработку для замера времени',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"Строк":>6} {"Запросов":>9} {"Время, мс":>10} {"Сессия, байт":>13}')
+        with transaction.atomic():
+            products = Product.objects.bulk_create(
+                Product(name=f'Тестовый букет {i}', price=100 + i) for i in range(max(options['sizes']))
+            )
+            for size in options['sizes']:
+                queries, seconds, session_size = self.measure(products[:size], options['repeat'])
+                self.stdout.write(f'{size:>6} {queries:>9} {seconds * 1000:>10.3f} {session_size:>13}')
+            transaction.set_rollback(True)
+
+    def measure(self, products, repeat):
+        """Запросы, среднее время на один запрос страницы корзины и размер корзины в сессии"""
+        session = SessionStore()
+        Cart(SimpleNamespace(session=session)).add_many((product, 2) for product in products)
+        payload = dict(session)
+
+        total = 0
+        for _ in range(repeat):
+            request = SimpleNamespace(session=SessionStore())
+            request.session.update(payload)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.process_time()
+                self.process(request)
+                total += time.process_time() - started
+        return len(queries), total / repeat, len(session.encode(payload))
+
+    def process(self, request):
+        # Та же работа, что на странице корзины и при оформлении заказа:
+        # шаблон перебирает корзину, считает сумму, а представление перебирает ее еще раз
+        cart = Cart(request)
+        for item in cart:
+            item.total_price
+        cart.get_total_price()
+        len(cart)
+        list(cart)
@@ -0,0 +1,14 @@
+# orders/management/commands/rebuild_sales_rollup.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from orders.models import DailySalesRollup
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводку продаж по дням по всей истории заказов'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = DailySalesRollup.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Сводка продаж пересчитана: {rows} строк.'))
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:11
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_sales_rollup(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    DailySalesRollup = apps.get_model('orders', 'DailySalesRollup')
+    totals = (
+        Order.objects.order_by()
+        .values('status', day=TruncDate('created_at'))
+        .annotate(order_count=Count('id'), revenue=Sum('total_price'))
+    )
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(date=row['day'], status=row['status'], order_count=row['order_count'], revenue=row['revenue'])
+        for row in totals
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_remove_order_delivery_place'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('status', models.CharField(choices=[('pending', 'В ожидании'), ('accepted', 'Принят к работе'), ('in_progress', 'Находится в работе'), ('in_delivery', 'В доставке'), ('completed', 'Выполнен'), ('canceled', 'Отменен')], max_length=20, verbose_name='Статус')),
+                ('order_count', models.IntegerField(default=0, verbose_name='Количество заказов')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'constraints': [models.UniqueConstraint(fields=('date', 'status'), name='sales_rollup_date_status_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_sales_rollup, migrations.RunPython.noop),
+    ]
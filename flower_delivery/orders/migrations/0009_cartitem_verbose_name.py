@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_cartitem'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cartitem',
+            options={'verbose_name': 'Строка корзины', 'verbose_name_plural': 'Строки корзин'},
+        ),
+    ]
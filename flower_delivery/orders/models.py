@@ -1,11 +1,127 @@
 # orders/models.py
 
+from decimal import Decimal
 from django.db import models
 from django.contrib.auth.models import User
 from products.models import Product
-from django.conf import settings
-from asgiref.sync import async_to_sync, sync_to_async
-from aiogram import Bot
+from django.db import transaction
+from django.db.models import F, Q, Sum, Count, Case, When, Value, Window
+from django.db.models.functions import TruncDate, RowNumber
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from telegram_bot.models import NotificationOutbox
+
+class OrderQuerySet(models.QuerySet):
+    def status_counts(self):
+        """Количество заказов в каждом статусе одним GROUP BY"""
+        return dict(self.order_by().values_list('status').annotate(count=Count('id')))
+
+    async def astatus_counts(self):
+        """Асинхронный вариант status_counts для обработчиков бота"""
+        return {
+            status: count
+            async for status, count in self.order_by().values_list('status').annotate(count=Count('id'))
+        }
+
+    def status_pages(self, offsets, per_page):
+        """
+        Страницы заказов сразу для нескольких статусов одним запросом.
+
+        offsets - словарь {статус: сколько заказов пропустить}. Заказы нумеруются
+        оконной функцией внутри своего статуса от новых к старым. Возвращает
+        словарь {статус: список заказов страницы}.
+        """
+        if not offsets:
+            return {}
+        orders = (
+            self.filter(status__in=offsets)
+            .annotate(
+                position=Window(
+                    RowNumber(), partition_by=[F('status')], order_by=[F('created_at').desc(), F('id').desc()]
+                ),
+                page_start=Case(
+                    *(When(status=status, then=Value(offset)) for status, offset in offsets.items()),
+                    output_field=models.IntegerField(),
+                ),
+            )
+            .filter(position__gt=F('page_start'), position__lte=F('page_start') + per_page)
+            .order_by('status', 'position')
+        )
+        pages = {status: [] for status in offsets}
+        for order in orders:
+            pages[order.status].append(order)
+        return pages
+
+    def keyset_page(self, cursor=None, size=20):
+        """
+        Страница заказов от новых к старым с пагинацией по ключу.
+
+        cursor - пара (created_at, id) последнего заказа предыдущей страницы.
+        Следующая страница выбирается условием по индексу, а не через OFFSET,
+        поэтому каждая страница стоит одинаково. Работает и после values(),
+        если в них есть created_at и id. Возвращает список заказов и курсор
+        следующей страницы (None, если страница последняя).
+        """
+        return self._keyset_result(list(self._keyset_queryset(cursor, size)), size)
+
+    async def akeyset_page(self, cursor=None, size=20):
+        """Асинхронный вариант keyset_page для обработчиков бота"""
+        orders = [order async for order in self._keyset_queryset(cursor, size)]
+        return self._keyset_result(orders, size)
+
+    def _keyset_queryset(self, cursor, size):
+        # Лишняя строка показывает, есть ли следующая страница
+        orders = self.order_by('-created_at', '-id')
+        if cursor is not None:
+            created_at, pk = cursor
+            orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return orders[:size + 1]
+
+    @staticmethod
+    def _keyset_result(orders, size):
+        if len(orders) <= size:
+            return orders, None
+        orders = orders[:size]
+        last = orders[-1]
+        if isinstance(last, dict):
+            return orders, (last['created_at'], last['id'])
+        return orders, (last.created_at, last.id)
+
+    def transition(self, status):
+        """
+        Массово переводим заказы в новый статус.
+
+        Заказы меняются одним UPDATE, а уведомления об изменении всех заказов
+        ставятся в очередь одной пачкой. Возвращает список пар
+        (id заказа, предыдущий статус) для действительно измененных заказов.
+        """
+        with transaction.atomic():
+            rows = list(
+                self.select_for_update().exclude(status=status).order_by('pk')
+                .values_list('pk', 'status', 'created_at', 'total_price')
+            )
+            if not rows:
+                return []
+            changed = [(pk, previous_status) for pk, previous_status, _, _ in rows]
+            Order.objects.filter(pk__in=[pk for pk, _ in changed]).exclude(status=status).update(status=status)
+            # Переносим заказы между строками сводки продаж, по одному UPDATE на день и статус
+            deltas = {}
+            for _, previous_status, created_at, total_price in rows:
+                date = timezone.localdate(created_at)
+                for key, sign in (((date, previous_status), -1), ((date, status), 1)):
+                    count, revenue = deltas.get(key, (0, 0))
+                    deltas[key] = (count + sign, revenue + sign * total_price)
+            for (date, row_status), (count, revenue) in deltas.items():
+                DailySalesRollup.apply(date, row_status, count, revenue)
+            NotificationOutbox.enqueue(
+                'order_status_changed_batch',
+                status=status,
+                orders=[[pk, previous_status] for pk, previous_status in changed],
+            )
+        return changed
+
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -27,6 +143,8 @@ class Order(models.Model):
     delivery_date = models.DateField(verbose_name='Дата доставки', null=True, blank=True)
     delivery_time = models.TimeField(verbose_name='Время доставки', null=True, blank=True)
 
+    objects = OrderQuerySet.as_manager()
+
     def status_color(self):
         status_colors = {
             'pending': 'warning',
@@ -46,49 +164,169 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            # Заказы в статусе для бота и администратора, новые сначала
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+            # История заказов пользователя в профиле
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Выборки заказов за период
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
 
-    def save(self, *args, **kwargs):
-        previous_status = None
-        if self.pk:
-            previous_status = Order.objects.get(pk=self.pk).status
-        super().save(*args, **kwargs)
-        if previous_status and previous_status != self.status:
-            # Статус изменился, отправляем уведомление
-            async_to_sync(send_status_change_notification)(self)
-
-
-# Асинхронная функция для отправки уведомления об изменении статуса
-async def send_status_change_notification(order):
-    try:
-        bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-
-        # Получаем необходимые данные из ORM в синхронном контексте
-        def get_notification_data():
-            text = (
-                f"🔔 <b>Статус вашего заказа №{order.id} изменен</b>\n"
-                f"Новый статус: <b>{order.get_status_display()}</b>"
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем статус из базы, чтобы при сохранении заметить его изменение без лишнего SELECT
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_total_price = instance.__dict__.get('total_price')
+        return instance
+
+    def _get_previous_state(self):
+        """Статус и сумма заказа, сохраненные в базе, или (None, None) для нового заказа"""
+        if self.pk is None:
+            return None, None
+        previous_status = getattr(self, '_loaded_status', None)
+        previous_total = getattr(self, '_loaded_total_price', None)
+        if previous_status is None or previous_total is None:
+            # Экземпляр создан вручную или поля были отложены, узнаем их из базы
+            previous_status, previous_total = (
+                Order.objects.filter(pk=self.pk).values_list('status', 'total_price').first() or (None, None)
             )
-            telegram_id = order.user.profile.telegram_id
-            return text, telegram_id
+        return previous_status, previous_total
+
+    def _get_previous_status(self):
+        return self._get_previous_state()[0]
+
+    def _update_sales_rollup(self, previous_status, previous_total):
+        """Сдвигаем сводку продаж с прежних статуса и суммы заказа на текущие"""
+        date = timezone.localdate(self.created_at)
+        # Сумма может оказаться float (значение по умолчанию 0.00 или присвоенное вызывающим кодом)
+        total = Decimal(str(self.total_price))
+        if previous_total is not None:
+            previous_total = Decimal(str(previous_total))
+        if previous_status is None:
+            DailySalesRollup.apply(date, self.status, 1, total)
+        elif previous_status == self.status:
+            DailySalesRollup.apply(date, self.status, 0, total - previous_total)
+        else:
+            DailySalesRollup.apply(date, previous_status, -1, -previous_total)
+            DailySalesRollup.apply(date, self.status, 1, total)
+
+    def _on_status_changed(self, previous_status):
+        # Уведомление ставится в очередь в той же транзакции, что и новый статус
+        NotificationOutbox.enqueue('order_status_changed', order_id=self.pk, status=self.status)
+
+    def save(self, *args, **kwargs):
+        previous_status, previous_total = self._get_previous_state()
+        update_fields = kwargs.get('update_fields')
+        status_saved = update_fields is None or 'status' in update_fields
+        total_saved = update_fields is None or 'total_price' in update_fields
+        # Без точки сохранения: внутри внешней транзакции (оформление заказа) просто присоединяемся к ней
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if previous_status is None or (
+                (status_saved and previous_status != self.status)
+                or (total_saved and previous_total != self.total_price)
+            ):
+                self._update_sales_rollup(
+                    previous_status if status_saved else self.status,
+                    previous_total if total_saved else self.total_price,
+                )
+            if status_saved and previous_status and previous_status != self.status:
+                self._on_status_changed(previous_status)
+        if status_saved:
+            self._loaded_status = self.status
+        if total_saved:
+            self._loaded_total_price = self.total_price
 
-        text, telegram_id = await sync_to_async(get_notification_data)()
+    def transition_to(self, status):
+        """
+        Переводим заказ в новый статус условным UPDATE.
 
-        # Отправляем уведомление администратору
-        await bot.send_message(
-            chat_id=settings.ADMIN_TELEGRAM_ID,
-            text=text,
-            parse_mode='HTML'
+        Статус меняется, только если в базе он все еще равен загруженному,
+        поэтому из двух параллельных переходов выполнится лишь один.
+        Возвращает True, если переход состоялся.
+        """
+        previous_status = self._get_previous_status() or self.status
+        if previous_status == status:
+            return False
+        with transaction.atomic():
+            updated = Order.objects.filter(pk=self.pk, status=previous_status).update(status=status)
+            if updated:
+                self.status = status
+                self._update_sales_rollup(previous_status, self.total_price)
+                self._on_status_changed(previous_status)
+        if updated:
+            self._loaded_status = status
+        return bool(updated)
+
+
+@receiver(post_delete, sender=Order)
+def update_sales_rollup_on_delete(sender, instance, **kwargs):
+    DailySalesRollup.apply(
+        timezone.localdate(instance.created_at), instance.status, -1, -instance.total_price
+    )
+
+
+class DailySalesRollup(models.Model):
+    """
+    Сводка продаж за день по статусам заказов.
+
+    Строки обновляются инкрементально при создании, изменении и удалении
+    заказов, поэтому отчет по продажам не агрегирует всю таблицу заказов.
+    """
+    date = models.DateField(verbose_name='Дата')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Статус')
+    order_count = models.IntegerField(default=0, verbose_name='Количество заказов')
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Выручка')
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status'], name='sales_rollup_date_status_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.date}: {self.get_status_display()}'
+
+    @staticmethod
+    def apply(date, status, count_delta, revenue_delta):
+        """
+        Атомарно сдвигаем счетчики за день.
+
+        Строка создается только при добавлении заказа: INSERT с пропуском конфликта
+        не мешает параллельным запросам, а сами счетчики меняются одним UPDATE.
+        """
+        if not count_delta and not revenue_delta:
+            return
+        if count_delta > 0:
+            DailySalesRollup.objects.bulk_create(
+                [DailySalesRollup(date=date, status=status)], ignore_conflicts=True
+            )
+        DailySalesRollup.objects.filter(date=date, status=status).update(
+            order_count=F('order_count') + count_delta,
+            revenue=F('revenue') + revenue_delta,
         )
-        # Если пользователь связал свой аккаунт с Telegram, отправляем ему уведомление
-        if telegram_id:
-            await bot.send_message(
-                chat_id=telegram_id,
-                text=text,
-                parse_mode='HTML'
+
+    @staticmethod
+    def rebuild():
+        """Пересчитываем сводку с нуля по таблице заказов"""
+        totals = (
+            Order.objects.order_by()
+            .values('status', day=TruncDate('created_at'))
+            .annotate(order_count=Count('id'), revenue=Sum('total_price'))
+        )
+        rows = [
+            DailySalesRollup(
+                date=row['day'], status=row['status'],
+                order_count=row['order_count'], revenue=row['revenue'],
             )
-        await bot.session.close()  # Закрываем сессию бота
-    except Exception as e:
-        print(f"Ошибка при отправке уведомления в Telegram: {e}")
+            for row in totals
+        ]
+        DailySalesRollup.objects.all().delete()
+        DailySalesRollup.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
 
 
 class OrderItem(models.Model):
@@ -102,3 +340,37 @@ class OrderItem(models.Model):
 
     def get_cost(self):
         return self.price * self.quantity
+
+
+class CartItem(models.Model):
+    """
+    Строка корзины авторизованного пользователя (хранилище orders.cart.DatabaseCartStore).
+
+    Одна строка на пару пользователь/продукт: изменение количества - upsert
+    одной строки, а не перезапись всей сессии. Цена хранится в копейках
+    на момент добавления, как в сессионной корзине.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    price_cents = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Строка корзины'
+        verbose_name_plural = 'Строки корзин'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='cart_item_user_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.product} x {self.quantity}'
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """При входе переносим корзину из сессии в корзину пользователя в базе"""
+    if request is None:
+        return
+    from .cart import merge_session_cart
+    merge_session_cart(request.session, user)
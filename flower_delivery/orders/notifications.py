@@ -0,0 +1,171 @@
+# orders/notifications.py
+
+import os
+from aiogram.types import BufferedInputFile, FSInputFile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from products.thumbnails import downscaled_jpeg
+from telegram_bot.notifier import notifier
+from telegram_bot.outbox import PartialDeliveryError
+from telegram_bot.scheduler import MESSAGE_LIMIT
+from .models import Order
+
+# Обработчики уведомлений вызываются диспетчером очереди telegram_bot.outbox.
+# Ошибки отправки не перехватываются: диспетчер повторит попытку позже.
+
+
+def get_product_photo(product):
+    """
+    Фотография продукта для Telegram.
+
+    Если изображение уже загружалось, возвращаем его file_id, иначе уменьшенную копию,
+    чтобы не отправлять оригинал размером в несколько мегабайт.
+    """
+    if product.telegram_file_id:
+        return product.telegram_file_id
+    jpeg = (product.thumbnails or {}).get('jpeg')
+    if jpeg:
+        path = os.path.join(settings.MEDIA_ROOT, jpeg[max(jpeg, key=int)])
+        if os.path.exists(path):
+            return FSInputFile(path)
+    if product.image and os.path.exists(product.image.path):
+        photo = downscaled_jpeg(product.image.path)
+        if photo:
+            return BufferedInputFile(photo, filename=f'product_{product.id}.jpg')
+    return None
+
+
+def get_order_data(order_id):
+    """Данные для уведомления о новом заказе: продукт, фотография и текст"""
+    order = Order.objects.select_related('user').get(pk=order_id)
+    first_item = order.items.select_related('product').first()
+    product = first_item.product if first_item else None
+    photo = get_product_photo(product) if product else None
+    text = (
+        f"🛍 <b>Новый заказ №{order.id}</b>\n"
+        f"👤 Пользователь: {order.user.username}\n"
+        f"💰 Сумма: {order.total_price} руб.\n"
+        f"📅 Дата и время заказа: {order.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+        f"📍 Адрес доставки: {order.address}\n"
+        f"📞 Телефон: {order.phone}\n"
+        f"📝 Комментарий: {order.comment or 'Нет'}"
+    )
+    return product, photo, text
+
+
+def get_status_change_data(order_id, status):
+    """Текст уведомления о смене статуса и Telegram ID покупателя"""
+    order = Order.objects.select_related('user__profile').get(pk=order_id)
+    text = (
+        f"🔔 <b>Статус вашего заказа №{order.id} изменен</b>\n"
+        f"Новый статус: <b>{dict(Order.STATUS_CHOICES).get(status, status)}</b>"
+    )
+    return text, order.user.profile.telegram_id
+
+
+async def send_order_notification(payload):
+    """Уведомляем администратора о новом заказе"""
+    try:
+        product, photo, text = await sync_to_async(get_order_data)(payload['order_id'])
+    except Order.DoesNotExist:
+        return  # Заказ удален, уведомлять не о чем
+
+    if photo:
+        sent = await notifier.send_photo(
+            chat_id=settings.ADMIN_TELEGRAM_ID,
+            photo=photo,
+            caption=text,
+            parse_mode='HTML'
+        )
+        if not isinstance(photo, str) and sent.photo:
+            # Запоминаем file_id самого крупного размера, чтобы больше не загружать файл
+            await sync_to_async(product.remember_telegram_file_id)(sent.photo[-1].file_id, product.image.name)
+    else:
+        await notifier.send_message(
+            chat_id=settings.ADMIN_TELEGRAM_ID,
+            text=text,
+            parse_mode='HTML'
+        )
+
+
+async def send_status_change_notification(payload):
+    """Уведомляем администратора и покупателя об изменении статуса заказа"""
+    try:
+        text, telegram_id = await sync_to_async(get_status_change_data)(payload['order_id'], payload['status'])
+    except Order.DoesNotExist:
+        return
+
+    # Отправляем уведомление администратору
+    await notifier.send_message(
+        chat_id=settings.ADMIN_TELEGRAM_ID,
+        text=text,
+        parse_mode='HTML'
+    )
+    # Если пользователь связал свой аккаунт с Telegram, отправляем ему уведомление
+    if telegram_id:
+        await notifier.send_message(
+            chat_id=telegram_id,
+            text=text,
+            parse_mode='HTML'
+        )
+
+
+def split_lines(header, lines, limit=MESSAGE_LIMIT):
+    """Собираем строки в сообщения не длиннее limit, каждое начинается с заголовка"""
+    chunks, current = [], header
+    for line in lines:
+        if len(current) + len(line) + 1 > limit and current != header:
+            chunks.append(current)
+            current = header
+        current += '\n' + line
+    chunks.append(current)
+    return chunks
+
+
+def get_status_change_batch_messages(order_ids, status):
+    """
+    Сообщения о массовой смене статуса.
+
+    Администратор получает одну сводку, каждый покупатель с привязанным Telegram -
+    одно сообщение со всеми своими заказами. Заказы загружаются одним запросом.
+    """
+    status_display = dict(Order.STATUS_CHOICES).get(status, status)
+    orders = list(
+        Order.objects.filter(pk__in=order_ids).select_related('user__profile').order_by('pk')
+    )
+    if not orders:
+        return []
+
+    messages = [
+        {'chat_id': settings.ADMIN_TELEGRAM_ID, 'text': text, 'parse_mode': 'HTML'}
+        for text in split_lines(
+            f"🔔 <b>Статус изменен у {len(orders)} заказов</b>\nНовый статус: <b>{status_display}</b>",
+            [f"№{order.id} - {order.user.username}" for order in orders],
+        )
+    ]
+
+    orders_by_chat = {}
+    for order in orders:
+        telegram_id = order.user.profile.telegram_id
+        if telegram_id:
+            orders_by_chat.setdefault(telegram_id, []).append(order.id)
+    for telegram_id, ids in orders_by_chat.items():
+        if len(ids) == 1:
+            header = f"🔔 <b>Статус вашего заказа №{ids[0]} изменен</b>"
+        else:
+            header = "🔔 <b>Статус ваших заказов изменен</b>\nЗаказы: " + ', '.join(f'№{pk}' for pk in ids)
+        messages.append({
+            'chat_id': telegram_id,
+            'text': f"{header}\nНовый статус: <b>{status_display}</b>",
+            'parse_mode': 'HTML',
+        })
+    return messages
+
+
+async def send_status_change_batch(payload):
+    """Уведомляем об изменении статуса сразу многих заказов с ограничением скорости"""
+    order_ids = [order_id for order_id, _ in payload['orders']]
+    messages = await sync_to_async(get_status_change_batch_messages)(order_ids, payload['status'])
+    remaining = await notifier.broadcast(messages)
+    if remaining:
+        raise PartialDeliveryError(remaining)
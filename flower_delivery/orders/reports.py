@@ -0,0 +1,105 @@
+# orders/reports.py
+
+import csv
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from .models import Order, DailySalesRollup
+
+# Группировки отчета по продажам
+GROUP_CHOICES = [
+    ('day', 'По дням'),
+    ('week', 'По неделям'),
+    ('month', 'По месяцам'),
+]
+
+# Размер блока при потоковой выгрузке строк из базы
+CSV_CHUNK_SIZE = 500
+
+
+def period_expression(group):
+    """Начало периода, к которому относится день сводки"""
+    if group == 'week':
+        return TruncWeek('date')
+    if group == 'month':
+        return TruncMonth('date')
+    return F('date')
+
+
+def sales_rows(date_from=None, date_to=None, group='day', by_status=False, before=None):
+    """
+    Строки отчета из сводки продаж, от новых периодов к старым.
+
+    before - начало периода, после которого продолжается предыдущая страница.
+    Периоды идут подряд, поэтому условие по дате сводки равносильно условию
+    по началу периода и использует индекс по дате.
+    """
+    rows = DailySalesRollup.objects.all()
+    if date_from:
+        rows = rows.filter(date__gte=date_from)
+    if date_to:
+        rows = rows.filter(date__lte=date_to)
+    if before:
+        rows = rows.filter(date__lt=before)
+    fields = ['period', 'status'] if by_status else ['period']
+    return (
+        rows.annotate(period=period_expression(group))
+        .values(*fields)
+        .annotate(total_orders=Sum('order_count'), total_revenue=Sum('revenue'))
+        .filter(total_orders__gt=0)
+        .order_by('-period', *fields[1:])
+    )
+
+
+def sales_page(date_from=None, date_to=None, group='day', by_status=False, before=None, page_size=30):
+    """
+    Страница отчета с пагинацией по ключу.
+
+    Возвращает список периодов и начало последнего из них для ссылки на
+    следующую страницу (None, если страница последняя). При разбивке по статусам
+    у каждого периода есть список statuses в порядке Order.STATUS_CHOICES
+    (None для статусов без заказов).
+    """
+    periods = list(sales_rows(date_from, date_to, group, before=before)[:page_size + 1])
+    next_before = periods[page_size - 1]['period'] if len(periods) > page_size else None
+    periods = periods[:page_size]
+    if by_status and periods:
+        # Разбивка только для периодов текущей страницы, одним запросом
+        statuses = sales_rows(date_from, date_to, group, by_status=True, before=before).filter(
+            period__gte=periods[-1]['period']
+        )
+        by_period = {}
+        for row in statuses:
+            by_period.setdefault(row['period'], {})[row['status']] = row
+        for period in periods:
+            rows = by_period.get(period['period'], {})
+            period['statuses'] = [rows.get(status) for status, _ in Order.STATUS_CHOICES]
+    return periods, next_before
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def sales_csv(date_from=None, date_to=None, group='day', by_status=False):
+    """
+    Строки отчета в формате CSV для StreamingHttpResponse.
+
+    Строки читаются из базы итератором блоками, поэтому выгрузка за годы
+    занимает постоянный объем памяти.
+    """
+    writer = csv.writer(Echo())
+    status_display = dict(Order.STATUS_CHOICES)
+    header = ['Период', 'Статус', 'Количество заказов', 'Выручка'] if by_status else \
+        ['Период', 'Количество заказов', 'Выручка']
+    # BOM, чтобы Excel распознал кодировку UTF-8
+    yield '\ufeff' + writer.writerow(header)
+    rows = sales_rows(date_from, date_to, group, by_status)
+    for row in rows.iterator(chunk_size=CSV_CHUNK_SIZE):
+        values = [row['period'].isoformat()]
+        if by_status:
+            values.append(status_display.get(row['status'], row['status']))
+        values += [row['total_orders'], '{:.2f}'.format(row['total_revenue'])]
+        yield writer.writerow(values)
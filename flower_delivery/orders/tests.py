@@ -2,16 +2,34 @@
 
 from django.test import TestCase
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, AnonymousUser
 from products.models import Product
-from .models import Order, OrderItem
+from .models import Order, OrderItem, DailySalesRollup, CartItem
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from decimal import Decimal
 from unittest.mock import patch
-from datetime import datetime, time
+from datetime import datetime, time, date, timedelta
+from django.utils import timezone
+from types import SimpleNamespace
+from io import BytesIO, StringIO
+from asgiref.sync import async_to_sync
+from aiogram.types import BufferedInputFile, FSInputFile
+from django.test import override_settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from .notifications import send_order_notification, send_status_change_batch
+from telegram_bot.models import NotificationOutbox
+from telegram_bot.notifier import Notifier
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from .cart import Cart, CartLine, load_lines, SessionCartStore, DatabaseCartStore, get_cart_count
+from flower_delivery.testing import QueryPlanMixin, TemporaryMediaMixin
+import shutil
+import tempfile
 
 
-class CartTest(TestCase):
+class CartTest(TemporaryMediaMixin, TestCase):
     def setUp(self):
         # Создаём пользователя
         self.user = User.objects.create_user(username='testuser', password='TestPassword123')
@@ -29,11 +47,10 @@ class CartTest(TestCase):
         response = self.client.post(reverse('cart_add', args=[self.product.id]))
         self.assertRedirects(response, reverse('product_list'))
         # Проверяем, что товар добавлен в сессию
-        cart = self.client.session.get('cart')
-        self.assertIsNotNone(cart)
-        self.assertIn(str(self.product.id), cart)
-        self.assertEqual(cart[str(self.product.id)]['quantity'], 1)
-        self.assertEqual(float(cart[str(self.product.id)]['price']), self.product.price)
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertIn(self.product.id, cart)
+        self.assertEqual(cart[self.product.id].quantity, 1)
+        self.assertEqual(float(cart[self.product.id].price), self.product.price)
 
     def test_cart_remove(self):
         """
@@ -45,11 +62,334 @@ class CartTest(TestCase):
         response = self.client.post(reverse('cart_remove', args=[self.product.id]))
         self.assertRedirects(response, reverse('cart_detail'))
         # Проверяем, что корзина пуста
-        cart = self.client.session.get('cart')
-        self.assertNotIn(str(self.product.id), cart)
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertNotIn(self.product.id, cart)
+
+    def test_cart_add_json(self):
+        """
+        AJAX-запрос на добавление получает сводку корзины вместо перенаправления на каталог.
+        """
+        for quantity in (1, 2):
+            response = self.client.post(
+                reverse('cart_add', args=[self.product.id]), {'quantity': quantity},
+                headers={'x-requested-with': 'XMLHttpRequest'},
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['total_price'], '5999.97')
+        self.assertEqual(data['lines'], [
+            {'product_id': self.product.id, 'quantity': 3, 'price': '1999.99', 'total_price': '5999.97'},
+        ])
+        self.assertEqual(data['message'], 'Товар "Тестовый Букет" добавлен в корзину.')
+        # Сообщение не откладывается до следующей загрузки страницы
+        self.assertNotContains(self.client.get(reverse('cart_detail')), 'добавлен в корзину')
+
+    def test_cart_add_unavailable_json(self):
+        """
+        Недоступный товар не добавляется, AJAX-клиент получает ошибку с кодом 400.
+        """
+        Product.objects.filter(pk=self.product.pk).update(available=False)
+        response = self.client.post(
+            reverse('cart_add', args=[self.product.id]), headers={'accept': 'application/json'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], ['Извините, этот товар недоступен для заказа.'])
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_cart_remove_json(self):
+        """
+        AJAX-запрос на удаление возвращает обновленную сводку корзины.
+        """
+        other = Product.objects.create(name='Другой букет', price=100)
+        self.client.post(reverse('cart_add', args=[self.product.id]))
+        self.client.post(reverse('cart_add', args=[other.id]))
+        response = self.client.post(
+            reverse('cart_remove', args=[self.product.id]), headers={'accept': 'application/json'},
+        )
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual([line['product_id'] for line in data['lines']], [other.id])
+        self.assertEqual(data['total_price'], '100.00')
+
+    def test_cart_script_on_catalog(self):
+        """
+        Каталог подключает скрипт корзины и помечает формы добавления для него.
+        """
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'js/cart.js')
+        self.assertContains(response, 'data-cart-add')
+        self.assertContains(response, 'data-cart-count')
+
+
+class CartCacheTest(TestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'Букет {i}', price=Decimal('10.50') * (i + 1)) for i in range(3)]
+        self.request = SimpleNamespace(session=SessionStore())
+        Cart(self.request).add_many((product, 2) for product in self.products)
+
+    def test_products_are_loaded_once_per_request(self):
+        """
+        Повторный перебор корзины и подсчет суммы не обращаются к базе повторно.
+        """
+        cart = Cart(self.request)
+        with self.assertNumQueries(1):
+            items = list(cart)
+            list(cart)
+            total = cart.get_total_price()
+        self.assertEqual(total, Decimal('126.00'))
+        self.assertIsInstance(items[0].price, Decimal)
+        self.assertEqual(items[2].total_price, Decimal('63.00'))
+
+    def test_mutation_invalidates_cache(self):
+        """
+        Изменение корзины пересчитывает строки без повторной загрузки уже известных продуктов.
+        """
+        cart = Cart(self.request)
+        list(cart)
+        with self.assertNumQueries(0):
+            cart.add(self.products[0], quantity=5, override_quantity=True)
+            cart.remove(self.products[1])
+            self.assertEqual(cart.get_total_price(), Decimal('115.50'))
+            self.assertEqual([item.product for item in cart], [self.products[0], self.products[2]])
+
+    def test_deleted_product_is_skipped(self):
+        """
+        Удаленный из каталога продукт не попадает в строки корзины.
+        """
+        self.products[1].delete()
+        cart = Cart(self.request)
+        self.assertEqual(len(list(cart)), 2)
+        self.assertEqual(cart.get_total_price(), Decimal('84.00'))
+        # Счетчик товаров совпадает со строками корзины, в том числе сохраненный для меню
+        self.assertEqual(len(cart), sum(line.quantity for line in cart))
+        self.assertEqual(SessionCartStore(self.request.session).count(), len(cart))
+
+
+class CartSessionFormatTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Букет', price=Decimal('1999.99'))
+        self.request = SimpleNamespace(session=SessionStore())
+
+    def test_compact_session_format(self):
+        """
+        В сессии корзина хранится списком [id, количество, цена в копейках].
+        """
+        Cart(self.request).add(self.product, quantity=3)
+        self.assertEqual(self.request.session['cart'], [[self.product.id, 3, 199999]])
+        line = Cart(self.request).lines[self.product.id]
+        self.assertIsInstance(line, CartLine)
+        self.assertEqual(line.price, Decimal('1999.99'))
+        self.assertEqual(line.total_price, Decimal('5999.97'))
+        with self.assertRaises(AttributeError):
+            line.extra = 1  # Строка корзины использует __slots__
+
+    def test_session_is_written_only_on_change(self):
+        """
+        Чтение корзины и изменение без результата не записывают сессию.
+        """
+        cart = Cart(self.request)
+        list(cart)
+        self.assertFalse(self.request.session.modified)
+        self.assertNotIn('cart', self.request.session)
+
+        cart.add(self.product, quantity=2)
+        self.request.session.modified = False
+        cart.add(self.product, quantity=2, override_quantity=True)
+        cart.remove(Product(id=self.product.id + 1))
+        self.assertFalse(self.request.session.modified)
+
+    def test_iteration_does_not_mutate_session(self):
+        """
+        Перебор корзины не добавляет в данные сессии объекты продуктов.
+        """
+        Cart(self.request).add(self.product)
+        cart = Cart(self.request)
+        list(cart)
+        self.assertEqual(self.request.session['cart'], [[self.product.id, 1, 199999]])
+
+    def test_legacy_session_format_is_loaded(self):
+        """
+        Корзина в прежнем формате словаря читается и пересохраняется в компактном.
+        """
+        self.request.session['cart'] = {str(self.product.id): {'quantity': 2, 'price': '1999.99'}}
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_total_price(), Decimal('3999.98'))
+        cart.add(self.product)
+        self.assertEqual(self.request.session['cart'], [[self.product.id, 3, 199999]])
+
+
+@override_settings(CART_STORE='orders.cart.DatabaseCartStore')
+class DatabaseCartStoreTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.product1 = Product.objects.create(name='Букет 1', price=Decimal('1000.00'))
+        self.product2 = Product.objects.create(name='Букет 2', price=Decimal('1500.50'))
+        self.request = SimpleNamespace(session=SessionStore(), user=self.user)
+
+    def test_lines_are_stored_in_database(self):
+        """
+        Корзина авторизованного пользователя хранится в CartItem, сессия не меняется.
+        """
+        cart = Cart(self.request)
+        self.assertIsInstance(cart.store, DatabaseCartStore)
+        cart.add(self.product1, quantity=2)
+        cart.add(self.product2)
+        self.assertFalse(self.request.session.modified)
+        self.assertEqual(
+            list(CartItem.objects.order_by('id').values_list('product_id', 'quantity', 'price_cents')),
+            [(self.product1.id, 2, 100000), (self.product2.id, 1, 150050)],
+        )
+        # Корзина доступна в новом запросе с другой сессией
+        cart = Cart(SimpleNamespace(session=SessionStore(), user=self.user))
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(cart.get_total_price(), Decimal('3500.50'))
+
+    def test_change_is_single_row_upsert(self):
+        """
+        Изменение количества - один запрос upsert, загрузка корзины с продуктами - один запрос.
+        """
+        Cart(self.request).add_many([(self.product1, 1), (self.product2, 1)])
+        with CaptureQueriesContext(connection) as queries:
+            cart = Cart(self.request)
+            cart.add(self.product1, quantity=5, override_quantity=True)
+            list(cart)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('ON CONFLICT', queries[1]['sql'])
+        self.assertEqual(CartItem.objects.get(product=self.product1).quantity, 5)
+        self.assertEqual(CartItem.objects.get(product=self.product2).quantity, 1)
+
+    def test_cart_add_ignores_non_positive_quantity(self):
+        """
+        Отрицательное количество при добавлении не попадает в CartItem, добавляется 1 штука.
+        """
+        self.client.login(username='testuser', password='TestPassword123')
+        for quantity in (-5, 0):
+            self.client.post(reverse('cart_add', args=[self.product1.id]), {'quantity': quantity})
+        self.assertEqual(CartItem.objects.get(user=self.user, product=self.product1).quantity, 2)
+
+    def test_remove_update_and_clear(self):
+        """
+        Удаление и обнуление количества удаляют строки, очистка удаляет корзину пользователя.
+        """
+        other = User.objects.create_user(username='other', password='TestPassword123')
+        Cart(SimpleNamespace(session=SessionStore(), user=other)).add(self.product1)
+        cart = Cart(self.request)
+        cart.add_many([(self.product1, 1), (self.product2, 3)])
+        cart.remove(self.product1)
+        self.assertFalse(CartItem.objects.filter(user=self.user, product=self.product1).exists())
+        cart.update_many({self.product2.id: 0})
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+        cart.add(self.product2)
+        Cart(self.request).clear()
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+        self.assertTrue(CartItem.objects.filter(user=other).exists())
+
+    def test_anonymous_cart_stays_in_session(self):
+        """
+        Анонимная корзина хранится в сессии даже при хранилище в базе.
+        """
+        request = SimpleNamespace(session=SessionStore(), user=AnonymousUser())
+        cart = Cart(request)
+        self.assertIsInstance(cart.store, SessionCartStore)
+        cart.add(self.product1)
+        self.assertEqual(request.session['cart'], [[self.product1.id, 1, 100000]])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_session_cart_is_merged_on_login(self):
+        """
+        При входе корзина из сессии добавляется к корзине пользователя, количества складываются.
+        """
+        Cart(self.request).add(self.product1, quantity=2)
+        session = self.client.session
+        session['cart'] = [
+            [self.product1.id, 1, 90000],
+            [self.product2.id, 2, 150050],
+            [self.product2.id + 100, 1, 100],  # Продукт удален из каталога
+        ]
+        session.save()
+
+        self.client.login(username='testuser', password='TestPassword123')
+        self.assertNotIn('cart', self.client.session)
+        self.assertEqual(
+            list(CartItem.objects.order_by('id').values_list('product_id', 'quantity', 'price_cents')),
+            [(self.product1.id, 3, 100000), (self.product2.id, 2, 150050)],
+        )
+        self.assertEqual(Cart(self.request).get_total_price(), Decimal('6001.00'))
+
+    @override_settings(CART_STORE='orders.cart.SessionCartStore')
+    def test_session_store_keeps_cart_on_login(self):
+        """
+        С сессионным хранилищем корзина после входа остается в сессии.
+        """
+        session = self.client.session
+        session['cart'] = [[self.product1.id, 1, 100000]]
+        session.save()
+        self.client.login(username='testuser', password='TestPassword123')
+        self.assertEqual(self.client.session['cart'], [[self.product1.id, 1, 100000]])
+        self.assertFalse(CartItem.objects.exists())
 
 
-class CartUpdateTest(TestCase):
+class CartCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.product1 = Product.objects.create(name='Букет 1', price=Decimal('1000.00'))
+        self.product2 = Product.objects.create(name='Букет 2', price=Decimal('500.00'))
+
+    def test_count_is_stored_with_cart(self):
+        """
+        Изменения корзины обновляют количество товаров в сессии, очистка его удаляет.
+        """
+        request = SimpleNamespace(session=SessionStore())
+        cart = Cart(request)
+        cart.add_many([(self.product1, 3), (self.product2, 1)])
+        self.assertEqual(request.session['cart_count'], 4)
+        cart.update_many({self.product1.id: 1})
+        self.assertEqual(request.session['cart_count'], 2)
+        cart.clear()
+        self.assertNotIn('cart_count', request.session)
+
+    def test_legacy_cart_without_count(self):
+        """
+        Для корзины, сохраненной без счетчика, количество считается по строкам.
+        """
+        session = SessionStore()
+        session['cart'] = [[self.product1.id, 2, 100000], [self.product2.id, 5, 50000]]
+        self.assertEqual(SessionCartStore(session).count(), 7)
+
+    def test_badge_shows_units(self):
+        """
+        Счетчик в меню показывает количество единиц товара, а не число строк.
+        """
+        self.client.post(reverse('cart_add', args=[self.product1.id]), {'quantity': 3})
+        response = self.client.get(reverse('login'))
+        self.assertContains(response, '<span data-cart-count>3</span>', html=True)
+
+    def test_anonymous_visitor_does_not_touch_sessions(self):
+        """
+        Посетитель без сессии получает пустой счетчик без обращения к хранилищу сессий.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('login'))
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+        self.assertContains(response, '<span data-cart-count>0</span>', html=True)
+        self.assertEqual(get_cart_count(SimpleNamespace(COOKIES={}, session=None)), 0)
+
+    @override_settings(CART_STORE='orders.cart.DatabaseCartStore')
+    def test_database_store_count(self):
+        """
+        Для корзины в базе количество считается одним агрегирующим запросом.
+        """
+        Cart(SimpleNamespace(session=SessionStore(), user=self.user)).add_many([(self.product1, 2), (self.product2, 3)])
+        self.client.login(username='testuser', password='TestPassword123')
+        cookies = {name: morsel.value for name, morsel in self.client.cookies.items()}
+        request = SimpleNamespace(COOKIES=cookies, session=self.client.session, user=self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cart_count(request), 5)
+
+
+class CartUpdateTest(TemporaryMediaMixin, TestCase):
     def setUp(self):
         # Создаём пользователя
         self.user = User.objects.create_user(username='testuser', password='TestPassword123')
@@ -77,9 +417,9 @@ class CartUpdateTest(TestCase):
             f'quantity_{self.product2.id}': 2,
         })
         self.assertRedirects(response, reverse('cart_detail'))
-        cart = self.client.session.get('cart')
-        self.assertEqual(cart[str(self.product1.id)]['quantity'], 3)
-        self.assertEqual(cart[str(self.product2.id)]['quantity'], 2)
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertEqual(cart[self.product1.id].quantity, 3)
+        self.assertEqual(cart[self.product2.id].quantity, 2)
 
     def test_cart_update_decrease_quantity(self):
         """
@@ -90,9 +430,9 @@ class CartUpdateTest(TestCase):
             f'quantity_{self.product2.id}': 1,
         })
         self.assertRedirects(response, reverse('cart_detail'))
-        cart = self.client.session.get('cart')
-        self.assertEqual(cart[str(self.product1.id)]['quantity'], 1)
-        self.assertEqual(cart[str(self.product2.id)]['quantity'], 1)
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertEqual(cart[self.product1.id].quantity, 1)
+        self.assertEqual(cart[self.product2.id].quantity, 1)
 
     def test_cart_update_remove_item_when_zero(self):
         """
@@ -103,9 +443,9 @@ class CartUpdateTest(TestCase):
             f'quantity_{self.product2.id}': 2,
         })
         self.assertRedirects(response, reverse('cart_detail'))
-        cart = self.client.session.get('cart')
-        self.assertNotIn(str(self.product1.id), cart)
-        self.assertEqual(cart[str(self.product2.id)]['quantity'], 2)
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertNotIn(self.product1.id, cart)
+        self.assertEqual(cart[self.product2.id].quantity, 2)
 
     def test_cart_update_invalid_quantity(self):
         """
@@ -119,13 +459,53 @@ class CartUpdateTest(TestCase):
         messages = list(response.wsgi_request._messages)
         self.assertTrue(any('Введите корректное количество для товара' in str(message) for message in messages))
         # Проверяем, что количество товара1 не изменилось
-        cart = self.client.session.get('cart')
-        self.assertEqual(cart[str(self.product1.id)]['quantity'], 1)  # Изначально было 1
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertEqual(cart[self.product1.id].quantity, 1)  # Изначально было 1
         # Товар2 должен быть удален, т.к. количество -1
-        self.assertNotIn(str(self.product2.id), cart)
+        self.assertNotIn(self.product2.id, cart)
+
+
+    def test_cart_update_json_summary(self):
+        """
+        AJAX-клиент получает сводку корзины в JSON вместо перенаправления.
+        """
+        response = self.client.post(reverse('cart_update'), {
+            f'quantity_{self.product1.id}': 3,
+            f'quantity_{self.product2.id}': 0,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(Decimal(data['total_price']), Decimal(str(self.product1.price)) * 3)
+        self.assertEqual([line['product_id'] for line in data['lines']], [self.product1.id])
+        self.assertEqual(data['lines'][0]['quantity'], 3)
+        self.assertEqual(data['errors'], [])
+
+    def test_cart_update_json_reports_invalid_quantity(self):
+        """
+        Некорректное количество возвращается в списке ошибок со статусом 400.
+        """
+        response = self.client.post(reverse('cart_update'), {
+            f'quantity_{self.product1.id}': 'invalid',
+        }, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 1)
+
+    def test_cart_update_writes_session_once(self):
+        """
+        Изменение нескольких строк записывает сессию одним запросом и не загружает продукты.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('cart_update'), {
+                f'quantity_{self.product1.id}': 5,
+                f'quantity_{self.product2.id}': 4,
+            })
+        sql = [query['sql'] for query in queries]
+        self.assertEqual(len([q for q in sql if q.startswith('UPDATE "django_session"')]), 1)
+        self.assertFalse([q for q in sql if 'products_product' in q])
 
 
-class OrderCreateTest(TestCase):
+class OrderCreateTest(TemporaryMediaMixin, TestCase):
     def setUp(self):
         # Создаём пользователя и логинимся
         self.user = User.objects.create_user(username='testuser', password='TestPassword123')
@@ -139,8 +519,7 @@ class OrderCreateTest(TestCase):
         # Добавляем товар в корзину
         self.client.post(reverse('cart_add', args=[self.product.id]))
 
-    @patch('orders.views.send_order_notification')  # Мокаем функцию отправки уведомления
-    def test_order_create_get(self, mock_send_notification):
+    def test_order_create_get(self):
         """
         Проверяем доступность страницы оформления заказа.
         """
@@ -148,8 +527,7 @@ class OrderCreateTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'orders/order_create.html')
 
-    @patch('orders.views.send_order_notification')  # Мокаем функцию отправки уведомления
-    def test_order_create_post(self, mock_send_notification):
+    def test_order_create_post(self):
         """
         Проверяем процесс создания заказа.
         """
@@ -185,22 +563,44 @@ class OrderCreateTest(TestCase):
         cart = self.client.session.get('cart')
         self.assertIsNone(cart)
 
-        # Проверяем, что функция отправки уведомления была вызвана
-        mock_send_notification.assert_called_once_with(order)
+        # Проверяем, что уведомление поставлено в очередь, а не отправлено в запросе
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.kind, 'order_created')
+        self.assertEqual(notification.payload, {'order_id': order.id})
+        self.assertEqual(notification.status, 'pending')
+
+    def test_order_create_enqueues_notification(self):
+        """
+        Оформление заказа ставит уведомление в очередь вместо отправки в Telegram.
+        """
+        with patch('orders.notifications.notifier') as mock_notifier, \
+                patch('orders.views.datetime') as mock_datetime:
+            # Заказы принимаются не в любое время суток: фиксируем рабочее время
+            mock_datetime.now.return_value = datetime(2024, 1, 1, 12, 0)
+            self.client.post(reverse('order_create'), {
+                'address': 'Test Address 123',
+                'phone': '1234567890',
+                'delivery_date': '2024-12-25',
+                'delivery_time': '14:30',
+            })
+        self.assertFalse(mock_notifier.mock_calls)
+        order = Order.objects.get(user=self.user)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.kind, 'order_created')
+        self.assertEqual(notification.payload, {'order_id': order.id})
 
-    @patch('orders.views.send_order_notification')  # Мокаем функцию отправки уведомления
-    def test_order_create_redirect_if_cart_empty(self, mock_send_notification):
+    def test_order_create_redirect_if_cart_empty(self):
         """
         Проверяем, что при пустой корзине происходит редирект на страницу каталога.
         """
         # Очистка корзины
         session = self.client.session
-        session['cart'] = {}
+        session['cart'] = []
         session.save()
         response = self.client.get(reverse('order_create'))
         self.assertRedirects(response, reverse('product_list'))
-        # Проверяем, что функция отправки уведомления не была вызвана
-        mock_send_notification.assert_not_called()
+        # Проверяем, что уведомление не поставлено в очередь
+        self.assertFalse(NotificationOutbox.objects.exists())
 
     def test_order_create_time_restriction(self):
         """
@@ -239,7 +639,64 @@ class OrderCreateTest(TestCase):
             self.assertFalse(Order.objects.filter(user=self.user).exists())
 
 
-class OrderStatusTest(TestCase):
+class AtomicCheckoutTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.client.login(username='testuser', password='TestPassword123')
+        self.form_data = {
+            'address': 'Test Address 123',
+            'phone': '1234567890',
+            'delivery_date': '2024-12-25',
+            'delivery_time': '14:30',
+        }
+
+    def fill_cart(self, size):
+        session = self.client.session
+        # Файлы изображений не нужны: продукты создаются без загрузки в media/
+        products = Product.objects.bulk_create(
+            Product(name=f'Букет {i}', price=Decimal('100.50'), image='products/test_image.jpg') for i in range(size)
+        )
+        session['cart'] = [[product.id, 2, 10050] for product in products]
+        session.save()
+
+    def checkout(self):
+        with patch('orders.views.datetime') as mock_datetime:
+            mock_datetime.now.return_value = datetime(2024, 1, 1, 12, 0)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('order_create'), self.form_data)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_checkout_query_count_does_not_depend_on_cart_size(self):
+        """
+        Оформление заказа выполняет одинаковое число запросов для корзины из 1 и 25 товаров.
+        """
+        self.fill_cart(1)
+        small_cart_queries = self.checkout()
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+
+        self.fill_cart(25)
+        large_cart_queries = self.checkout()
+        self.assertEqual(small_cart_queries, large_cart_queries)
+
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 25)
+        self.assertEqual(order.total_price, Decimal('5025.00'))
+
+    def test_checkout_is_atomic(self):
+        """
+        Ошибка при записи позиций откатывает и сам заказ.
+        """
+        self.fill_cart(3)
+        with patch('orders.views.OrderItem.objects.bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+
+class OrderStatusTest(TemporaryMediaMixin, TestCase):
     def setUp(self):
         # Создаём пользователя и логинимся
         self.user = User.objects.create_user(username='testuser', password='TestPassword123')
@@ -267,8 +724,7 @@ class OrderStatusTest(TestCase):
             quantity=1
         )
 
-    @patch('orders.models.send_status_change_notification')  # Мокаем функцию отправки уведомления
-    def test_admin_can_change_order_status(self, mock_send_status_notification):
+    def test_admin_can_change_order_status(self):
         """
         Проверяем, что администратор может изменять статус заказа.
         """
@@ -303,8 +759,365 @@ class OrderStatusTest(TestCase):
         self.assertEqual(self.order.status, 'accepted')  # Проверяем, что статус изменился
         self.assertEqual(response.status_code, 200)
 
-        # Проверяем, что функция отправки уведомления была вызвана
-        mock_send_status_notification.assert_called_once_with(self.order)
+        # Проверяем, что уведомление о смене статуса поставлено в очередь
+        notification = NotificationOutbox.objects.get(kind='order_status_changed')
+        self.assertEqual(notification.payload, {'order_id': self.order.id, 'status': 'accepted'})
+
+    def test_status_change_rolls_back_with_notification(self):
+        """
+        Уведомление не остается в очереди, если транзакция со сменой статуса откатилась.
+        """
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.order.status = 'accepted'
+                self.order.save()
+                raise RuntimeError
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_save_without_status_change_does_not_notify(self):
+        """
+        Сохранение заказа без смены статуса не создает уведомление.
+        """
+        self.order.address = 'New Address'
+        self.order.save()
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+
+class BulkStatusTransitionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.user.profile.telegram_id = '555'
+        self.user.profile.save()
+        self.other_user = User.objects.create_user(username='otheruser', password='TestPassword123')
+        self.admin_user = User.objects.create_superuser(username='admin', password='AdminPassword123',
+                                                        email='admin@example.com')
+        self.orders = [
+            Order.objects.create(user=self.user, total_price=100, address='Address', phone='123'),
+            Order.objects.create(user=self.user, total_price=200, address='Address', phone='123'),
+            Order.objects.create(user=self.other_user, total_price=300, address='Address', phone='123'),
+        ]
+
+    def test_transition_updates_orders_and_enqueues_one_batch(self):
+        """
+        Массовая смена статуса обновляет все заказы и ставит в очередь одно уведомление.
+        """
+        self.orders[0].transition_to('accepted')
+        NotificationOutbox.objects.all().delete()
+
+        changed = Order.objects.all().transition('accepted')
+
+        self.assertEqual(changed, [(self.orders[1].id, 'pending'), (self.orders[2].id, 'pending')])
+        self.assertEqual(Order.objects.filter(status='accepted').count(), 3)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.kind, 'order_status_changed_batch')
+        self.assertEqual(notification.payload, {
+            'status': 'accepted',
+            'orders': [[self.orders[1].id, 'pending'], [self.orders[2].id, 'pending']],
+        })
+        # Повторный переход ничего не меняет и не создает уведомлений
+        self.assertEqual(Order.objects.all().transition('accepted'), [])
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+    def test_admin_action_uses_bulk_transition(self):
+        """
+        Действие администратора меняет статус выбранных заказов одной пачкой.
+        """
+        self.client.login(username='admin', password='AdminPassword123')
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': 'mark_as_in_delivery',
+            '_selected_action': [order.id for order in self.orders],
+        }, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.filter(status='in_delivery').count(), 3)
+        self.assertEqual(NotificationOutbox.objects.get().kind, 'order_status_changed_batch')
+
+    @override_settings(ADMIN_TELEGRAM_ID='1', TELEGRAM_GLOBAL_RATE=1000)
+    def test_batch_notification_groups_messages_per_chat(self):
+        """
+        Администратор получает сводку, покупатель - одно сообщение на все свои заказы.
+        """
+        FakeBot.calls = []
+        changed = Order.objects.all().transition('completed')
+        payload = NotificationOutbox.objects.get().payload
+
+        with patch('orders.notifications.notifier', Notifier(bot=FakeBot())):
+            with CaptureQueriesContext(connection) as queries:
+                async_to_sync(send_status_change_batch)(payload)
+
+        self.assertEqual(len(changed), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(FakeBot.calls), 2)
+        texts = [text for _, text in FakeBot.calls]
+        self.assertTrue(any('Статус изменен у 3 заказов' in text for text in texts))
+        customer_text = next(text for text in texts if 'ваших заказов' in text)
+        self.assertIn(f'№{self.orders[0].id}, №{self.orders[1].id}', customer_text)
+
+
+class OrderStatusTrackingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.order = Order.objects.create(
+            user=self.user,
+            total_price=1999.99,
+            address='Test Address 123',
+            phone='1234567890'
+        )
+
+    def test_save_does_not_reselect_status(self):
+        """
+        Сохранение загруженного заказа выполняет только UPDATE, без SELECT предыдущего статуса.
+        """
+        order = Order.objects.get(pk=self.order.pk)
+        order.address = 'New Address'
+        with self.assertNumQueries(1):
+            order.save()
+
+    def test_status_change_detected_from_snapshot(self):
+        """
+        Изменение статуса определяется по значению, загруженному из базы.
+        """
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'accepted'
+        # UPDATE заказа, UPDATE прежней и INSERT+UPDATE новой строки сводки продаж, INSERT уведомления
+        with self.assertNumQueries(5):
+            order.save()
+        self.assertEqual(NotificationOutbox.objects.get().payload['status'], 'accepted')
+        # Повторное сохранение без изменений не создает уведомление
+        order.save()
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+    def test_manually_constructed_instance_falls_back_to_query(self):
+        """
+        Для экземпляра, созданного без загрузки из базы, статус читается запросом.
+        """
+        order = Order(
+            pk=self.order.pk, user=self.user, status='in_progress', total_price=1,
+            address='A', phone='1', created_at=self.order.created_at
+        )
+        order.save()
+        self.assertEqual(NotificationOutbox.objects.get().payload['status'], 'in_progress')
+
+    def test_transition_to(self):
+        """
+        transition_to меняет статус и ставит уведомление в очередь.
+        """
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(order.transition_to('accepted'))
+        self.assertEqual(order.status, 'accepted')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'accepted')
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+        # Переход в тот же статус не выполняется
+        self.assertFalse(order.transition_to('accepted'))
+
+    def test_concurrent_transitions(self):
+        """
+        Из двух параллельных переходов из одного статуса выполняется только первый.
+        """
+        first = Order.objects.get(pk=self.order.pk)
+        second = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(first.transition_to('accepted'))
+        self.assertFalse(second.transition_to('canceled'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'accepted')
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+
+class DailySalesRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.admin_user = User.objects.create_superuser(username='admin', password='AdminPassword123',
+                                                        email='admin@example.com')
+
+    def create_order(self, total_price):
+        return Order.objects.create(user=self.user, total_price=total_price, address='Address', phone='123')
+
+    def rollup(self):
+        return {
+            row.status: (row.order_count, row.revenue)
+            for row in DailySalesRollup.objects.exclude(order_count=0, revenue=0)
+        }
+
+    def test_rollup_follows_order_changes(self):
+        """
+        Сводка обновляется при создании заказа, изменении суммы, статуса и удалении.
+        """
+        order = self.create_order(Decimal('100.00'))
+        self.create_order(Decimal('50.00'))
+        self.assertEqual(self.rollup(), {'pending': (2, Decimal('150.00'))})
+
+        order = Order.objects.get(pk=order.pk)
+        order.total_price = Decimal('120.00')
+        order.save()
+        self.assertEqual(self.rollup(), {'pending': (2, Decimal('170.00'))})
+
+        order.transition_to('canceled')
+        self.assertEqual(self.rollup(), {
+            'pending': (1, Decimal('50.00')),
+            'canceled': (1, Decimal('120.00')),
+        })
+
+        Order.objects.all().transition('completed')
+        self.assertEqual(self.rollup(), {'completed': (2, Decimal('170.00'))})
+
+        Order.objects.get(pk=order.pk).delete()
+        self.assertEqual(self.rollup(), {'completed': (1, Decimal('50.00'))})
+
+    def test_rollup_accepts_float_totals(self):
+        """
+        Сумма по умолчанию и сумма, заданная float, не ломают пересчет сводки.
+        """
+        order = Order.objects.create(user=self.user, address='Address', phone='123')
+        order.total_price = Decimal('100.00')
+        order.save()
+        self.assertEqual(self.rollup(), {'pending': (1, Decimal('100.00'))})
+
+        order.total_price = 80.5
+        order.save()
+        self.assertEqual(self.rollup(), {'pending': (1, Decimal('80.50'))})
+
+    def test_rebuild_matches_incremental_rollup(self):
+        """
+        Команда rebuild_sales_rollup восстанавливает те же значения, что и инкрементальные обновления.
+        """
+        for total in ('100.00', '200.00', '300.00'):
+            self.create_order(Decimal(total))
+        Order.objects.filter(total_price=300).transition('canceled')
+        expected = self.rollup()
+
+        DailySalesRollup.objects.all().delete()
+        call_command('rebuild_sales_rollup', stdout=StringIO())
+        self.assertEqual(self.rollup(), expected)
+
+    def test_sales_report_reads_rollup(self):
+        """
+        Отчет по продажам читает готовую сводку, число запросов не зависит от числа заказов.
+        """
+        self.client.login(username='admin', password='AdminPassword123')
+        self.create_order(Decimal('100.00'))
+        self.client.get(reverse('sales_report'))
+        with CaptureQueriesContext(connection) as few_orders:
+            self.client.get(reverse('sales_report'))
+
+        for _ in range(20):
+            self.create_order(Decimal('10.00'))
+        with CaptureQueriesContext(connection) as many_orders:
+            response = self.client.get(reverse('sales_report'))
+
+        self.assertEqual(len(few_orders), len(many_orders))
+        self.assertNotIn('orders_order', ' '.join(query['sql'] for query in many_orders))
+        row = response.context['sales_data'][0]
+        self.assertEqual(row['total_orders'], 21)
+        self.assertEqual(row['total_revenue'], Decimal('300.00'))
+
+
+class SalesReportTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser(username='admin', password='AdminPassword123', email='admin@example.com')
+        self.client.login(username='admin', password='AdminPassword123')
+        for day, status, count, revenue in [
+            (date(2024, 1, 30), 'completed', 2, '200.00'),
+            (date(2024, 1, 31), 'completed', 1, '100.00'),
+            (date(2024, 1, 31), 'canceled', 1, '50.00'),
+            (date(2024, 2, 1), 'completed', 3, '300.00'),
+            (date(2024, 2, 2), 'pending', 1, '10.00'),
+        ]:
+            DailySalesRollup.objects.create(date=day, status=status, order_count=count, revenue=Decimal(revenue))
+
+    def report(self, **params):
+        return self.client.get(reverse('sales_report'), params)
+
+    def test_date_range_filter(self):
+        """
+        Параметры from и to ограничивают отчет выбранными днями.
+        """
+        response = self.report(**{'from': '2024-01-31', 'to': '2024-02-01'})
+        periods = [row['period'] for row in response.context['sales_data']]
+        self.assertEqual(periods, [date(2024, 2, 1), date(2024, 1, 31)])
+        self.assertEqual(response.context['sales_data'][1]['total_orders'], 2)
+
+    @override_settings(SALES_REPORT_PAGE_SIZE=2)
+    def test_keyset_pagination(self):
+        """
+        Следующая страница продолжается с дня, на котором закончилась предыдущая.
+        """
+        response = self.report()
+        self.assertEqual(
+            [row['period'] for row in response.context['sales_data']], [date(2024, 2, 2), date(2024, 2, 1)]
+        )
+        self.assertEqual(response.context['next_query'], 'before=2024-02-01')
+
+        response = self.client.get(reverse('sales_report') + '?' + response.context['next_query'])
+        self.assertEqual(
+            [row['period'] for row in response.context['sales_data']], [date(2024, 1, 31), date(2024, 1, 30)]
+        )
+        self.assertIsNone(response.context['next_query'])
+
+    def test_month_grouping_with_status_breakdown(self):
+        """
+        Группировка по месяцам суммирует дни, разбивка по статусам идет в порядке STATUS_CHOICES.
+        """
+        response = self.report(group='month', by_status='1')
+        february, january = response.context['sales_data']
+        self.assertEqual(january['period'], date(2024, 1, 1))
+        self.assertEqual((january['total_orders'], january['total_revenue']), (4, Decimal('350.00')))
+        statuses = dict(zip([status for status, _ in Order.STATUS_CHOICES], january['statuses']))
+        self.assertEqual(statuses['completed']['total_orders'], 3)
+        self.assertEqual(statuses['canceled']['total_revenue'], Decimal('50.00'))
+        self.assertIsNone(statuses['pending'])
+        self.assertEqual(february['statuses'][0]['total_orders'], 1)
+
+    def test_empty_report_spans_all_columns(self):
+        """
+        Строка пустого отчета занимает все колонки, в том числе колонки статусов.
+        """
+        response = self.report(**{'from': '2025-01-01'})
+        self.assertContains(response, 'colspan="3"')
+        response = self.report(**{'from': '2025-01-01', 'by_status': '1'})
+        self.assertContains(response, f'colspan="{3 + len(Order.STATUS_CHOICES)}"')
+
+    def test_csv_export_is_streamed(self):
+        """
+        Выгрузка в CSV отдается потоком и учитывает фильтры отчета.
+        """
+        response = self.report(format='csv', by_status='1', to='2024-01-31')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], 'Период,Статус,Количество заказов,Выручка')
+        self.assertEqual(lines[1:], [
+            '2024-01-31,Отменен,1,50.00',
+            '2024-01-31,Выполнен,1,100.00',
+            '2024-01-30,Выполнен,2,200.00',
+        ])
+
+
+class OrderIndexTest(QueryPlanMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+
+    def test_orders_by_status_use_index(self):
+        """
+        Заказы в статусе (команда бота /orders) выбираются по индексу, без полного просмотра.
+        """
+        self.assertUsesIndex(
+            Order.objects.filter(status='pending').order_by('-created_at'), 'order_status_created_idx'
+        )
+
+    def test_user_orders_use_index(self):
+        """
+        История заказов пользователя выбирается по индексу в нужном порядке.
+        """
+        self.assertUsesIndex(self.user.orders.order_by('-created_at'), 'order_user_created_idx')
+
+    def test_orders_for_period_use_index(self):
+        """
+        Заказы за период выбираются по индексу на дате создания.
+        """
+        today = timezone.now()
+        self.assertUsesIndex(
+            Order.objects.filter(created_at__range=(today - timedelta(days=1), today)), 'order_created_idx'
+        )
 
 
 class OrderItemTest(TestCase):
@@ -345,4 +1158,106 @@ class OrderItemTest(TestCase):
         """
         expected_cost = Decimal('3999.98')
         actual_cost = Decimal(self.order_item.get_cost()).quantize(Decimal('0.01'))  # Преобразуем в Decimal перед quantize
-        self.assertEqual(actual_cost, expected_cost)
\ No newline at end of file
+        self.assertEqual(actual_cost, expected_cost)
+
+
+class FakeBot:
+    """
+    Заглушка Bot API: запоминает отправленные сообщения и возвращает file_id.
+    """
+    calls = []
+
+    def __init__(self):
+        self.session = SimpleNamespace(close=self.close)
+
+    async def close(self):
+        pass
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        FakeBot.calls.append(('send_photo', photo))
+        return SimpleNamespace(photo=[
+            SimpleNamespace(file_id='small-file-id'),
+            SimpleNamespace(file_id='large-file-id'),
+        ])
+
+    async def send_message(self, chat_id, text, **kwargs):
+        FakeBot.calls.append(('send_message', text))
+        return SimpleNamespace(photo=None)
+
+
+@patch('orders.notifications.notifier', Notifier(bot=FakeBot()))
+class TelegramPhotoCacheTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        FakeBot.calls = []
+
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.product = Product.objects.create(name='Тестовый Букет', price=1999.99, image=self.make_image())
+        self.order = Order.objects.create(
+            user=self.user, total_price=1999.99, address='Test Address 123', phone='1234567890'
+        )
+        OrderItem.objects.create(order=self.order, product=self.product, price=1999.99, quantity=1)
+
+    def make_image(self, color=(200, 30, 90)):
+        buffer = BytesIO()
+        Image.new('RGB', (1500, 1800), color).save(buffer, 'PNG')
+        return SimpleUploadedFile(name='flower.png', content=buffer.getvalue(), content_type='image/png')
+
+    def test_first_notification_uploads_downscaled_photo(self):
+        """
+        Первое уведомление загружает уменьшенную копию и сохраняет file_id.
+        """
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        method, photo = FakeBot.calls[0]
+        self.assertEqual(method, 'send_photo')
+        self.assertIsInstance(photo, FSInputFile)
+        self.assertIn('.960w.jpeg', str(photo.path))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.telegram_file_id, 'large-file-id')
+
+    def test_next_notification_reuses_file_id(self):
+        """
+        Повторные уведомления отправляют сохраненный file_id вместо файла.
+        """
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        self.assertEqual(FakeBot.calls[1], ('send_photo', 'large-file-id'))
+
+    def test_downscales_original_without_thumbnails(self):
+        """
+        Без миниатюр в Telegram уходит уменьшенная копия оригинала.
+        """
+        Product.objects.update(thumbnails={})
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        photo = FakeBot.calls[0][1]
+        self.assertIsInstance(photo, BufferedInputFile)
+        with Image.open(BytesIO(photo.data)) as image:
+            self.assertLessEqual(max(image.size), 1280)
+
+    def test_image_change_invalidates_file_id(self):
+        """
+        Смена изображения сбрасывает сохраненный file_id.
+        """
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        product = Product.objects.get(pk=self.product.pk)
+        product.image = self.make_image(color=(10, 120, 40))
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.telegram_file_id, '')
+
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        self.assertNotIsInstance(FakeBot.calls[1][1], str)
+
+    def test_text_notification_for_unreadable_image(self):
+        """
+        Если изображение не читается, отправляется текстовое уведомление.
+        """
+        product = Product.objects.get(pk=self.product.pk)
+        product.image = SimpleUploadedFile(name='broken.jpg', content=b'', content_type='image/jpeg')
+        product.save()
+        async_to_sync(send_order_notification)({'order_id': self.order.id})
+        self.assertEqual(FakeBot.calls[0][0], 'send_message')
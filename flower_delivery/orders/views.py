@@ -9,14 +9,14 @@ from django.contrib.auth.decorators import login_required
 from .forms import OrderCreateForm
 from django.contrib import messages
 from datetime import datetime, time
-from django.conf import settings
-from asgiref.sync import async_to_sync, sync_to_async
-from aiogram import Bot
-import os
-from aiogram.types import FSInputFile
+from decimal import Decimal
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncDay
+from django.db import transaction
+from telegram_bot.models import NotificationOutbox
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from .reports import GROUP_CHOICES, sales_page, sales_csv
 
 @login_required
 def order_create(request):
@@ -33,101 +33,89 @@ def order_create(request):
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
         if form.is_valid():
-            order = form.save(commit=False)
-            order.user = request.user
-            order.total_price = cart.get_total_price()
-            order.save()
-            for item in cart:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item['product'],
-                    price=item['price'],
-                    quantity=item['quantity']
+            # Один проход по корзине: из одних и тех же строк получаем и позиции, и сумму заказа
+            items = [
+                OrderItem(
+                    product=item.product,
+                    price=item.price,
+                    quantity=item.quantity
                 )
+                for item in cart
+            ]
+            with transaction.atomic():
+                order = form.save(commit=False)
+                order.user = request.user
+                order.total_price = sum((item.get_cost() for item in items), Decimal('0'))
+                order.save()
+                for item in items:
+                    item.order = order
+                OrderItem.objects.bulk_create(items)
+                # Уведомление отправит диспетчер очереди после фиксации транзакции
+                NotificationOutbox.enqueue('order_created', order_id=order.id)
             # Очистить корзину
             cart.clear()
             messages.success(request, f'Ваш заказ №{order.id} успешно оформлен!')
 
-            # Передаем order в send_order_notification
-            async_to_sync(send_order_notification)(order)
-
             return render(request, 'orders/order_created.html', {'order': order})
     else:
         form = OrderCreateForm()
     return render(request, 'orders/order_create.html', {'cart': cart, 'form': form})
 
 
-# Асинхронная функция для отправки уведомления
-async def send_order_notification(order):
-    try:
-        bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-
-        # Получаем необходимые данные из ORM в синхронном контексте
-        def get_order_data():
-            first_item = order.items.first()
-            product_image_path = first_item.product.image.path if first_item else None
-            text = (
-                f"🛍 <b>Новый заказ №{order.id}</b>\n"
-                f"👤 Пользователь: {order.user.username}\n"
-                f"💰 Сумма: {order.total_price} руб.\n"
-                f"📅 Дата и время заказа: {order.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-                f"📍 Адрес доставки: {order.address}\n"
-                f"📞 Телефон: {order.phone}\n"
-                f"📝 Комментарий: {order.comment or 'Нет'}"
-            )
-            return product_image_path, text
-
-        product_image_path, text = await sync_to_async(get_order_data)()
-
-        if product_image_path and os.path.exists(product_image_path):
-            photo = FSInputFile(product_image_path)
-            await bot.send_photo(
-                chat_id=settings.ADMIN_TELEGRAM_ID,
-                photo=photo,
-                caption=text,
-                parse_mode='HTML'
-            )
-        else:
-            await bot.send_message(
-                chat_id=settings.ADMIN_TELEGRAM_ID,
-                text=text,
-                parse_mode='HTML'
-            )
-        await bot.session.close()  # Закрываем сессию бота
-    except Exception as e:
-        print(f"Ошибка при отправке уведомления в Telegram: {e}")
+def _wants_json(request):
+    """Запрос отправлен AJAX-клиентом, который ждет JSON вместо перенаправления"""
+    return (
+        request.headers.get('x-requested-with') == 'XMLHttpRequest'
+        or 'application/json' in request.headers.get('accept', '')
+    )
 
 @require_POST
 def cart_add(request, product_id):
     cart = Cart(request)
     product = get_object_or_404(Product, id=product_id)
     if not product.available:
-        messages.error(request, 'Извините, этот товар недоступен для заказа.')
+        error = 'Извините, этот товар недоступен для заказа.'
+        if _wants_json(request):
+            return JsonResponse({**cart.summary(), 'errors': [error]}, status=400)
+        messages.error(request, error)
         return redirect('product_list')
     quantity = request.POST.get('quantity', 1)
     try:
-        quantity = int(quantity)
+        # Добавить можно только положительное количество: ноль и отрицательные значения считаем за 1
+        quantity = max(int(quantity), 1)
     except ValueError:
         quantity = 1
     cart.add(product=product, quantity=quantity)
-    messages.success(request, f'Товар "{product.name}" добавлен в корзину.')
+    message = f'Товар "{product.name}" добавлен в корзину.'
+    if _wants_json(request):
+        # AJAX-клиент обновляет счетчик и карточку товара на месте, без перехода на каталог
+        return JsonResponse({**cart.summary(), 'message': message, 'errors': []})
+    messages.success(request, message)
     return redirect('product_list')
 
 @require_POST
 def cart_update(request):
     cart = Cart(request)
-    for item in cart:
-        product_id = str(item['product'].id)
-        quantity = request.POST.get('quantity_' + product_id)
+    # Разбираем все количества за один проход по строкам корзины, без обращения к базе
+    quantities = {}
+    invalid = []
+    for product_id in cart.lines:
+        quantity = request.POST.get(f'quantity_{product_id}')
         if quantity:
             try:
-                quantity = int(quantity)
-                if quantity > 0:
-                    cart.add(product=item['product'], quantity=quantity, override_quantity=True)
-                else:
-                    cart.remove(item['product'])
+                quantities[product_id] = int(quantity)
             except ValueError:
-                messages.error(request, f'Введите корректное количество для товара {item["product"].name}')
+                invalid.append(product_id)
+    cart.update_many(quantities)
+
+    errors = [
+        f'Введите корректное количество для товара {item.product.name}'
+        for item in cart if item.product_id in invalid
+    ] if invalid else []
+    if _wants_json(request):
+        return JsonResponse({**cart.summary(), 'errors': errors}, status=400 if errors else 200)
+    for error in errors:
+        messages.error(request, error)
     messages.success(request, 'Корзина успешно обновлена.')
     return redirect('cart_detail')
 
@@ -135,19 +123,72 @@ def cart_remove(request, product_id):
     cart = Cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
-    messages.success(request, f'Товар "{product.name}" удален из корзины.')
+    message = f'Товар "{product.name}" удален из корзины.'
+    if _wants_json(request):
+        return JsonResponse({**cart.summary(), 'message': message, 'errors': []})
+    messages.success(request, message)
     return redirect('cart_detail')
 
 def cart_detail(request):
     cart = Cart(request)
     return render(request, 'orders/cart_detail.html', {'cart': cart})
 
+def _parse_report_date(value):
+    """Дата из параметра отчета в формате ГГГГ-ММ-ДД или None"""
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
 @staff_member_required
 def sales_report(request):
-    # Агрегируем данные по дням
-    sales_data = Order.objects.values(date=TruncDay('created_at')).annotate(
-        total_orders=Count('id'),
-        total_revenue=Sum('total_price')
-    ).order_by('-date')
-
-    return render(request, 'orders/sales_report.html', {'sales_data': sales_data})
\ No newline at end of file
+    # Отчет строится по готовой сводке по дням: объем работы не зависит от числа заказов за всю историю
+    date_from = _parse_report_date(request.GET.get('from'))
+    date_to = _parse_report_date(request.GET.get('to'))
+    group = request.GET.get('group')
+    if group not in dict(GROUP_CHOICES):
+        group = 'day'
+    by_status = request.GET.get('by_status') == '1'
+
+    if request.GET.get('format') == 'csv':
+        response = StreamingHttpResponse(
+            sales_csv(date_from, date_to, group, by_status),
+            content_type='text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = 'attachment; filename="sales_report.csv"'
+        return response
+
+    sales_data, next_before = sales_page(
+        date_from, date_to, group, by_status,
+        before=_parse_report_date(request.GET.get('before')),
+        page_size=settings.SALES_REPORT_PAGE_SIZE,
+    )
+
+    # Параметры фильтра для ссылок на первую и следующую страницы и на выгрузку
+    filters = request.GET.copy()
+    filters.pop('before', None)
+    filters.pop('format', None)
+    next_query = None
+    if next_before:
+        next_filters = filters.copy()
+        next_filters['before'] = next_before.isoformat()
+        next_query = next_filters.urlencode()
+    csv_filters = filters.copy()
+    csv_filters['format'] = 'csv'
+
+    return render(request, 'orders/sales_report.html', {
+        'sales_data': sales_data,
+        'date_from': date_from,
+        'date_to': date_to,
+        'group': group,
+        'group_choices': GROUP_CHOICES,
+        'by_status': by_status,
+        'status_choices': Order.STATUS_CHOICES,
+        # Период, количество и выручка, плюс колонка на каждый статус при разбивке
+        'column_count': 3 + (len(Order.STATUS_CHOICES) if by_status else 0),
+        'is_first_page': 'before' not in request.GET,
+        'first_query': filters.urlencode(),
+        'next_query': next_query,
+        'csv_query': csv_filters.urlencode(),
+    })
@@ -10,11 +10,12 @@ class ReviewAdmin(admin.ModelAdmin):
     actions = ['approve_reviews', 'reject_reviews']
 
     def approve_reviews(self, request, queryset):
-        queryset.update(is_active=True)
+        # set_active вместе с флагом обновляет счетчики рейтинга продуктов
+        queryset.set_active(True)
     approve_reviews.short_description = 'Одобрить выбранные отзывы'
 
     def reject_reviews(self, request, queryset):
-        queryset.update(is_active=False)
+        queryset.set_active(False)
     reject_reviews.short_description = 'Отклонить выбранные отзывы'
 
 admin.site.register(Product)
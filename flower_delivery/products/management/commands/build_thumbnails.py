@@ -0,0 +1,52 @@
+# products/management/commands/build_thumbnails.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.thumbnails import render_thumbnails, delete_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры изображений продуктов в нескольких процессах'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Количество процессов для обработки изображений',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить миниатюры и для продуктов, у которых они уже есть',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'image', 'thumbnails')
+        if not options['force']:
+            products = products.filter(thumbnails={})
+        products = {product.id: product for product in products}
+        if not products:
+            self.stdout.write('Нет изображений для обработки.')
+            return
+
+        built = failed = 0
+        # Обработка изображений загружает процессор, поэтому распределяем ее по процессам,
+        # а запись в базу остается в основном процессе
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(render_thumbnails, product.image.name, str(settings.MEDIA_ROOT)): product_id
+                for product_id, product in products.items()
+            }
+            for future in as_completed(futures):
+                product = products[futures[future]]
+                thumbnails = future.result()
+                if not thumbnails:
+                    failed += 1
+                    self.stderr.write(f'Не удалось обработать {product.image.name}')
+                    continue
+                delete_thumbnails(product.thumbnails or {}, settings.MEDIA_ROOT, keep=thumbnails)
+                Product.objects.filter(pk=product.pk).update(thumbnails=thumbnails)
+                built += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Миниатюры построены: {built}, ошибок: {failed}.'))
@@ -0,0 +1,14 @@
+# products/management/commands/rebuild_ratings.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики рейтинга продуктов по активным отзывам'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Product.rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Счетчики рейтинга пересчитаны для {updated} продуктов.'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='telegram_file_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Telegram file_id'),
+        ),
+    ]
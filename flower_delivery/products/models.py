@@ -1,7 +1,16 @@
 # products/models.py
 
-from django.db import models
+import logging
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .thumbnails import render_thumbnails, delete_thumbnails
+
+logger = logging.getLogger(__name__)
 
 class Product(models.Model):
     # Название продукта
@@ -11,19 +20,112 @@ class Product(models.Model):
     # Изображение продукта
     image = models.ImageField(upload_to='products/', verbose_name='Изображение')
     available = models.BooleanField(default=True, verbose_name='В наличии')
+    # Счетчики активных отзывов, поддерживаются при записи Review
+    rating_sum = models.IntegerField(default=0, editable=False, verbose_name='Сумма оценок')
+    rating_count = models.IntegerField(default=0, editable=False, verbose_name='Количество оценок')
+    # Миниатюры изображения: {формат: {ширина: имя файла}}
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False, verbose_name='Миниатюры')
+    # file_id фотографии, уже загруженной в Telegram; сбрасывается при смене изображения
+    telegram_file_id = models.CharField(max_length=255, blank=True, editable=False, verbose_name='Telegram file_id')
+
+    # Поля, которые пишут только apply_rating_delta и rebuild_ratings
+    RATING_FIELDS = ('rating_sum', 'rating_count')
 
     def __str__(self):
         return self.name  # Отображение названия продукта в админке
 
+    def save(self, *args, **kwargs):
+        # Обычное сохранение уже существующего продукта не трогает счетчики рейтинга:
+        # загруженные значения могли устареть, и запись затерла бы сдвиги от новых отзывов
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем загруженное изображение, чтобы заметить его замену
+        instance._loaded_image_name = instance.__dict__.get('image')
+        return instance
+
+    def build_thumbnails(self):
+        """Строим миниатюры текущего изображения и сохраняем их список"""
+        previous = self.thumbnails or {}
+        thumbnails = {}
+        if self.image:
+            thumbnails = render_thumbnails(self.image.name, settings.MEDIA_ROOT)
+            if not thumbnails:
+                logger.info('Не удалось построить миниатюры для %s', self.image.name)
+        delete_thumbnails(previous, settings.MEDIA_ROOT, keep=thumbnails)
+        self.thumbnails = thumbnails
+        Product.objects.filter(pk=self.pk).update(thumbnails=thumbnails)
+        return thumbnails
+
+    def remember_telegram_file_id(self, file_id, image_name):
+        """Сохраняем file_id, если изображение не сменилось с момента отправки"""
+        updated = Product.objects.filter(pk=self.pk, image=image_name).update(telegram_file_id=file_id)
+        if updated:
+            self.telegram_file_id = file_id
+        return bool(updated)
+
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
 
     def get_average_rating(self):
-        reviews = self.reviews.filter(is_active=True)
-        if reviews.exists():
-            return round(reviews.aggregate(models.Avg('rating'))['rating__avg'], 1)
-        return 0
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
+
+    @staticmethod
+    def apply_rating_delta(product_id, sum_delta, count_delta):
+        """Атомарно сдвигаем счетчики рейтинга продукта"""
+        if sum_delta or count_delta:
+            Product.objects.filter(pk=product_id).update(
+                rating_sum=F('rating_sum') + sum_delta,
+                rating_count=F('rating_count') + count_delta,
+            )
+
+    @staticmethod
+    def rebuild_ratings(queryset=None):
+        """Пересчитываем счетчики рейтинга с нуля по активным отзывам"""
+        active_reviews = Review.objects.filter(product=models.OuterRef('pk'), is_active=True).order_by()
+        rating_sum = active_reviews.values('product').annotate(total=models.Sum('rating')).values('total')
+        rating_count = active_reviews.values('product').annotate(total=models.Count('id')).values('total')
+        if queryset is None:
+            queryset = Product.objects.all()
+        return queryset.update(
+            rating_sum=Coalesce(models.Subquery(rating_sum), 0),
+            rating_count=Coalesce(models.Subquery(rating_count), 0),
+        )
+
+class ReviewQuerySet(models.QuerySet):
+    def set_active(self, is_active):
+        """Массово включаем или отключаем отзывы, сохраняя счетчики рейтинга"""
+        with transaction.atomic():
+            pks = list(
+                self.select_for_update().exclude(is_active=is_active).values_list('pk', flat=True)
+            )
+            changed = Review.objects.filter(pk__in=pks)
+            deltas = list(
+                changed.order_by().values('product').annotate(
+                    rating_sum=models.Sum('rating'),
+                    rating_count=models.Count('id'),
+                )
+            )
+            changed.update(is_active=is_active)
+            sign = 1 if is_active else -1
+            for delta in deltas:
+                Product.apply_rating_delta(
+                    delta['product'], sign * delta['rating_sum'], sign * delta['rating_count']
+                )
+        return len(pks)
+
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews', verbose_name='Продукт')
@@ -33,6 +135,8 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     is_active = models.BooleanField(default=True, verbose_name='Активен')  # Для модерации отзывов
 
+    objects = ReviewQuerySet.as_manager()
+
     def __str__(self):
         return f'Отзыв от {self.user.username} на {self.product.name}'
 
@@ -40,3 +144,72 @@ class Review(models.Model):
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
         ordering = ['-created_at']
+        indexes = [
+            # Опубликованные отзывы продукта в порядке показа. Частичный индекс: фильтр
+            # is_active=True в SQLite превращается в условие без сравнения, и обычный
+            # составной индекс по нему не выбирается
+            models.Index(
+                fields=['product', '-created_at'], condition=models.Q(is_active=True),
+                name='review_product_active_idx',
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_rating()
+        return instance
+
+    def _remember_rating(self):
+        # Запоминаем, какой вклад отзыв внес в счетчики продукта
+        self._loaded_rating = (self.product_id, self.rating if self.is_active else 0, int(self.is_active))
+
+    def save(self, *args, **kwargs):
+        # Счетчики продукта обновляются в той же транзакции, что и сам отзыв
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+@receiver(post_save, sender=Product)
+def build_product_thumbnails(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    image_name = instance.image.name if instance.image else None
+    if created or image_name != getattr(instance, '_loaded_image_name', None):
+        instance.build_thumbnails()
+        if instance.telegram_file_id:
+            # Загруженная в Telegram фотография относится к старому изображению
+            instance.telegram_file_id = ''
+            Product.objects.filter(pk=instance.pk).update(telegram_file_id='')
+    instance._loaded_image_name = image_name
+
+
+@receiver(post_save, sender=Review)
+def update_product_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and not hasattr(instance, '_loaded_rating'):
+        # Неизвестно, что было в базе до сохранения, пересчитываем продукт целиком
+        Product.rebuild_ratings(Product.objects.filter(pk=instance.product_id))
+        instance._remember_rating()
+        return
+    previous = None if created else instance._loaded_rating
+    instance._remember_rating()
+    current = instance._loaded_rating
+    if previous == current:
+        return
+    if previous and previous[0] != current[0]:
+        Product.apply_rating_delta(previous[0], -previous[1], -previous[2])
+        previous = None
+    if previous:
+        Product.apply_rating_delta(current[0], current[1] - previous[1], current[2] - previous[2])
+    else:
+        Product.apply_rating_delta(current[0], current[1], current[2])
+
+
+@receiver(post_delete, sender=Review)
+def update_product_rating_on_delete(sender, instance, **kwargs):
+    if not hasattr(instance, '_loaded_rating'):
+        instance._remember_rating()
+    product_id, rating, count = instance._loaded_rating
+    Product.apply_rating_delta(product_id, -rating, -count)
@@ -0,0 +1,52 @@
+# products/templatetags/product_images.py
+
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+def _srcset(renditions):
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for width, name in sorted(renditions.items(), key=lambda item: int(item[0]))
+    )
+
+
+def _attributes(attrs):
+    return format_html_join('', ' {}="{}"', ((key, value) for key, value in attrs.items() if value))
+
+
+@register.simple_tag
+def product_image(product, sizes='100vw', css_class='', style='', loading='lazy'):
+    """
+    Выводим изображение продукта с адаптивными миниатюрами.
+
+    Браузер сам выбирает WebP или JPEG нужной ширины по srcset/sizes,
+    а изображения за пределами экрана загружаются лениво.
+    """
+    attrs = {
+        'class': css_class,
+        'style': style,
+        'alt': product.name,
+        'loading': loading,
+        'decoding': 'async',
+    }
+    thumbnails = product.thumbnails or {}
+    jpeg = thumbnails.get('jpeg')
+    if not jpeg:
+        # Миниатюр еще нет, отдаем оригинал
+        return format_html('<img src="{}"{}>', product.image.url, _attributes(attrs))
+
+    largest = max(jpeg, key=int)
+    attrs.update({'srcset': _srcset(jpeg), 'sizes': sizes})
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((extension, _srcset(renditions), sizes)
+         for extension, renditions in thumbnails.items() if extension != 'jpeg' and renditions),
+    )
+    return format_html(
+        '<picture>{}<img src="{}"{}></picture>',
+        sources, default_storage.url(jpeg[largest]), _attributes(attrs),
+    )
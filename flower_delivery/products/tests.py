@@ -2,9 +2,19 @@
 
 from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Product
+from django.contrib.auth.models import User
+from .models import Product, Review
 
 from django.urls import reverse
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import override_settings
+from io import BytesIO, StringIO
+from PIL import Image
+from flower_delivery.testing import QueryPlanMixin
+import os
+import shutil
+import tempfile
 
 
 class ProductModelTest(TestCase):
@@ -117,3 +127,215 @@ class ProductListViewTest(TestCase):
         self.assertContains(response, 'Цена: 1500,00 руб.')
         self.assertContains(response, 'Цена: 1800,00 руб.')
 
+
+class ProductListQueryCountTest(TestCase):
+    def setUp(self):
+        """
+        Создаем продукты с отзывами, чтобы проверить число запросов к базе.
+        """
+        self.user = User.objects.create_user(username='reviewer', password='TestPassword123')
+
+    def create_products(self, count):
+        # Файлы изображений не нужны: продукты создаются без загрузки в media/
+        products = Product.objects.bulk_create(
+            Product(name=f'Букет {i}', price=1000.00, image='products/rose.jpg') for i in range(count)
+        )
+        for product in products:
+            Review.objects.create(product=product, user=self.user, rating=4)
+            Review.objects.create(product=product, user=self.user, rating=5)
+            Review.objects.create(product=product, user=self.user, rating=1, is_active=False)
+
+    def test_product_list_uses_single_query(self):
+        """
+        Каталог загружается одним запросом независимо от количества продуктов.
+        """
+        for count in (1, 20):
+            Product.objects.all().delete()
+            self.create_products(count)
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('product_list'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_product_list_shows_annotated_rating(self):
+        """
+        Средний рейтинг учитывает только активные отзывы.
+        """
+        self.create_products(1)
+        response = self.client.get(reverse('product_list'))
+        product = response.context['products'][0]
+        self.assertEqual(product.get_average_rating(), 4.5)
+        self.assertEqual(product.rating_count, 2)
+        self.assertContains(response, '(4,5/5)')
+
+
+class ProductRatingCountersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reviewer', password='TestPassword123')
+        # Файл изображения не нужен: продукт создается без загрузки в media/
+        self.product = Product.objects.create(name='Тестовый Букет', price=1999.99, image='products/test_image.jpg')
+
+    def assertCounters(self, rating_sum, rating_count):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_sum, rating_sum)
+        self.assertEqual(self.product.rating_count, rating_count)
+
+    def test_counters_follow_review_writes(self):
+        """
+        Счетчики меняются при создании, модерации, изменении и удалении отзыва.
+        """
+        review = Review.objects.create(product=self.product, user=self.user, rating=4)
+        Review.objects.create(product=self.product, user=self.user, rating=2, is_active=False)
+        self.assertCounters(4, 1)
+
+        review = Review.objects.get(pk=review.pk)
+        review.is_active = False
+        review.save()
+        self.assertCounters(0, 0)
+
+        review.is_active = True
+        review.rating = 5
+        review.save()
+        self.assertCounters(5, 1)
+
+        review.delete()
+        self.assertCounters(0, 0)
+
+    def test_bulk_moderation_updates_counters(self):
+        """
+        Массовое одобрение и отклонение отзывов в админке учитывается в счетчиках.
+        """
+        for rating in (3, 4, 5):
+            Review.objects.create(product=self.product, user=self.user, rating=rating, is_active=False)
+        self.assertCounters(0, 0)
+
+        self.assertEqual(Review.objects.all().set_active(True), 3)
+        self.assertCounters(12, 3)
+        # Повторное одобрение ничего не меняет
+        self.assertEqual(Review.objects.all().set_active(True), 0)
+        self.assertCounters(12, 3)
+
+        Review.objects.filter(rating__gte=4).set_active(False)
+        self.assertCounters(3, 1)
+
+        Review.objects.all().delete()
+        self.assertCounters(0, 0)
+
+    def test_stale_product_save_keeps_counters(self):
+        """
+        Сохранение ранее загруженного продукта (например, правка цены в админке) не затирает счетчики.
+        """
+        product = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=self.user, rating=5)
+        Review.objects.create(product=self.product, user=self.user, rating=3)
+
+        product.price = 2500
+        product.save()
+        self.assertCounters(8, 2)
+        self.assertEqual(self.product.price, 2500)
+
+    def test_rebuild_ratings_command(self):
+        """
+        Команда rebuild_ratings восстанавливает рассинхронизированные счетчики.
+        """
+        Review.objects.create(product=self.product, user=self.user, rating=4)
+        Review.objects.create(product=self.product, user=self.user, rating=5)
+        Product.objects.update(rating_sum=100, rating_count=7)
+
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertCounters(9, 2)
+
+
+class ReviewIndexTest(QueryPlanMixin, TestCase):
+    def test_active_reviews_use_index(self):
+        """
+        Опубликованные отзывы продукта выбираются по составному индексу.
+        """
+        product = Product.objects.create(name='Букет', price=100)
+        self.assertUsesIndex(product.reviews.filter(is_active=True), 'review_product_active_idx')
+
+
+class ProductThumbnailsTest(TestCase):
+    def setUp(self):
+        """
+        Миниатюры пишутся во временный MEDIA_ROOT, чтобы не засорять media/.
+        """
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def make_image(self, width, height, image_format='PNG'):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), (200, 30, 90)).save(buffer, image_format)
+        return SimpleUploadedFile(name='flower.png', content=buffer.getvalue(), content_type='image/png')
+
+    def test_thumbnails_built_on_upload(self):
+        """
+        При загрузке изображения строятся миниатюры WebP и JPEG фиксированных ширин.
+        """
+        product = Product.objects.create(name='Букет', price=1000, image=self.make_image(1200, 1500))
+        self.assertEqual(set(product.thumbnails), {'webp', 'jpeg'})
+        self.assertEqual(set(product.thumbnails['webp']), {'320', '640', '960'})
+        name = product.thumbnails['jpeg']['320']
+        self.assertTrue(name.startswith('products/flower'))
+        self.assertTrue(name.endswith('.320w.jpeg'))
+        with Image.open(os.path.join(self.media_root, name)) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 400))
+        # Список миниатюр сохранен в базе
+        product.refresh_from_db()
+        self.assertEqual(product.thumbnails['jpeg']['320'], name)
+
+    def test_small_image_is_not_upscaled(self):
+        """
+        Для узкого изображения строится только миниатюра его собственной ширины.
+        """
+        product = Product.objects.create(name='Букет', price=1000, image=self.make_image(200, 100))
+        self.assertEqual(set(product.thumbnails['jpeg']), {'200'})
+
+    def test_image_replacement_rebuilds_thumbnails(self):
+        """
+        Замена изображения перестраивает миниатюры и удаляет старые файлы.
+        """
+        product = Product.objects.create(name='Букет', price=1000, image=self.make_image(800, 800))
+        old_name = product.thumbnails['webp']['320']
+        product = Product.objects.get(pk=product.pk)
+        product.image = self.make_image(700, 900)
+        product.save()
+        self.assertNotEqual(product.thumbnails['webp']['320'], old_name)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, old_name)))
+
+    def test_invalid_image_has_no_thumbnails(self):
+        """
+        Если файл не является изображением, миниатюры не строятся.
+        """
+        product = Product.objects.create(
+            name='Букет', price=1000,
+            image=SimpleUploadedFile(name='broken.jpg', content=b'', content_type='image/jpeg'),
+        )
+        self.assertEqual(product.thumbnails, {})
+
+    def test_product_image_tag(self):
+        """
+        Тег product_image выводит srcset, sizes и ленивую загрузку.
+        """
+        product = Product.objects.create(name='Букет', price=1000, image=self.make_image(1200, 1500))
+        html = Template(
+            '{% load product_images %}{% product_image product sizes="33vw" css_class="card-img-top" %}'
+        ).render(Context({'product': product}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('320w', html)
+        self.assertIn('960w', html)
+        self.assertIn('sizes="33vw"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('class="card-img-top"', html)
+
+    def test_build_thumbnails_command(self):
+        """
+        Команда build_thumbnails достраивает миниатюры для существующих продуктов.
+        """
+        product = Product.objects.create(name='Букет', price=1000, image=self.make_image(700, 700))
+        Product.objects.update(thumbnails={})
+        call_command('build_thumbnails', workers=1, stdout=StringIO(), stderr=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(set(product.thumbnails['jpeg']), {'320', '640', '700'})
@@ -0,0 +1,112 @@
+# products/thumbnails.py
+
+import hashlib
+import os
+from io import BytesIO
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Ширины миниатюр в пикселях, под которые строится srcset
+THUMBNAIL_WIDTHS = (320, 640, 960)
+
+# Форматы миниатюр: расширение -> (формат Pillow, параметры сохранения)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Размер блока при подсчете хэша содержимого
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(path):
+    """Короткий хэш содержимого файла для имени миниатюры"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:10]
+
+
+def thumbnail_name(image_name, digest, width, extension):
+    """Имя миниатюры рядом с оригиналом: products/rose.<хэш>.320w.webp"""
+    stem = os.path.splitext(image_name)[0]
+    return f'{stem}.{digest}.{width}w.{extension}'
+
+
+def thumbnail_widths(original_width):
+    """Ширины, которые имеет смысл строить для изображения данной ширины"""
+    widths = [width for width in THUMBNAIL_WIDTHS if width < original_width]
+    if len(widths) < len(THUMBNAIL_WIDTHS):
+        # Изображение не больше крупной миниатюры, добавляем его собственную ширину
+        widths.append(original_width)
+    return widths
+
+
+def _prepare(image, extension):
+    """Приводим изображение к режиму, который поддерживает формат миниатюры"""
+    if image.mode in ('RGB', 'RGBA') and not (extension == 'jpeg' and image.mode == 'RGBA'):
+        return image
+    image = image.convert('RGBA')
+    if extension == 'jpeg':
+        # JPEG не поддерживает прозрачность, кладем изображение на белый фон
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image
+
+
+def render_thumbnails(image_name, media_root):
+    """
+    Строим миниатюры изображения во всех форматах и ширинах.
+
+    Функция не обращается к Django и может выполняться в отдельном процессе.
+    Возвращает словарь {расширение: {ширина: имя файла}} или пустой словарь,
+    если файл не является изображением.
+    """
+    path = os.path.join(media_root, image_name)
+    try:
+        digest = content_hash(path)
+        with Image.open(path) as original:
+            original = ImageOps.exif_transpose(original)
+            original.load()
+    except (OSError, UnidentifiedImageError):
+        return {}
+
+    thumbnails = {extension: {} for extension in THUMBNAIL_FORMATS}
+    for width in thumbnail_widths(original.width):
+        height = max(1, round(original.height * width / original.width))
+        resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+        for extension, (image_format, save_options) in THUMBNAIL_FORMATS.items():
+            name = thumbnail_name(image_name, digest, width, extension)
+            target = os.path.join(media_root, name)
+            # Имя зависит от содержимого, поэтому готовый файл можно не пересоздавать
+            if not os.path.exists(target):
+                _prepare(resized, extension).save(target, image_format, **save_options)
+            thumbnails[extension][str(width)] = name
+    return thumbnails
+
+
+def delete_thumbnails(thumbnails, media_root, keep=None):
+    """Удаляем файлы миниатюр, кроме перечисленных в keep"""
+    keep_names = {name for renditions in (keep or {}).values() for name in renditions.values()}
+    for renditions in thumbnails.values():
+        for name in renditions.values():
+            if name in keep_names:
+                continue
+            try:
+                os.remove(os.path.join(media_root, name))
+            except FileNotFoundError:
+                pass
+
+
+def downscaled_jpeg(path, max_size=1280):
+    """Уменьшенная копия изображения в JPEG или None, если файл не читается"""
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+            buffer = BytesIO()
+            _prepare(image, 'jpeg').save(buffer, 'JPEG', quality=85, optimize=True)
+    except (OSError, UnidentifiedImageError):
+        return None
+    return buffer.getvalue()
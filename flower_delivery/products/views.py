@@ -5,9 +5,9 @@ from .models import Product, Review
 from .forms import ReviewForm
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Avg
 
 def product_list(request):
+    # Рейтинг хранится в самих продуктах, поэтому каталог загружается одним запросом
     products = Product.objects.all()
     return render(request, 'products/product_list.html', {'products': products})
 
@@ -33,12 +33,11 @@ def product_detail(request, product_id):
             return redirect('product_detail', product_id=product.id)
     else:
         form = ReviewForm()
-    average_rating = reviews.aggregate(Avg('rating'))['rating__avg']
     return render(request, 'products/product_detail.html', {
         'product': product,
         'reviews': reviews,
         'form': form,
         'user_review': user_review,
-        'average_rating': average_rating,
-        'review_count': reviews.count()
+        'average_rating': product.get_average_rating(),
+        'review_count': product.rating_count
     })
@@ -0,0 +1,125 @@
+// static/js/cart.js
+
+// Работа с корзиной без перезагрузки страницы: сервер возвращает JSON со сводкой корзины,
+// а скрипт обновляет счетчик в меню, карточки товаров и таблицу корзины на месте
+(function () {
+    function formatPrice(value) {
+        return value.replace('.', ',') + ' руб.';
+    }
+
+    function post(url, body, csrfToken) {
+        var headers = {'X-Requested-With': 'XMLHttpRequest', 'Accept': 'application/json'};
+        if (csrfToken) {
+            headers['X-CSRFToken'] = csrfToken;
+        }
+        return fetch(url, {method: 'POST', body: body, headers: headers}).then(function (response) {
+            return response.json();
+        });
+    }
+
+    function postForm(form) {
+        return post(form.action, new FormData(form));
+    }
+
+    function showAlert(container, text, level) {
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-' + level + ' alert-dismissible fade show';
+        alert.setAttribute('role', 'alert');
+        alert.textContent = text;
+        var close = document.createElement('button');
+        close.type = 'button';
+        close.className = 'btn-close';
+        close.setAttribute('data-bs-dismiss', 'alert');
+        close.setAttribute('aria-label', 'Закрыть');
+        alert.appendChild(close);
+        container.appendChild(alert);
+    }
+
+    function showMessages(summary) {
+        // На странице корзины ошибки выводятся над таблицей, на остальных - в общем блоке сообщений
+        var container = document.querySelector('[data-cart-errors]') || document.querySelector('[data-messages]');
+        if (!container) {
+            return;
+        }
+        container.innerHTML = '';
+        if (summary.message) {
+            showAlert(container, summary.message, 'success');
+        }
+        (summary.errors || []).forEach(function (error) {
+            showAlert(container, error, 'danger');
+        });
+    }
+
+    function renderBadge(summary) {
+        document.querySelectorAll('[data-cart-count]').forEach(function (count) {
+            count.textContent = summary.count;
+        });
+        document.querySelectorAll('[data-cart-badge]').forEach(function (badge) {
+            badge.classList.toggle('d-none', !summary.count);
+        });
+    }
+
+    function renderProductForm(form, summary) {
+        var productId = form.action.match(/(\d+)\/?$/)[1];
+        var button = form.querySelector('[type=submit]');
+        summary.lines.forEach(function (line) {
+            if (String(line.product_id) === productId) {
+                button.textContent = 'В корзине: ' + line.quantity;
+            }
+        });
+    }
+
+    function renderCart(summary) {
+        renderBadge(summary);
+        if (!summary.count) {
+            // Корзина опустела: показываем страницу пустой корзины
+            window.location.reload();
+            return;
+        }
+        var lines = {};
+        summary.lines.forEach(function (line) {
+            lines[line.product_id] = line;
+        });
+        document.querySelectorAll('[data-cart-line]').forEach(function (row) {
+            var line = lines[row.dataset.cartLine];
+            if (!line) {
+                row.remove();
+                return;
+            }
+            row.querySelector('[data-line-quantity]').value = line.quantity;
+            row.querySelector('[data-line-total]').textContent = formatPrice(line.total_price);
+        });
+        document.querySelectorAll('[data-cart-total]').forEach(function (total) {
+            total.textContent = formatPrice(summary.total_price);
+        });
+        showMessages(summary);
+    }
+
+    // Кнопки "Добавить в корзину" в каталоге и на странице товара
+    document.querySelectorAll('[data-cart-add]').forEach(function (form) {
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            postForm(form).then(function (summary) {
+                renderBadge(summary);
+                renderProductForm(form, summary);
+                showMessages(summary);
+            });
+        });
+    });
+
+    // Страница корзины: обновление количеств и удаление строк
+    var form = document.querySelector('[data-cart-form]');
+    if (form) {
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            postForm(form).then(renderCart);
+        });
+        var csrfToken = form.querySelector('[name=csrfmiddlewaretoken]').value;
+        form.querySelectorAll('[data-cart-remove]').forEach(function (link) {
+            link.addEventListener('click', function (event) {
+                event.preventDefault();
+                post(link.href, null, csrfToken).then(renderCart);
+            });
+        });
+    }
+})();
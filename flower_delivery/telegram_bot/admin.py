@@ -1,3 +1,18 @@
+# telegram_bot/admin.py
+
 from django.contrib import admin
+from django.utils import timezone
+from .models import NotificationOutbox
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['kind', 'payload', 'attempts', 'last_error', 'created_at', 'sent_at']
+    ordering = ['-id']
+    actions = ['requeue']
 
-# Register your models here.
+    def requeue(self, request, queryset):
+        queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+    requeue.short_description = 'Повторить отправку выбранных уведомлений'
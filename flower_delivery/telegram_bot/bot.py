@@ -1,15 +1,11 @@
 # telegram_bot/bot.py
 
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from django.conf import settings
+from aiogram import Dispatcher
 from telegram_bot.handlers import register_handlers
+from telegram_bot.storage import DatabaseStorage
 
-# Инициализируем бота
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-
-# Создаем хранилище для FSM (можно использовать другое, например Redis)
-storage = MemoryStorage()
+# Состояния FSM храним в базе проекта: они переживают перезапуск и общие для всех процессов бота
+storage = DatabaseStorage()
 
 # Инициализируем диспетчер
 dp = Dispatcher(storage=storage)
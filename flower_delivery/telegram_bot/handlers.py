@@ -1,14 +1,93 @@
 # telegram_bot/handlers.py
 
-from aiogram import Router, types
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
+from aiogram import F, Router, types
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from django.conf import settings
-from orders.models import Order
-from django.contrib.auth.models import User
+from orders.models import Order, DailySalesRollup
+from users.models import Profile
 from asgiref.sync import sync_to_async
-from datetime import datetime
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncDay
+from django.utils import timezone
+from django.db.models import Sum
+
+# Данные кнопки меню статусов в /orders_status
+STATUS_MENU = 'order_statuses'
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class OrdersPage(CallbackData, prefix='orders'):
+    """
+    Данные кнопки страницы заказов: статус и курсор - время создания в микросекундах
+    и ID последнего заказа предыдущей страницы. Укладываются в 64 байта callback_data.
+    """
+    status: str
+    created: Optional[int] = None
+    pk: Optional[int] = None
+
+    @classmethod
+    def after(cls, status, cursor):
+        created_at, pk = cursor
+        return cls(status=status, created=(created_at - EPOCH) // timedelta(microseconds=1), pk=pk)
+
+    @property
+    def cursor(self):
+        if self.created is None or self.pk is None:
+            return None
+        return EPOCH + timedelta(microseconds=self.created), self.pk
+
+
+async def get_orders_page(status, cursor=None):
+    """
+    Текст и клавиатура одной страницы заказов в статусе status.
+
+    Выбирается только эта страница (пагинация по ключу), текст собирается
+    одним join, а размер страницы держит сообщение в пределах лимита Telegram.
+    """
+    status_display = dict(Order.STATUS_CHOICES).get(status, status)
+    orders, next_cursor = await (
+        Order.objects.filter(status=status)
+        .values('id', 'created_at', 'user__username', 'total_price')
+        .akeyset_page(cursor, settings.TELEGRAM_ORDERS_PAGE_SIZE)
+    )
+    if orders:
+        header = f"Заказы в статусе '{status_display}'" + (" (продолжение)" if cursor else "") + ":"
+        text = '\n'.join([header] + [
+            f"Заказ №{order['id']}, пользователь: {order['user__username']}, "
+            f"сумма: {order['total_price']} руб."
+            for order in orders
+        ])
+    else:
+        text = f"Нет заказов в статусе '{status_display}'."
+
+    keyboard = InlineKeyboardBuilder()
+    if cursor:
+        keyboard.button(text="⏮ В начало", callback_data=OrdersPage(status=status))
+    if next_cursor:
+        keyboard.button(text="Дальше ▶", callback_data=OrdersPage.after(status, next_cursor))
+    keyboard.button(text="Все статусы", callback_data=STATUS_MENU)
+    keyboard.adjust(2)
+    return text, keyboard.as_markup()
+
+
+async def get_status_menu():
+    """Количество заказов по статусам и кнопки для перехода к их страницам, одним GROUP BY"""
+    counts = await Order.objects.astatus_counts()
+    if not counts:
+        return "Нет заказов.", None
+    lines = ["Заказы по статусам:"]
+    keyboard = InlineKeyboardBuilder()
+    for status, label in Order.STATUS_CHOICES:
+        count = counts.get(status, 0)
+        lines.append(f"{label}: {count}")
+        if count:
+            keyboard.button(text=f"{label} ({count})", callback_data=OrdersPage(status=status))
+    keyboard.adjust(2)
+    return '\n'.join(lines), keyboard.as_markup()
+
 
 def register_handlers():
     router = Router()
@@ -18,8 +97,8 @@ def register_handlers():
         await message.answer(
             "Здравствуйте! Это бот для уведомлений о заказах.\n\n"
             "Доступные команды:\n"
-            "/orders - список новых заказов\n"
-            "/orders_status - список заказов со статусами\n"
+            "/orders - список новых заказов по страницам\n"
+            "/orders_status - заказы по статусам с переходом к их страницам\n"
             "/set_status <order_id> <status> - установить статус заказа\n"
             "/daily_report - отчет по продажам за сегодня\n"
             "/link <username> - связать ваш Telegram с аккаунтом на сайте"
@@ -31,20 +110,8 @@ def register_handlers():
             await message.answer("У вас нет доступа к этой информации.")
             return
 
-        orders = await sync_to_async(list)(
-            Order.objects.filter(status='pending').values('id', 'user__username', 'total_price')
-        )
-
-        if orders:
-            response = "Текущие заказы в статусе 'В ожидании':\n"
-            for order in orders:
-                response += (
-                    f"Заказ №{order['id']}, пользователь: {order['user__username']}, "
-                    f"сумма: {order['total_price']} руб.\n"
-                )
-        else:
-            response = "Нет новых заказов."
-        await message.answer(response)
+        text, keyboard = await get_orders_page('pending')
+        await message.answer(text, reply_markup=keyboard)
 
     @router.message(Command(commands=['orders_status']))
     async def list_orders_with_status(message: types.Message):
@@ -52,24 +119,29 @@ def register_handlers():
             await message.answer("У вас нет доступа к этой информации.")
             return
 
-        orders = await sync_to_async(list)(
-            Order.objects.all()
-            .order_by('status', '-created_at')
-            .values('id', 'user__username', 'total_price', 'status')
-        )
+        text, keyboard = await get_status_menu()
+        await message.answer(text, reply_markup=keyboard)
 
-        if orders:
-            status_display = dict(Order.STATUS_CHOICES)
-            response = "Список всех заказов:\n"
-            for order in orders:
-                status = status_display.get(order['status'], 'Неизвестно')
-                response += (
-                    f"Заказ №{order['id']}, пользователь: {order['user__username']}, "
-                    f"сумма: {order['total_price']} руб., статус: {status}\n"
-                )
-        else:
-            response = "Нет заказов."
-        await message.answer(response)
+    @router.callback_query(OrdersPage.filter())
+    async def show_orders_page(callback: types.CallbackQuery, callback_data: OrdersPage):
+        if str(callback.from_user.id) != settings.ADMIN_TELEGRAM_ID:
+            await callback.answer("У вас нет доступа к этой информации.", show_alert=True)
+            return
+
+        # Каждое нажатие загружает только запрошенную страницу и заменяет текст сообщения
+        text, keyboard = await get_orders_page(callback_data.status, callback_data.cursor)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+
+    @router.callback_query(F.data == STATUS_MENU)
+    async def show_status_menu(callback: types.CallbackQuery):
+        if str(callback.from_user.id) != settings.ADMIN_TELEGRAM_ID:
+            await callback.answer("У вас нет доступа к этой информации.", show_alert=True)
+            return
+
+        text, keyboard = await get_status_menu()
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
 
     @router.message(Command(commands=['set_status']))
     async def set_order_status(message: types.Message):
@@ -88,9 +160,16 @@ def register_handlers():
                 await message.answer("Некорректный статус заказа.")
                 return
 
-            order = await sync_to_async(Order.objects.get)(id=order_id)
-            order.status = status
-            await sync_to_async(order.save)()
+            order = await Order.objects.aget(id=order_id)
+            if order.status == status:
+                await message.answer(f"Заказ №{order_id} уже в статусе '{order.get_status_display()}'.")
+                return
+            # Условный UPDATE: если статус успели изменить параллельно, переход не выполнится.
+            # Переход меняет заказ, сводку продаж и очередь уведомлений в одной транзакции,
+            # а транзакции асинхронный ORM не поддерживает, поэтому он выполняется в синхронном потоке
+            if not await sync_to_async(order.transition_to)(status):
+                await message.answer(f"Статус заказа №{order_id} был изменен одновременно с вами, повторите команду.")
+                return
             await message.answer(
                 f"Статус заказа №{order_id} изменен на '{order.get_status_display()}'."
             )
@@ -105,13 +184,14 @@ def register_handlers():
             await message.answer("У вас нет доступа к этой информации.")
             return
 
-        today = datetime.now().date()
-        orders_today = await sync_to_async(Order.objects.filter)(created_at__date=today)
+        today = timezone.localdate()
+        # Одна выборка из сводки продаж вместо подсчета заказов за день
+        totals = await DailySalesRollup.objects.filter(date=today).aaggregate(
+            orders=Sum('order_count'), revenue=Sum('revenue')
+        )
 
-        total_orders = await sync_to_async(orders_today.count)()
-        total_revenue = await sync_to_async(
-            lambda: orders_today.aggregate(total=Sum('total_price'))['total'] or 0
-        )()
+        total_orders = totals['orders'] or 0
+        total_revenue = totals['revenue'] or 0
 
         response = f"Отчет по продажам за {today.strftime('%d.%m.%Y')}:\n"
         response += f"Всего заказов: {total_orders}\n"
@@ -127,15 +207,15 @@ def register_handlers():
             return
         username = args[1]
         try:
-            user = await sync_to_async(User.objects.get)(username=username)
-            profile = user.profile
+            # Профиль ищем сразу по имени пользователя: один запрос, без ленивой загрузки user.profile
+            profile = await Profile.objects.aget(user__username=username)
             profile.telegram_id = str(message.from_user.id)
-            await sync_to_async(profile.save)()
+            await profile.asave(update_fields=['telegram_id'])
             await message.answer(
                 f"Ваш аккаунт связан с пользователем {username}. "
                 f"Вы будете получать уведомления о статусе заказов."
             )
-        except User.DoesNotExist:
+        except Profile.DoesNotExist:
             await message.answer("Пользователь с таким именем не найден.")
 
     return router
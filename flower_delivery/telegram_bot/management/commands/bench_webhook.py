@@ -0,0 +1,107 @@
+# telegram_bot/management/commands/bench_webhook.py
+
+import asyncio
+import json
+import os
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+from flower_delivery.testing import FakeBotSession
+from orders.models import DailySalesRollup, Order
+from telegram_bot.handlers import register_handlers
+from telegram_bot.webhook import SECRET_HEADER, WEBHOOK_HANDLER, create_app
+
+RECORDED_UPDATES = os.path.join(os.path.dirname(__file__), '..', '..', 'testdata', 'updates.json')
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный замер вебхука: воспроизводит записанные обновления Telegram против '
+        'локального сервера. Bot API не вызывается, задержка его ответов имитируется. '
+        'Обработчики работают с временной тестовой базой, рабочие данные не меняются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--updates', default=RECORDED_UPDATES, help='JSON-файл со списком обновлений')
+        parser.add_argument('--repeat', type=int, default=20, help='Сколько раз воспроизвести записанные обновления')
+        parser.add_argument('--clients', type=int, default=50, help='Одновременных запросов к вебхуку')
+        parser.add_argument('--concurrency', type=int, help='Обновлений, обрабатываемых сервером одновременно')
+        parser.add_argument('--latency', type=float, default=50, help='Задержка ответа Bot API, мс')
+
+    def handle(self, *args, **options):
+        with open(options['updates'], encoding='utf-8') as file:
+            recorded = json.load(file)
+        # Номера обновлений уникальны, как у настоящего потока от Telegram
+        updates = [
+            {**update, 'update_id': index}
+            for index, update in enumerate(recorded * options['repeat'], start=1)
+        ]
+        # Обработчики пишут в базу (например, /link), поэтому замер идет на временной
+        # тестовой базе, которая удаляется после прогона
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.create_data()
+            results = asyncio.run(self.run(updates, options))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        self.stdout.write(
+            f'Обновлений: {len(updates)}\n'
+            f'Ответ вебхука, мс: медиана {results["median"]:.1f}, 95% {results["p95"]:.1f}, '
+            f'максимум {results["max"]:.1f}\n'
+            f'Все обновления обработаны за {results["total"]:.2f} с '
+            f'({len(updates) / results["total"]:.0f} обновлений/с)\n'
+            f'Запросов к Bot API: {results["requests"]}'
+        )
+
+    def create_data(self, orders=100):
+        """Пользователь из записанных обновлений и заказы, которые покажут обработчики"""
+        user = User.objects.create_user(username='anna', password='bench-password')
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+        Order.objects.bulk_create(
+            Order(user=user, status=statuses[i % len(statuses)], total_price=100 + i, address='Адрес', phone='123')
+            for i in range(orders)
+        )
+        DailySalesRollup.rebuild()
+
+    async def run(self, updates, options):
+        session = FakeBotSession(latency=options['latency'] / 1000)
+        bot = Bot(token='123456:BENCH-TOKEN', session=session)
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        dispatcher.include_router(register_handlers())
+        secret = settings.TELEGRAM_WEBHOOK_SECRET or 'bench-secret'
+        app = create_app(dispatcher, bot, secret_token=secret, max_concurrent=options['concurrency'])
+        handler = app[WEBHOOK_HANDLER]
+
+        async with TestServer(app) as server, ClientSession() as client:
+            url = server.make_url(settings.TELEGRAM_WEBHOOK_PATH)
+            clients = asyncio.Semaphore(options['clients'])
+            timings = []
+
+            async def post(update):
+                async with clients:
+                    started = time.perf_counter()
+                    async with client.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                        response.raise_for_status()
+                    timings.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(update) for update in updates))
+            # Дожидаемся фоновой обработки всех принятых обновлений
+            while handler._tasks:
+                await asyncio.gather(*handler._tasks, return_exceptions=True)
+            total = time.perf_counter() - started
+
+        timings.sort()
+        return {
+            'median': timings[len(timings) // 2],
+            'p95': timings[int(len(timings) * 0.95) - 1],
+            'max': timings[-1],
+            'total': total,
+            'requests': len(session.requests),
+        }
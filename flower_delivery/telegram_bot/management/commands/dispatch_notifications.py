@@ -0,0 +1,62 @@
+# telegram_bot/management/commands/dispatch_notifications.py
+
+import asyncio
+import signal
+from django.core.management.base import BaseCommand
+from telegram_bot.notifier import notifier
+from telegram_bot.outbox import OutboxDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Отправляет уведомления из очереди NotificationOutbox в Telegram'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь один раз и завершиться')
+        parser.add_argument('--batch-size', type=int, help='Сколько уведомлений забирать за раз')
+        parser.add_argument('--interval', type=float, help='Пауза между опросами пустой очереди, секунды')
+
+    def handle(self, *args, **options):
+        dispatcher = OutboxDispatcher(batch_size=options['batch_size'])
+        if options['once']:
+            processed = asyncio.run(self.drain(dispatcher))
+            self.stdout.write(f'Обработано уведомлений: {processed}')
+            return
+        self.stdout.write('Диспетчер уведомлений запущен.')
+        asyncio.run(self.serve(dispatcher, options['interval']))
+        self.stdout.write('Диспетчер уведомлений остановлен.')
+
+    async def drain(self, dispatcher):
+        processed = 0
+        try:
+            while True:
+                batch = await dispatcher.dispatch_batch()
+                if not batch:
+                    return processed
+                processed += batch
+        finally:
+            self.write_metrics()
+            await notifier.close()
+
+    def write_metrics(self):
+        """Метрики планировщика отправки: глубина очереди, счетчики и задержки в миллисекундах"""
+        metrics = notifier.metrics()
+        if not metrics:
+            return
+        values = []
+        for name, value in metrics.items():
+            if name.startswith(('wait_', 'send_')):
+                value = '-' if value is None else f'{value * 1000:.0f} мс'
+            values.append(f'{name}={value}')
+        self.stdout.write('Отправка в Telegram: ' + ', '.join(values))
+
+    async def serve(self, dispatcher, interval):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        try:
+            await dispatcher.run(stop_event, poll_interval=interval)
+        finally:
+            self.write_metrics()
+            # Одна сессия Telegram на весь процесс, закрываем ее при остановке
+            await notifier.close()
@@ -0,0 +1,87 @@
+# telegram_bot/management/commands/run_webhook.py
+
+import asyncio
+import multiprocessing
+from aiohttp import web
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from telegram_bot.notifier import notifier
+from telegram_bot.webhook import create_app
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает Telegram-бота в режиме вебхука: локальный HTTP-сервер принимает обновления '
+        'от Telegram и передает их тому же диспетчеру, что и run_bot.py. '
+        'Telegram доставляет обновления либо вебхуку, либо поллингу, поэтому run_bot.py '
+        'одновременно с вебхуком не запускается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help='Адрес, на котором слушает сервер')
+        parser.add_argument('--port', type=int, help='Порт сервера')
+        parser.add_argument('--workers', type=int, help='Сколько процессов сервера запустить на одном порту')
+        parser.add_argument('--concurrency', type=int, help='Обновлений, обрабатываемых одновременно в процессе')
+        parser.add_argument(
+            '--set-webhook', action='store_true',
+            help='Перед запуском зарегистрировать TELEGRAM_WEBHOOK_URL в Telegram',
+        )
+
+    def handle(self, *args, **options):
+        host = options['host'] or settings.TELEGRAM_WEBHOOK_HOST
+        port = options['port'] or settings.TELEGRAM_WEBHOOK_PORT
+        workers = options['workers'] or settings.TELEGRAM_WEBHOOK_WORKERS
+        concurrency = options['concurrency'] or settings.TELEGRAM_WEBHOOK_MAX_CONCURRENT_UPDATES
+        if not settings.TELEGRAM_WEBHOOK_SECRET:
+            self.stderr.write('TELEGRAM_WEBHOOK_SECRET не задан: запросы к вебхуку не проверяются.')
+        if options['set_webhook']:
+            if not settings.TELEGRAM_WEBHOOK_URL:
+                raise CommandError('Для --set-webhook задайте TELEGRAM_WEBHOOK_URL.')
+            asyncio.run(self.set_webhook(max_connections=min(workers * concurrency, 100)))
+
+        self.stdout.write(f'Вебхук слушает http://{host}:{port}{settings.TELEGRAM_WEBHOOK_PATH}, процессов: {workers}')
+        if workers == 1:
+            self.serve(host, port, concurrency)
+            return
+        # Процессы делят порт через SO_REUSEPORT, ядро распределяет между ними соединения.
+        # Соединения с базой не должны достаться дочерним процессам от родителя.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=self.serve, args=(host, port, concurrency, True))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
+
+    def serve(self, host, port, concurrency, reuse_port=False):
+        from telegram_bot.bot import dp
+
+        # Бот берем у notifier при запуске: после notifier.close() он создается заново
+        app = create_app(dp, notifier.bot, max_concurrent=concurrency)
+
+        async def close_notifier(app):
+            # Одна сессия Telegram на весь процесс, закрываем ее при остановке
+            await notifier.close()
+
+        app.on_cleanup.append(close_notifier)
+        web.run_app(app, host=host, port=port, reuse_port=reuse_port, print=None)
+
+    async def set_webhook(self, max_connections):
+        try:
+            await notifier.bot.set_webhook(
+                url=settings.TELEGRAM_WEBHOOK_URL,
+                secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+                max_connections=max_connections,
+                allowed_updates=['message', 'callback_query'],
+            )
+        finally:
+            await notifier.close()
+        self.stdout.write(f'Вебхук зарегистрирован: {settings.TELEGRAM_WEBHOOK_URL}')
@@ -1,3 +1,68 @@
+# telegram_bot/models.py
+
 from django.db import models
+from django.utils import timezone
+
+
+class NotificationOutbox(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает отправки'),
+        ('sent', 'Отправлено'),
+        ('dead', 'Не доставлено'),  # Исчерпаны попытки отправки
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name='Тип уведомления')
+    payload = models.JSONField(default=dict, verbose_name='Данные')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попытки')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата отправки')
+
+    def __str__(self):
+        return f'Уведомление №{self.id} ({self.kind})'
+
+    class Meta:
+        verbose_name = 'Уведомление в очереди'
+        verbose_name_plural = 'Очередь уведомлений'
+        ordering = ['id']
+        indexes = [
+            # Диспетчер выбирает ожидающие уведомления, срок которых наступил
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    @classmethod
+    def enqueue(cls, kind, **payload):
+        """
+        Ставим уведомление в очередь.
+
+        Вызывается внутри транзакции, изменяющей данные, чтобы уведомление
+        сохранилось тогда и только тогда, когда сохранились сами изменения.
+        """
+        return cls.objects.create(kind=kind, payload=payload)
+
+
+class BotState(models.Model):
+    """
+    Состояние диалога с ботом (FSM aiogram) для telegram_bot.storage.DatabaseStorage.
+
+    Хранится в базе проекта, поэтому переживает перезапуск бота и общее
+    для всех его процессов.
+    """
+    key = models.CharField(max_length=255, unique=True, verbose_name='Ключ')
+    state = models.CharField(max_length=255, null=True, blank=True, verbose_name='Состояние')
+    data = models.JSONField(default=dict, verbose_name='Данные')
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name='Действует до')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    def __str__(self):
+        return f'{self.key}: {self.state}'
 
-# Create your models here.
+    class Meta:
+        verbose_name = 'Состояние диалога с ботом'
+        verbose_name_plural = 'Состояния диалогов с ботом'
+        indexes = [
+            # Очистка просроченных состояний
+            models.Index(fields=['expires_at'], name='bot_state_expires_idx'),
+        ]
@@ -0,0 +1,133 @@
+# telegram_bot/notifier.py
+
+import asyncio
+import ssl
+import certifi
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import ClientSession, TCPConnector
+from django.conf import settings
+from .scheduler import SendScheduler
+
+
+class KeepAliveSession(AiohttpSession):
+    """
+    HTTP-сессия aiogram, которая держит соединения с Telegram открытыми
+    keepalive_timeout секунд между запросами.
+    """
+
+    def __init__(self, keepalive_timeout, limit=100, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.keepalive_timeout = keepalive_timeout
+        self.limit = limit
+        self._client = None
+
+    def create_connector(self):
+        # Сертификаты и кэш DNS - как у стандартной сессии aiogram
+        return TCPConnector(
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+            limit=self.limit,
+            ttl_dns_cache=3600,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+
+    async def create_session(self):
+        if self._client is None or self._client.closed:
+            self._client = ClientSession(connector=self.create_connector())
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+
+
+class Notifier:
+    """
+    Общий для процесса клиент Telegram для исходящих сообщений.
+
+    Держит один Bot и одну HTTP-сессию с постоянными соединениями, поэтому
+    рукопожатие TCP+TLS с Telegram выполняется один раз, а не на каждое
+    уведомление. Число одновременных запросов ограничено семафором, а темп
+    отправки - планировщиком SendScheduler с лимитами Bot API на бота и на чат.
+    """
+
+    def __init__(self, bot=None, concurrency=None, keepalive_timeout=None):
+        self._bot = bot
+        # Переданный извне бот принадлежит вызывающему коду и не пересоздается
+        self._owns_bot = bot is None
+        self.concurrency = concurrency or settings.TELEGRAM_MAX_CONCURRENT_REQUESTS
+        self.keepalive_timeout = keepalive_timeout or settings.TELEGRAM_KEEPALIVE_TIMEOUT
+        self._loop = None
+        self._semaphore = None
+        self._scheduler = None
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            session = KeepAliveSession(self.keepalive_timeout, limit=self.concurrency)
+            self._bot = Bot(token=settings.TELEGRAM_BOT_TOKEN, session=session)
+        return self._bot
+
+    async def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None and self._owns_bot and self._bot is not None:
+            # HTTP-сессия привязана к прежнему циклу событий и в новом не работает:
+            # закрываем ее, чтобы не оставлять открытые соединения
+            await self._bot.session.close()
+            self._bot = None
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._scheduler = SendScheduler(self._send)
+
+    async def _send(self, method, chat_id, kwargs):
+        async with self._semaphore:
+            return await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._bind_loop()
+        return await self._scheduler.submit('send_message', chat_id, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        await self._bind_loop()
+        return await self._scheduler.submit('send_photo', chat_id, photo=photo, **kwargs)
+
+    def metrics(self):
+        """Метрики планировщика отправки: глубина очереди, счетчики и задержки"""
+        return self._scheduler.metrics() if self._scheduler is not None else {}
+
+    async def broadcast(self, messages):
+        """
+        Рассылаем сообщения.
+
+        messages - список словарей с параметрами send_message. Темп отправки
+        задает планировщик SendScheduler (общий лимит бота и лимит на чат),
+        поэтому все сообщения сразу ставятся в его очередь.
+        Возвращает список сообщений, которые стоит отправить повторно:
+        сообщения, отклоненные Telegram окончательно (бот заблокирован,
+        чат не найден), не повторяются.
+        """
+        results = await asyncio.gather(
+            *(self.send_message(**message) for message in messages),
+            return_exceptions=True,
+        )
+        return [
+            message for message, result in zip(messages, results)
+            if isinstance(result, Exception)
+            and not isinstance(result, (TelegramForbiddenError, TelegramBadRequest))
+        ]
+
+    async def close(self):
+        """Закрываем HTTP-сессию при завершении процесса"""
+        if self._bot is not None:
+            await self._bot.session.close()
+        if self._owns_bot:
+            self._bot = None
+        self._loop = None
+        self._scheduler = None
+
+
+# Единственный экземпляр на процесс: его используют и сайт, и процессы бота
+notifier = Notifier()
@@ -0,0 +1,129 @@
+# telegram_bot/outbox.py
+
+import asyncio
+import random
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import NotificationOutbox
+
+# Обработчики уведомлений по типу: асинхронные функции, принимающие payload
+HANDLERS = {
+    'order_created': 'orders.notifications.send_order_notification',
+    'order_status_changed': 'orders.notifications.send_status_change_notification',
+    'order_status_changed_batch': 'orders.notifications.send_status_change_batch',
+    'telegram_messages': 'telegram_bot.outbox.send_messages',
+}
+
+
+class PartialDeliveryError(Exception):
+    """
+    Часть сообщений пачки не доставлена.
+
+    Диспетчер заменяет уведомление на повтор только недоставленных сообщений,
+    чтобы уже получившие сообщение пользователи не получили его дважды.
+    """
+
+    def __init__(self, messages):
+        super().__init__(f'Не доставлено сообщений: {len(messages)}')
+        self.messages = messages
+
+
+async def send_messages(payload):
+    """Повторная отправка готовых сообщений, оставшихся от массовой рассылки"""
+    from .notifier import notifier
+
+    remaining = await notifier.broadcast(payload['messages'])
+    if remaining:
+        raise PartialDeliveryError(remaining)
+
+
+def get_handler(kind):
+    return import_string(HANDLERS[kind])
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повторной попыткой, со случайным разбросом"""
+    delay = min(settings.OUTBOX_MAX_RETRY_DELAY, settings.OUTBOX_BASE_RETRY_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxDispatcher:
+    """
+    Разбирает очередь уведомлений и отправляет их в Telegram.
+
+    Уведомление сначала захватывается условным UPDATE: срок следующей попытки
+    сдвигается на время аренды, поэтому несколько диспетчеров не отправят
+    одно уведомление дважды, а уведомление упавшего диспетчера вернется в очередь.
+    """
+
+    def __init__(self, batch_size=None, lease=None, max_attempts=None):
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.lease = lease or settings.OUTBOX_LEASE_SECONDS
+        self.max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+
+    def claim_batch(self):
+        now = timezone.now()
+        candidates = list(
+            NotificationOutbox.objects.filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:self.batch_size]
+        )
+        claimed = []
+        for message in candidates:
+            updated = NotificationOutbox.objects.filter(
+                pk=message.pk, status='pending', next_attempt_at=message.next_attempt_at
+            ).update(next_attempt_at=now + timedelta(seconds=self.lease), attempts=F('attempts') + 1)
+            if updated:
+                message.attempts += 1
+                claimed.append(message)
+        return claimed
+
+    def mark_sent(self, message):
+        NotificationOutbox.objects.filter(pk=message.pk).update(
+            status='sent', sent_at=timezone.now(), last_error=''
+        )
+
+    def mark_failed(self, message, error):
+        if message.attempts >= self.max_attempts:
+            # Попытки исчерпаны, оставляем уведомление для ручного разбора
+            status, next_attempt_at = 'dead', timezone.now()
+        else:
+            status = 'pending'
+            next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(message.attempts))
+        changes = {}
+        if isinstance(error, PartialDeliveryError):
+            # Повторяем только недоставленные сообщения
+            changes = {'kind': 'telegram_messages', 'payload': {'messages': error.messages}}
+        NotificationOutbox.objects.filter(pk=message.pk).update(
+            status=status, next_attempt_at=next_attempt_at, last_error=f'{type(error).__name__}: {error}', **changes
+        )
+
+    async def deliver(self, message):
+        try:
+            await get_handler(message.kind)(message.payload)
+        except Exception as e:
+            await sync_to_async(self.mark_failed)(message, e)
+            return False
+        await sync_to_async(self.mark_sent)(message)
+        return True
+
+    async def dispatch_batch(self):
+        """Отправляем одну пачку уведомлений, возвращаем количество обработанных"""
+        messages = await sync_to_async(self.claim_batch)()
+        if messages:
+            await asyncio.gather(*(self.deliver(message) for message in messages))
+        return len(messages)
+
+    async def run(self, stop_event, poll_interval=None):
+        """Разбираем очередь, пока не будет установлен stop_event"""
+        poll_interval = poll_interval or settings.OUTBOX_POLL_INTERVAL
+        while not stop_event.is_set():
+            if await self.dispatch_batch():
+                continue
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
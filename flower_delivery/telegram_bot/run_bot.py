@@ -14,15 +14,16 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'flower_delivery.settings')
 # Инициализируем Django
 django.setup()
 
-from telegram_bot.bot import bot, dp
+from telegram_bot.bot import dp
+from telegram_bot.notifier import notifier
 
 async def main():
     try:
-        # Запускаем поллинг бота
-        await dp.start_polling(bot)
+        # Запускаем поллинг бота: бот общий для процесса, через него идут и ответы на команды, и уведомления
+        await dp.start_polling(notifier.bot)
     finally:
-        # Закрываем сессию бота при завершении
-        await bot.session.close()
+        # Закрываем общую сессию бота при завершении
+        await notifier.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
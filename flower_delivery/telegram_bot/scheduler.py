@@ -0,0 +1,242 @@
+# telegram_bot/scheduler.py
+
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter
+from django.conf import settings
+
+# Ограничение Telegram на длину одного сообщения
+MESSAGE_LIMIT = 4096
+
+# Сколько последних замеров задержки хранить для метрик
+LATENCY_WINDOW = 1000
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity про запас.
+
+    Время передается снаружи (loop.time()), поэтому ведро не зависит от часов.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд появится токен"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    """Запрос к Bot API в очереди чата и ожидающие его результата вызовы"""
+    __slots__ = ('method', 'chat_id', 'kwargs', 'futures', 'enqueued_at', 'retries')
+
+    def __init__(self, method, chat_id, kwargs, future, enqueued_at):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.futures = [future]
+        self.enqueued_at = enqueued_at
+        self.retries = 0
+
+
+class _Chat:
+    __slots__ = ('bucket', 'jobs', 'busy', 'scheduled')
+
+    def __init__(self, rate):
+        self.bucket = TokenBucket(rate)
+        self.jobs = deque()
+        self.busy = False  # Запрос в этот чат уже выполняется: порядок сообщений сохраняется
+        self.scheduled = False  # Чат стоит в очереди готовности
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class SendScheduler:
+    """
+    Планировщик исходящих запросов к Telegram с учетом ограничений Bot API.
+
+    Запросы ждут своей очереди в очереди чата. Отправка проходит через два ведра
+    токенов: общее (global_rate сообщений в секунду на бота) и ведро чата
+    (chat_rate в секунду). В чат одновременно идет не больше одного запроса.
+    Несколько текстовых сообщений, накопившихся для одного чата, склеиваются
+    в одно, если помещаются в лимит длины. На TelegramRetryAfter отправка
+    приостанавливается на указанное Telegram время, и запрос повторяется.
+
+    send - корутина send(method, chat_id, kwargs), выполняющая запрос.
+    """
+
+    def __init__(self, send, global_rate=None, chat_rate=None, max_retries=None, coalesce=True):
+        self.send = send
+        self.global_bucket = TokenBucket(global_rate or settings.TELEGRAM_GLOBAL_RATE)
+        self.chat_rate = chat_rate or settings.TELEGRAM_CHAT_RATE
+        self.max_retries = max_retries if max_retries is not None else settings.TELEGRAM_RETRY_AFTER_ATTEMPTS
+        self.coalesce = coalesce
+        self.paused_until = 0
+        self._chats = {}
+        self._ready = []  # Куча (время готовности, порядковый номер, chat_id)
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._tasks = set()
+        # Метрики
+        self.queue_depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.wait_times = deque(maxlen=LATENCY_WINDOW)
+        self.send_times = deque(maxlen=LATENCY_WINDOW)
+
+    async def submit(self, method, chat_id, **kwargs):
+        """Ставим запрос в очередь чата и ждем его результата"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.chat_rate)
+        chat.jobs.append(_Job(method, chat_id, kwargs, future, loop.time()))
+        self.queue_depth += 1
+        self._schedule(chat_id, chat, loop.time())
+        return await future
+
+    def metrics(self):
+        """Глубина очереди, счетчики и задержки: ожидание в очереди и выполнение запроса, секунды"""
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': len(self._tasks),
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'failed': self.failed,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+            'wait_p50': percentile(self.wait_times, 50),
+            'wait_p95': percentile(self.wait_times, 95),
+            'send_p50': percentile(self.send_times, 50),
+            'send_p95': percentile(self.send_times, 95),
+        }
+
+    def _schedule(self, chat_id, chat, now):
+        if chat.busy or chat.scheduled or not chat.jobs:
+            return
+        chat.scheduled = True
+        heapq.heappush(self._ready, (now + chat.bucket.wait_time(now), next(self._counter), chat_id))
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._ready:
+            now = loop.time()
+            ready_at, _, chat_id = self._ready[0]
+            wait = max(ready_at - now, self.global_bucket.wait_time(now), self.paused_until - now)
+            if wait > 0:
+                # Ждем срока или появления нового чата, который может быть готов раньше
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._ready)
+            chat = self._chats[chat_id]
+            chat.scheduled = False
+            job = self._take(chat)
+            chat.bucket.consume(now)
+            self.global_bucket.consume(now)
+            chat.busy = True
+            task = asyncio.create_task(self._deliver(chat, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _take(self, chat):
+        """Первый запрос чата вместе со склеенными с ним следующими сообщениями"""
+        job = chat.jobs.popleft()
+        while self.coalesce and chat.jobs and self._can_merge(job, chat.jobs[0]):
+            other = chat.jobs.popleft()
+            job.kwargs = {**job.kwargs, 'text': job.kwargs['text'] + '\n\n' + other.kwargs['text']}
+            job.futures += other.futures
+            self.coalesced += 1
+        self.queue_depth -= len(job.futures)
+        return job
+
+    @staticmethod
+    def _can_merge(job, other):
+        if job.method != 'send_message' or other.method != 'send_message':
+            return False
+        if 'reply_markup' in job.kwargs or 'reply_markup' in other.kwargs:
+            return False
+        rest = {key: value for key, value in job.kwargs.items() if key != 'text'}
+        other_rest = {key: value for key, value in other.kwargs.items() if key != 'text'}
+        return rest == other_rest and len(job.kwargs['text']) + len(other.kwargs['text']) + 2 <= MESSAGE_LIMIT
+
+    async def _deliver(self, chat, job):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.wait_times.append(started - job.enqueued_at)
+        try:
+            result = await self.send(job.method, job.chat_id, job.kwargs)
+        except TelegramRetryAfter as error:
+            if job.retries < self.max_retries:
+                # Telegram просит подождать: приостанавливаем отправку и повторяем запрос первым в чате
+                job.retries += 1
+                self.retried += 1
+                self.paused_until = max(self.paused_until, loop.time() + error.retry_after)
+                chat.jobs.appendleft(job)
+                self.queue_depth += len(job.futures)
+            else:
+                self._finish(job, error=error)
+        except Exception as error:
+            self._finish(job, error=error)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self.send_times.append(loop.time() - started)
+            chat.busy = False
+            now = loop.time()
+            if chat.jobs:
+                self._schedule(job.chat_id, chat, now)
+            elif not chat.scheduled:
+                # Ведро чата храним, пока оно не наполнится: иначе следующее сообщение
+                # в этот чат получило бы новое полное ведро и ушло без паузы
+                loop.call_later(chat.bucket.wait_time(now), self._forget, job.chat_id, chat)
+
+    def _forget(self, chat_id, chat):
+        """Удаляем простаивающий чат с наполнившимся ведром"""
+        if self._chats.get(chat_id) is chat and not (chat.jobs or chat.busy or chat.scheduled):
+            del self._chats[chat_id]
+
+    def _finish(self, job, result=None, error=None):
+        if error is None:
+            self.sent += len(job.futures)
+        else:
+            self.failed += len(job.futures)
+        for future in job.futures:
+            # Вызывающий мог быть отменен, пока запрос ждал очереди
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
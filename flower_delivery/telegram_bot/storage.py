@@ -0,0 +1,144 @@
+# telegram_bot/storage.py
+
+import asyncio
+from datetime import timedelta
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import BotState
+
+# Как часто удалять из базы просроченные состояния
+PURGE_INTERVAL = timedelta(hours=1)
+
+
+class _Batcher:
+    """
+    Группировка обращений к базе.
+
+    Запросы, пришедшие за delay секунд (или за один проход цикла событий при
+    delay=0), выполняются одним вызовом handler(items). Каждый вызывающий
+    получает свой результат из словаря, который возвращает handler.
+    """
+
+    def __init__(self, handler, delay):
+        self.handler = handler
+        self.delay = delay
+        self._pending = {}
+        self._task = None
+
+    async def submit(self, key, item=None):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((item, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        await asyncio.sleep(self.delay)
+        pending, self._pending, self._task = self._pending, {}, None
+        try:
+            results = await self.handler({key: [item for item, _ in calls] for key, calls in pending.items()})
+        except Exception as error:
+            for calls in pending.values():
+                for _, future in calls:
+                    if not future.done():
+                        future.set_exception(error)
+            return
+        for key, calls in pending.items():
+            for _, future in calls:
+                # Вызывающий мог быть отменен, пока шел запрос
+                if not future.done():
+                    future.set_result(results.get(key))
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    Хранилище состояний FSM aiogram в базе проекта (модель BotState).
+
+    Обращения к базе идут через sync_to_async и группируются: одновременные
+    чтения разных диалогов выполняются одним SELECT, записи - одним upsert.
+    Запись завершается, только когда данные сохранены, поэтому следующее
+    обновление диалога увидит их в любом процессе бота. Каждая запись продлевает
+    срок жизни состояния на ttl секунд; просроченные состояния не читаются
+    и периодически удаляются.
+    """
+
+    def __init__(self, ttl=None, batch_delay=None, key_builder=None):
+        self.ttl = ttl if ttl is not None else settings.TELEGRAM_FSM_TTL
+        self.batch_delay = batch_delay if batch_delay is not None else settings.TELEGRAM_FSM_BATCH_DELAY
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True, with_business_connection_id=True, with_destiny=True,
+        )
+        self._reads = _Batcher(self._read, self.batch_delay)
+        self._writes = _Batcher(self._write, self.batch_delay)
+        self._last_purge = None
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await self._writes.submit(self.key_builder.build(key), ('state', state))
+
+    async def get_state(self, key):
+        row = await self._reads.submit(self.key_builder.build(key))
+        return row[0] if row else None
+
+    async def set_data(self, key, data):
+        await self._writes.submit(self.key_builder.build(key), ('data', dict(data)))
+
+    async def get_data(self, key):
+        row = await self._reads.submit(self.key_builder.build(key))
+        return dict(row[1]) if row else {}
+
+    async def close(self):
+        pass
+
+    async def _read(self, requests):
+        return await sync_to_async(self.read_rows)(list(requests))
+
+    async def _write(self, requests):
+        await sync_to_async(self.write_rows)(requests)
+        return {}
+
+    def expires_at(self, now):
+        return now + timedelta(seconds=self.ttl) if self.ttl else None
+
+    def read_rows(self, keys):
+        """Состояние и данные диалогов одним запросом: {ключ: (state, data)}"""
+        rows = BotState.objects.filter(key__in=keys).filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+        ).values_list('key', 'state', 'data')
+        return {key: (state, data) for key, state, data in rows}
+
+    def write_rows(self, requests):
+        """
+        Сохраняем накопленные записи: requests - {ключ: [(поле, значение), ...]}.
+
+        Состояния и данные пишутся отдельными upsert, чтобы запись одного поля
+        не затирала другое. Из нескольких записей одного поля побеждает последняя.
+        """
+        now = timezone.now()
+        expires_at = self.expires_at(now)
+        changes = {'state': {}, 'data': {}}
+        for key, writes in requests.items():
+            for field, value in writes:
+                changes[field][key] = value
+        # Просроченная строка не должна ожить: запись одного поля вернула бы и прежнее значение другого
+        BotState.objects.filter(key__in=list(requests), expires_at__lte=now).delete()
+        for field, values in changes.items():
+            if values:
+                BotState.objects.bulk_create(
+                    [BotState(key=key, expires_at=expires_at, **{field: value}) for key, value in values.items()],
+                    update_conflicts=True,
+                    unique_fields=['key'],
+                    update_fields=[field, 'expires_at', 'updated_at'],
+                )
+        # Диалог без состояния и данных хранить незачем
+        cleared = [key for key, value in changes['state'].items() if value is None] + \
+            [key for key, value in changes['data'].items() if not value]
+        if cleared:
+            BotState.objects.filter(key__in=cleared, state__isnull=True, data={}).delete()
+        if self.ttl and (self._last_purge is None or now - self._last_purge > PURGE_INTERVAL):
+            self._last_purge = now
+            BotState.objects.filter(expires_at__lte=now).delete()
@@ -1,3 +1,725 @@
-from django.test import TestCase
+# telegram_bot/tests.py
 
-# Create your tests here.
+import json
+from datetime import timedelta
+from io import StringIO
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import TCPConnector
+from aiohttp.test_utils import TestClient, TestServer
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import SyncToAsync, async_to_sync
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from flower_delivery.testing import FakeBotSession
+from orders.models import Order
+from users.models import Profile
+from .handlers import OrdersPage, get_orders_page, get_status_menu, register_handlers
+from .models import BotState, NotificationOutbox
+from .notifier import Notifier
+from .outbox import OutboxDispatcher, PartialDeliveryError
+from .scheduler import SendScheduler
+from .storage import DatabaseStorage
+from .webhook import SECRET_HEADER, WEBHOOK_HANDLER, create_app
+from .management.commands.bench_webhook import RECORDED_UPDATES
+import asyncio
+
+calls = []
+
+
+async def successful_handler(payload):
+    calls.append(payload)
+
+
+async def failing_handler(payload):
+    raise ConnectionError('Telegram недоступен')
+
+
+async def partial_handler(payload):
+    raise PartialDeliveryError(payload['messages'][1:])
+
+
+TEST_HANDLERS = {
+    'ok': 'telegram_bot.tests.successful_handler',
+    'fail': 'telegram_bot.tests.failing_handler',
+    'partial': 'telegram_bot.tests.partial_handler',
+}
+
+
+@patch('telegram_bot.outbox.HANDLERS', TEST_HANDLERS)
+@override_settings(OUTBOX_MAX_ATTEMPTS=3, OUTBOX_BASE_RETRY_DELAY=5, OUTBOX_MAX_RETRY_DELAY=60)
+class OutboxDispatcherTest(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.dispatcher = OutboxDispatcher()
+
+    def dispatch(self):
+        return async_to_sync(self.dispatcher.dispatch_batch)()
+
+    def test_successful_delivery_marks_sent(self):
+        """
+        Успешно отправленное уведомление помечается как отправленное.
+        """
+        message = NotificationOutbox.enqueue('ok', order_id=1)
+        self.assertEqual(self.dispatch(), 1)
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'sent')
+        self.assertEqual(message.attempts, 1)
+        self.assertIsNotNone(message.sent_at)
+        self.assertEqual(calls, [{'order_id': 1}])
+        # Повторно уведомление не отправляется
+        self.assertEqual(self.dispatch(), 0)
+
+    def test_failure_schedules_retry_with_backoff(self):
+        """
+        После ошибки уведомление возвращается в очередь с задержкой.
+        """
+        message = NotificationOutbox.enqueue('fail', order_id=1)
+        before = timezone.now()
+        self.dispatch()
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'pending')
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('ConnectionError', message.last_error)
+        self.assertGreaterEqual(message.next_attempt_at, before + timedelta(seconds=4))
+        # До наступления срока повторной попытки уведомление не выбирается
+        self.assertEqual(self.dispatch(), 0)
+
+    def test_dead_letter_after_max_attempts(self):
+        """
+        После исчерпания попыток уведомление помечается как недоставленное.
+        """
+        message = NotificationOutbox.enqueue('fail', order_id=1)
+        for _ in range(3):
+            NotificationOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+            self.dispatch()
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'dead')
+        self.assertEqual(message.attempts, 3)
+
+    def test_claimed_message_is_hidden_from_other_dispatchers(self):
+        """
+        Захваченное уведомление не достается второму диспетчеру.
+        """
+        NotificationOutbox.enqueue('ok', order_id=1)
+        self.assertEqual(len(self.dispatcher.claim_batch()), 1)
+        self.assertEqual(OutboxDispatcher().claim_batch(), [])
+
+
+    def test_partial_delivery_retries_only_remaining_messages(self):
+        """
+        При частичной доставке повторяются только недоставленные сообщения.
+        """
+        messages = [{'chat_id': 1, 'text': 'первое'}, {'chat_id': 2, 'text': 'второе'}]
+        message = NotificationOutbox.enqueue('partial', messages=messages)
+        self.dispatch()
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'pending')
+        self.assertEqual(message.kind, 'telegram_messages')
+        self.assertEqual(message.payload, {'messages': messages[1:]})
+
+
+class CountingBot:
+    """
+    Заглушка Bot API, считающая одновременные запросы.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.sent = 0
+        self.closed = False
+        self.session = self
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        self.sent += 1
+
+    async def close(self):
+        self.closed = True
+
+
+class NotifierTest(TestCase):
+    @override_settings(TELEGRAM_GLOBAL_RATE=1000)
+    def test_concurrency_is_bounded(self):
+        """
+        Одновременно выполняется не больше concurrency запросов через один бот.
+        """
+        bot = CountingBot()
+        notifier = Notifier(bot=bot, concurrency=3)
+
+        async def burst():
+            await asyncio.gather(*(notifier.send_message(chat_id=chat_id, text='тест') for chat_id in range(10)))
+
+        async_to_sync(burst)()
+        self.assertEqual(bot.sent, 10)
+        self.assertEqual(bot.max_active, 3)
+
+    @override_settings(TELEGRAM_GLOBAL_RATE=50)
+    def test_broadcast_is_rate_limited(self):
+        """
+        Рассылка не превышает общий лимит бота в секунду из планировщика отправки.
+        """
+        bot = CountingBot()
+        notifier = Notifier(bot=bot, concurrency=10)
+        messages = [{'chat_id': chat_id, 'text': 'тест'} for chat_id in range(6)]
+
+        async def broadcast():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            remaining = await notifier.broadcast(messages)
+            return remaining, loop.time() - started
+
+        remaining, elapsed = async_to_sync(broadcast)()
+        self.assertEqual(remaining, [])
+        self.assertEqual(bot.sent, 6)
+        # Шестое сообщение отправляется не раньше чем через 5/50 секунды
+        self.assertGreaterEqual(elapsed, 0.1)
+
+    @override_settings(TELEGRAM_GLOBAL_RATE=1000)
+    def test_broadcast_returns_failed_messages(self):
+        """
+        Рассылка возвращает сообщения, которые не удалось отправить из-за временной ошибки.
+        """
+        bot = CountingBot()
+
+        async def send_message(chat_id, text, **kwargs):
+            if chat_id == 2:
+                raise ConnectionError('Telegram недоступен')
+
+        bot.send_message = send_message
+        notifier = Notifier(bot=bot)
+        messages = [{'chat_id': chat_id, 'text': 'тест'} for chat_id in range(3)]
+        remaining = async_to_sync(notifier.broadcast)(messages)
+        self.assertEqual(remaining, [{'chat_id': 2, 'text': 'тест'}])
+
+    @override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+    def test_owned_bot_shares_one_session(self):
+        """
+        Собственный бот создается один раз и закрывается методом close().
+        """
+        notifier = Notifier()
+        bot = notifier.bot
+        self.assertIs(notifier.bot, bot)
+
+        async def close():
+            await notifier._bind_loop()
+            with patch('telegram_bot.notifier.TCPConnector', wraps=TCPConnector) as connector:
+                client = await bot.session.create_session()
+                self.assertIs(await bot.session.create_session(), client)
+            self.assertEqual(connector.call_args.kwargs['keepalive_timeout'], notifier.keepalive_timeout)
+            await notifier.close()
+            self.assertTrue(client.closed)
+
+        async_to_sync(close)()
+        self.assertIsNone(notifier._bot)
+
+    @override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+    def test_new_event_loop_closes_previous_session(self):
+        """
+        В новом цикле событий бот пересоздается, а сессия прежнего цикла закрывается.
+        """
+        notifier = Notifier()
+
+        async def open_session():
+            await notifier._bind_loop()
+            return notifier.bot, await notifier.bot.session.create_session()
+
+        old_bot, old_client = async_to_sync(open_session)()
+        new_bot, new_client = async_to_sync(open_session)()
+        self.assertIsNot(new_bot, old_bot)
+        self.assertTrue(old_client.closed)
+        self.assertFalse(new_client.closed)
+        async_to_sync(notifier.close)()
+
+
+class SendSchedulerTest(TestCase):
+    def setUp(self):
+        self.requests = []
+
+    async def send(self, method, chat_id, kwargs):
+        self.requests.append((method, chat_id, kwargs, asyncio.get_running_loop().time()))
+        return f'ok {len(self.requests)}'
+
+    def run_scheduler(self, scenario, **options):
+        async def run():
+            scheduler = SendScheduler(self.send, **{'global_rate': 1000, 'chat_rate': 1000, **options})
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            results = await scenario(scheduler)
+            return scheduler, results, loop.time() - started
+        return async_to_sync(run)()
+
+    def test_per_chat_rate(self):
+        """
+        В один чат сообщения уходят по очереди и не чаще chat_rate в секунду.
+        """
+        async def scenario(scheduler):
+            return await asyncio.gather(*(
+                scheduler.submit('send_message', 1, text=f'{i}', reply_markup='keyboard') for i in range(3)
+            ))
+
+        scheduler, results, elapsed = self.run_scheduler(scenario, chat_rate=20)
+        self.assertEqual([kwargs['text'] for _, _, kwargs, _ in self.requests], ['0', '1', '2'])
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertEqual(results, ['ok 1', 'ok 2', 'ok 3'])
+
+    def test_per_chat_rate_for_consecutive_messages(self):
+        """
+        Сообщения, отправленные в чат одно за другим, тоже не превышают chat_rate в секунду.
+        """
+        async def scenario(scheduler):
+            for i in range(3):
+                await scheduler.submit('send_message', 1, text=f'{i}')
+            # Когда ведро наполнилось, простаивающий чат удаляется
+            await asyncio.sleep(0.1)
+            return scheduler.metrics()['chats']
+
+        scheduler, chats, _ = self.run_scheduler(scenario, chat_rate=20)
+        times = [sent_at for _, _, _, sent_at in self.requests]
+        self.assertGreaterEqual(times[1] - times[0], 0.045)
+        self.assertGreaterEqual(times[2] - times[1], 0.045)
+        self.assertEqual(chats, 0)
+
+    def test_global_rate(self):
+        """
+        Сообщения в разные чаты не превышают общий лимит бота.
+        """
+        async def scenario(scheduler):
+            await asyncio.gather(*(scheduler.submit('send_message', chat_id, text='тест') for chat_id in range(6)))
+
+        scheduler, _, elapsed = self.run_scheduler(scenario, global_rate=50)
+        self.assertEqual(len(self.requests), 6)
+        # Шестое сообщение уходит не раньше чем через 5/50 секунды
+        self.assertGreaterEqual(elapsed, 0.1)
+
+    def test_messages_to_one_chat_are_coalesced(self):
+        """
+        Накопившиеся текстовые сообщения одному чату склеиваются в одно, фото - нет.
+        """
+        async def scenario(scheduler):
+            return await asyncio.gather(
+                scheduler.submit('send_message', 1, text='Заказ №1', parse_mode='HTML'),
+                scheduler.submit('send_message', 1, text='Заказ №2', parse_mode='HTML'),
+                scheduler.submit('send_message', 1, text='Заказ №3', parse_mode='HTML'),
+                scheduler.submit('send_photo', 1, photo='file-id'),
+                scheduler.submit('send_message', 2, text='Заказ №4', parse_mode='HTML'),
+            )
+
+        scheduler, results, _ = self.run_scheduler(scenario)
+        sent = [(method, chat_id, kwargs) for method, chat_id, kwargs, _ in self.requests]
+        self.assertIn(('send_message', 1, {'text': 'Заказ №1\n\nЗаказ №2\n\nЗаказ №3', 'parse_mode': 'HTML'}), sent)
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(len(set(results[:3])), 1)
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics['coalesced'], 2)
+        self.assertEqual(metrics['sent'], 5)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertIsNotNone(metrics['wait_p95'])
+
+    def test_retry_after_is_honoured(self):
+        """
+        После TelegramRetryAfter отправка ждет указанное время и повторяет запрос.
+        """
+        async def send(method, chat_id, kwargs):
+            if not self.requests:
+                self.requests.append(method)
+                raise TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text='тест'), message='Flood', retry_after=1)
+            return 'ok'
+
+        self.send = send
+
+        async def scenario(scheduler):
+            return await scheduler.submit('send_message', 1, text='тест')
+
+        scheduler, result, elapsed = self.run_scheduler(scenario)
+        self.assertEqual(result, 'ok')
+        self.assertGreaterEqual(elapsed, 1)
+        self.assertEqual(scheduler.metrics()['retried'], 1)
+
+    def test_errors_reach_caller(self):
+        """
+        Ошибка запроса возвращается вызывающему и не останавливает очередь.
+        """
+        async def send(method, chat_id, kwargs):
+            if chat_id == 1:
+                raise ConnectionError('Telegram недоступен')
+            return 'ok'
+
+        self.send = send
+
+        async def scenario(scheduler):
+            return await asyncio.gather(
+                scheduler.submit('send_message', 1, text='тест'),
+                scheduler.submit('send_message', 2, text='тест'),
+                return_exceptions=True,
+            )
+
+        scheduler, results, _ = self.run_scheduler(scenario)
+        self.assertIsInstance(results[0], ConnectionError)
+        self.assertEqual(results[1], 'ok')
+        self.assertEqual(scheduler.metrics()['failed'], 1)
+
+
+@override_settings(ADMIN_TELEGRAM_ID='1', TELEGRAM_ORDERS_PAGE_SIZE=3)
+class OrdersPageTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='TestPassword123')
+        self.orders = [
+            Order.objects.create(user=self.user, total_price=100 + i, address='Address', phone='123')
+            for i in range(7)
+        ]
+        # Часть заказов создана в одну и ту же секунду: курсор должен различать их по ID
+        Order.objects.filter(pk__in=[order.pk for order in self.orders[2:5]]).update(
+            created_at=self.orders[2].created_at
+        )
+        Order.objects.filter(pk=self.orders[6].pk).update(status='completed')
+        self.router = register_handlers()
+
+    def get_handler(self, observer, name):
+        return next(handler.callback for handler in observer.handlers if handler.callback.__name__ == name)
+
+    def make_callback(self, user_id=1):
+        return SimpleNamespace(
+            from_user=SimpleNamespace(id=user_id),
+            message=SimpleNamespace(edit_text=AsyncMock()),
+            answer=AsyncMock(),
+        )
+
+    def test_pages_follow_cursor(self):
+        """
+        Страницы по курсору проходят все заказы статуса по одному разу, каждая одним запросом.
+        """
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                text, keyboard = async_to_sync(get_orders_page)('pending', cursor)
+            seen += [int(line.split('№')[1].split(',')[0]) for line in text.splitlines()[1:]]
+            buttons = [button.callback_data for row in keyboard.inline_keyboard for button in row]
+            next_pages = [OrdersPage.unpack(data) for data in buttons if data.startswith('orders:') and ':pending::' not in data]
+            if not next_pages:
+                break
+            cursor = next_pages[0].cursor
+        expected = sorted((order.pk for order in self.orders[:6]), reverse=True)
+        self.assertEqual(sorted(seen, reverse=True), expected)
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_callback_data_round_trip(self):
+        """
+        Курсор в данных кнопки восстанавливается без потерь и укладывается в 64 байта.
+        """
+        order = Order.objects.get(pk=self.orders[3].pk)
+        data = OrdersPage.after('in_progress', (order.created_at, order.pk)).pack()
+        self.assertLessEqual(len(data.encode()), 64)
+        self.assertEqual(OrdersPage.unpack(data).cursor, (order.created_at, order.pk))
+
+    def test_status_menu(self):
+        """
+        Меню статусов считает заказы одним запросом и дает кнопки только непустым статусам.
+        """
+        with self.assertNumQueries(1):
+            text, keyboard = async_to_sync(get_status_menu)()
+        self.assertIn('В ожидании: 6', text)
+        buttons = [button.callback_data for row in keyboard.inline_keyboard for button in row]
+        self.assertEqual(buttons, [OrdersPage(status='pending').pack(), OrdersPage(status='completed').pack()])
+
+    def test_callback_edits_message(self):
+        """
+        Нажатие кнопки заменяет текст сообщения следующей страницей.
+        """
+        handler = self.get_handler(self.router.callback_query, 'show_orders_page')
+        callback = self.make_callback()
+        async_to_sync(handler)(callback, OrdersPage(status='completed'))
+        text = callback.message.edit_text.call_args.args[0]
+        self.assertIn(f'Заказ №{self.orders[6].pk}', text)
+        callback.answer.assert_awaited_once_with()
+
+    def test_callback_requires_admin(self):
+        """
+        Кнопки страниц заказов доступны только администратору.
+        """
+        handler = self.get_handler(self.router.callback_query, 'show_orders_page')
+        callback = self.make_callback(user_id=2)
+        async_to_sync(handler)(callback, OrdersPage(status='pending'))
+        callback.message.edit_text.assert_not_awaited()
+        self.assertTrue(callback.answer.call_args.kwargs['show_alert'])
+
+
+@override_settings(ADMIN_TELEGRAM_ID='1')
+class HandlerQueryTest(TestCase):
+    """Обработчики команд обращаются к базе через асинхронный ORM минимальным числом запросов"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='TestPassword123')
+        self.order = Order.objects.create(user=self.user, total_price=1500, address='Address', phone='123')
+        Order.objects.create(user=self.user, total_price=500, address='Address', phone='123')
+        router = register_handlers()
+        self.handlers = {handler.callback.__name__: handler.callback for handler in router.message.handlers}
+
+    def call(self, name, text, user_id=1):
+        message = SimpleNamespace(from_user=SimpleNamespace(id=user_id), text=text, answer=AsyncMock())
+        async_to_sync(self.handlers[name])(message)
+        return message.answer.call_args.args[0]
+
+    def test_daily_report(self):
+        """
+        Отчет за день - один агрегирующий запрос к сводке продаж.
+        """
+        with self.assertNumQueries(1):
+            text = self.call('daily_report', '/daily_report')
+        self.assertIn('Всего заказов: 2', text)
+        self.assertIn('Общая выручка: 2000', text)
+
+    def test_link_account(self):
+        """
+        Привязка Telegram - поиск профиля по имени и обновление одного поля, без ленивых запросов.
+        """
+        with self.assertNumQueries(2):
+            text = self.call('link_account', '/link buyer', user_id=777)
+        self.assertIn('связан с пользователем buyer', text)
+        self.assertEqual(Profile.objects.get(user=self.user).telegram_id, '777')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.call('link_account', '/link nobody'), 'Пользователь с таким именем не найден.')
+
+    def test_order_lists(self):
+        """
+        Страница заказов и меню статусов - по одному запросу.
+        """
+        with self.assertNumQueries(1):
+            text = self.call('list_orders', '/orders')
+        self.assertIn(f'Заказ №{self.order.id}', text)
+        with self.assertNumQueries(1):
+            self.assertIn('В ожидании: 2', self.call('list_orders_with_status', '/orders_status'))
+
+    def test_set_status(self):
+        """
+        Смена статуса загружает заказ одним запросом, повторная смена на тот же статус в базу не пишет.
+        """
+        self.call('set_order_status', f'/set_status {self.order.id} accepted')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'accepted')
+        with self.assertNumQueries(1):
+            text = self.call('set_order_status', f'/set_status {self.order.id} accepted')
+        self.assertIn('уже в статусе', text)
+
+    def test_handler_latency(self):
+        """
+        Задержка обработчика без замера времени: один переход в поток базы на каждый запрос
+        и один вызов Bot API на ответ, без лишних переходов через sync_to_async.
+        """
+        commands = [
+            ('daily_report', '/daily_report', 1),
+            ('list_orders', '/orders', 1),
+            ('list_orders_with_status', '/orders_status', 1),
+            ('link_account', '/link buyer', 2),
+        ]
+        original_call = SyncToAsync.__call__
+        for name, text, expected_hops in commands:
+            hops = []
+
+            async def counting_call(self, *args, **kwargs):
+                hops.append(self.func)
+                return await original_call(self, *args, **kwargs)
+
+            message = SimpleNamespace(from_user=SimpleNamespace(id=1), text=text, answer=AsyncMock())
+            with patch.object(SyncToAsync, '__call__', counting_call):
+                async_to_sync(self.handlers[name])(message)
+            self.assertEqual(message.answer.await_count, 1, name)
+            self.assertEqual(len(hops), expected_hops, f'{name}: {hops}')
+
+
+class BlockingDispatcher:
+    """Диспетчер, который держит обновления до сигнала и считает одновременно обрабатываемые"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.updates = []
+        self.active = 0
+        self.max_active = 0
+
+    async def feed_update(self, bot, update):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await self.release.wait()
+            self.updates.append(update.update_id)
+        finally:
+            self.active -= 1
+
+
+@override_settings(TELEGRAM_WEBHOOK_PATH='/webhook/')
+class WebhookTest(TestCase):
+    def setUp(self):
+        self.bot = Bot(token='123456:TEST-TOKEN', session=FakeBotSession())
+        with open(RECORDED_UPDATES, encoding='utf-8') as file:
+            self.updates = json.load(file)
+
+    def run_app(self, app, scenario):
+        async def run():
+            async with TestClient(TestServer(app)) as client:
+                return await scenario(client)
+        return async_to_sync(run)()
+
+    def test_rejects_wrong_secret(self):
+        """
+        Запросы без секретного токена или с чужим токеном отклоняются.
+        """
+        dispatcher = BlockingDispatcher()
+        app = create_app(dispatcher, self.bot, secret_token='s3cret')
+
+        async def scenario(client):
+            missing = await client.post('/webhook/', json=self.updates[0])
+            wrong = await client.post('/webhook/', json=self.updates[0], headers={SECRET_HEADER: 'other'})
+            return missing.status, wrong.status
+
+        self.assertEqual(self.run_app(app, scenario), (401, 401))
+        self.assertEqual(dispatcher.updates, [])
+
+    def test_concurrency_is_bounded(self):
+        """
+        Одновременно обрабатывается не больше max_concurrent обновлений, остальные ждут.
+        """
+        dispatcher = BlockingDispatcher()
+        app = create_app(dispatcher, self.bot, secret_token='s3cret', max_concurrent=2)
+
+        async def scenario(client):
+            headers = {SECRET_HEADER: 's3cret'}
+            requests = [
+                asyncio.ensure_future(client.post('/webhook/', json={**self.updates[0], 'update_id': i}, headers=headers))
+                for i in range(5)
+            ]
+            await asyncio.sleep(0.2)
+            answered = sum(request.done() for request in requests)
+            dispatcher.release.set()
+            statuses = [(await request).status for request in requests]
+            await asyncio.gather(*app[WEBHOOK_HANDLER]._tasks)
+            return answered, statuses
+
+        answered, statuses = self.run_app(app, scenario)
+        self.assertEqual(answered, 2)
+        self.assertEqual(statuses, [200] * 5)
+        self.assertEqual(dispatcher.max_active, 2)
+        self.assertEqual(sorted(dispatcher.updates), list(range(5)))
+
+    @override_settings(ADMIN_TELEGRAM_ID='5000001')
+    def test_replays_recorded_updates(self):
+        """
+        Записанные обновления проходят через настоящие обработчики, каждое получает ответ бота.
+        """
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        dispatcher.include_router(register_handlers())
+        app = create_app(dispatcher, self.bot, secret_token='s3cret')
+
+        async def scenario(client):
+            for update in self.updates:
+                response = await client.post('/webhook/', json=update, headers={SECRET_HEADER: 's3cret'})
+                self.assertEqual(response.status, 200)
+            await asyncio.gather(*app[WEBHOOK_HANDLER]._tasks)
+
+        self.run_app(app, scenario)
+        methods = [type(method).__name__ for method in self.bot.session.requests]
+        self.assertEqual(methods.count('SendMessage'), 7)
+        self.assertEqual(methods.count('EditMessageText'), 2)
+        self.assertEqual(methods.count('AnswerCallbackQuery'), 2)
+
+    def test_bench_command(self):
+        """
+        Нагрузочный замер воспроизводит записанные обновления на временной базе и печатает результаты.
+        """
+        out = StringIO()
+        # Тест уже идет на тестовой базе, поэтому подменяем ее создание, удаление и наполнение
+        command = 'telegram_bot.management.commands.bench_webhook'
+        with patch(f'{command}.setup_databases', return_value='old_config') as setup_databases, \
+                patch(f'{command}.teardown_databases') as teardown_databases, \
+                patch(f'{command}.Command.create_data') as create_data:
+            call_command('bench_webhook', repeat=2, latency=0, stdout=out)
+        self.assertIn(f'Обновлений: {len(self.updates) * 2}', out.getvalue())
+        setup_databases.assert_called_once()
+        create_data.assert_called_once()
+        teardown_databases.assert_called_once_with('old_config', verbosity=0)
+
+
+class OrderForm(StatesGroup):
+    address = State()
+    phone = State()
+
+
+class DatabaseStorageTest(TestCase):
+    def setUp(self):
+        self.storage = DatabaseStorage(ttl=3600, batch_delay=0)
+
+    def make_key(self, chat_id):
+        return StorageKey(bot_id=123456, chat_id=chat_id, user_id=chat_id)
+
+    def test_state_survives_restart(self):
+        """
+        Состояние и данные диалога сохраняются в базе и видны новому экземпляру хранилища.
+        """
+        async def scenario():
+            context = FSMContext(self.storage, self.make_key(1))
+            await context.set_state(OrderForm.address)
+            await context.update_data(address='ул. Цветочная, 1')
+            restarted = FSMContext(DatabaseStorage(batch_delay=0), self.make_key(1))
+            return await restarted.get_state(), await restarted.get_data()
+
+        state, data = async_to_sync(scenario)()
+        self.assertEqual(state, 'OrderForm:address')
+        self.assertEqual(data, {'address': 'ул. Цветочная, 1'})
+
+    def test_concurrent_calls_are_batched(self):
+        """
+        Одновременные записи и чтения разных диалогов выполняются одним запросом каждые.
+        """
+        keys = [self.make_key(chat_id) for chat_id in range(1, 21)]
+
+        async def write():
+            await asyncio.gather(*(self.storage.set_state(key, 'OrderForm:phone') for key in keys))
+
+        async def read():
+            return await asyncio.gather(*(self.storage.get_state(key) for key in keys))
+
+        async_to_sync(write)()  # Первая запись заодно удаляет просроченные состояния
+        # Удаление просроченных среди записываемых ключей и один upsert на 20 диалогов
+        with self.assertNumQueries(2):
+            async_to_sync(write)()
+        with self.assertNumQueries(1):
+            states = async_to_sync(read)()
+        self.assertEqual(states, ['OrderForm:phone'] * 20)
+        self.assertEqual(BotState.objects.count(), 20)
+
+    def test_expired_state_is_not_read(self):
+        """
+        Просроченное состояние не читается и не оживает при записи данных.
+        """
+        key = self.make_key(1)
+        async_to_sync(self.storage.set_state)(key, 'OrderForm:phone')
+        BotState.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(async_to_sync(self.storage.get_state)(key))
+
+        async_to_sync(self.storage.set_data)(key, {'phone': '123'})
+        self.assertIsNone(async_to_sync(self.storage.get_state)(key))
+        self.assertEqual(async_to_sync(self.storage.get_data)(key), {'phone': '123'})
+        self.assertGreater(BotState.objects.get().expires_at, timezone.now())
+
+    def test_cleared_dialog_is_deleted(self):
+        """
+        Диалог без состояния и данных удаляется из базы.
+        """
+        async def scenario():
+            context = FSMContext(self.storage, self.make_key(1))
+            await context.set_state(OrderForm.phone)
+            await context.set_data({'phone': '123'})
+            await context.clear()
+
+        async_to_sync(scenario)()
+        self.assertFalse(BotState.objects.exists())
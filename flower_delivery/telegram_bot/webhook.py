@@ -0,0 +1,86 @@
+# telegram_bot/webhook.py
+
+import asyncio
+import hmac
+import logging
+from aiogram.types import Update
+from aiohttp import web
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает secret_token, заданный в setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookHandler:
+    """
+    Прием обновлений Telegram по вебхуку.
+
+    Проверяет секретный токен, сразу отвечает Telegram и обрабатывает обновление
+    диспетчером в фоне. Одновременно обрабатывается не больше max_concurrent
+    обновлений: когда все места заняты, ответ на новый запрос ждет
+    освобождения места, и Telegram сам снижает темп доставки.
+    """
+
+    def __init__(self, dispatcher, bot, secret_token=None, max_concurrent=None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token if secret_token is not None else settings.TELEGRAM_WEBHOOK_SECRET
+        self.max_concurrent = max_concurrent or settings.TELEGRAM_WEBHOOK_MAX_CONCURRENT_UPDATES
+        self._semaphore = None
+        self._tasks = set()
+
+    def register(self, app, path):
+        app.router.add_post(path, self.handle)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+
+    async def on_startup(self, app):
+        # Семафор создаем в цикле событий сервера
+        self._semaphore = asyncio.BoundedSemaphore(self.max_concurrent)
+
+    async def on_shutdown(self, app):
+        # Дожидаемся обновлений, которые уже приняты: Telegram не пришлет их повторно
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def verify(self, request):
+        if not self.secret_token:
+            return True
+        received = request.headers.get(SECRET_HEADER, '')
+        return hmac.compare_digest(received.encode(), self.secret_token.encode())
+
+    async def handle(self, request):
+        if not self.verify(request):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except ValueError:
+            return web.Response(status=400)
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self.process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def process(self, update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            # Ответ Telegram уже отправлен, повторной доставки не будет: только записываем ошибку
+            logger.exception('Ошибка обработки обновления %s', update.update_id)
+        finally:
+            self._semaphore.release()
+
+
+WEBHOOK_HANDLER = web.AppKey('webhook_handler', WebhookHandler)
+
+
+def create_app(dispatcher, bot, path=None, secret_token=None, max_concurrent=None):
+    """Приложение aiohttp с обработчиком вебхука по адресу path"""
+    app = web.Application()
+    handler = WebhookHandler(dispatcher, bot, secret_token=secret_token, max_concurrent=max_concurrent)
+    handler.register(app, path or settings.TELEGRAM_WEBHOOK_PATH)
+    app[WEBHOOK_HANDLER] = handler
+    return app
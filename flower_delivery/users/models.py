@@ -17,6 +17,10 @@ class Profile(models.Model):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Поиск профиля по Telegram ID при командах бота
+            models.Index(fields=['telegram_id'], name='profile_telegram_id_idx'),
+        ]
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -3,10 +3,16 @@
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
-from unittest.mock import patch, call  # Добавляем call
+from unittest.mock import patch
 from orders.models import Order, OrderItem
+from orders.cart import load_lines
 from products.models import Product
 from django.core.files.uploadedfile import SimpleUploadedFile
+from telegram_bot.models import NotificationOutbox
+from flower_delivery.testing import QueryPlanMixin, TemporaryMediaMixin
+from .models import Profile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 class UserRegistrationTest(TestCase):
@@ -107,7 +113,7 @@ class UserLogoutTest(TestCase):
         self.assertFalse(user.is_authenticated)
 
 
-class UserProfileTest(TestCase):
+class UserProfileTest(TemporaryMediaMixin, TestCase):
     def setUp(self):
         """
         Создаем пользователя и входим в систему для тестирования профиля.
@@ -135,6 +141,61 @@ class UserProfileTest(TestCase):
         response = self.client.get(reverse('profile'))
         self.assertRedirects(response, f'{reverse("login")}?next={reverse("profile")}')
 
+    def test_cancel_pending_order(self):
+        """
+        Покупатель может отменить заказ в ожидании, уведомление ставится в очередь.
+        """
+        order = Order.objects.create(user=self.user, total_price=1000.00, address='Test Address 123', phone='1234567890')
+        response = self.client.post(reverse('cancel_order', args=[order.id]))
+        self.assertRedirects(response, reverse('profile'))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'canceled')
+        self.assertTrue(NotificationOutbox.objects.filter(kind='order_status_changed').exists())
+
+    def create_orders(self, status, count):
+        return [
+            Order.objects.create(user=self.user, status=status, total_price=100, address='Address', phone='123')
+            for _ in range(count)
+        ]
+
+    def test_profile_query_count_does_not_depend_on_history(self):
+        """
+        Число запросов профиля не зависит от количества заказов и статусов.
+        """
+        self.create_orders('pending', 1)
+        with CaptureQueriesContext(connection) as few_orders:
+            self.client.get(reverse('profile'))
+
+        for status, _ in Order.STATUS_CHOICES:
+            self.create_orders(status, 15)
+        with CaptureQueriesContext(connection) as many_orders:
+            response = self.client.get(reverse('profile'))
+
+        self.assertEqual(len(few_orders), len(many_orders))
+        groups = response.context['order_groups']
+        self.assertEqual(len(groups), len(Order.STATUS_CHOICES))
+        self.assertEqual(groups[0]['page'].paginator.count, 16)
+        self.assertEqual(len(groups[0]['page']), 10)
+
+    def test_profile_pages_are_independent_per_status(self):
+        """
+        Страница каждого статуса выбирается своим параметром, остальные остаются на своих страницах.
+        """
+        completed = self.create_orders('completed', 12)
+        self.create_orders('canceled', 3)
+
+        response = self.client.get(reverse('profile'), {'page_completed': 2})
+        groups = {group['status']: group for group in response.context['order_groups']}
+        self.assertEqual([order.id for order in groups['completed']['page']], [completed[1].id, completed[0].id])
+        self.assertTrue(groups['completed']['is_open'])
+        self.assertEqual(len(groups['canceled']['page']), 3)
+        self.assertEqual(groups['canceled']['page_query'], 'page_completed=2&page_canceled=')
+        self.assertContains(response, 'href="?page_completed=1"')
+
+        # Некорректный номер страницы заменяется ближайшим допустимым
+        response = self.client.get(reverse('profile'), {'page_completed': 99})
+        self.assertEqual(response.context['order_groups'][0]['page'].number, 2)
+
     @patch('users.views.Cart')  # Мокаем класс Cart в users.views
     def test_reorder_adds_items_to_cart(self, mock_cart_class):
         """
@@ -181,13 +242,8 @@ class UserProfileTest(TestCase):
         response = self.client.get(reverse('reorder', args=[order.id]))
         self.assertRedirects(response, reverse('cart_detail'))
 
-        # Проверяем, что метод add был вызван для каждого доступного товара с правильными аргументами
-        expected_calls = [
-            call(product=product1, quantity=2),
-            call(product=product2, quantity=1),
-        ]
-        mock_cart.add.assert_has_calls(expected_calls, any_order=True)
-        self.assertEqual(mock_cart.add.call_count, 2)
+        # Проверяем, что все доступные товары добавлены одним вызовом add_many
+        mock_cart.add_many.assert_called_once_with([(product1, 2), (product2, 1)])
 
         # Проверяем, что сообщения об успешном добавлении отображаются
         messages = list(response.wsgi_request._messages)
@@ -239,12 +295,8 @@ class UserProfileTest(TestCase):
         response = self.client.get(reverse('reorder', args=[order.id]))
         self.assertRedirects(response, reverse('cart_detail'))
 
-        # Проверяем, что метод add был вызван только для доступного товара с правильными аргументами
-        expected_calls = [
-            call(product=product1, quantity=1),
-        ]
-        mock_cart.add.assert_has_calls(expected_calls, any_order=True)
-        self.assertEqual(mock_cart.add.call_count, 1)
+        # Проверяем, что add_many получил только доступный товар
+        mock_cart.add_many.assert_called_once_with([(product1, 1)])
 
         # Проверяем, что сообщение о недоступном товаре отображается
         messages = list(response.wsgi_request._messages)
@@ -290,28 +342,23 @@ class ReorderTest(TestCase):
             quantity=1
         )
 
-    @patch('orders.cart.Cart.add')  # Мокаем метод add класса Cart
-    def test_reorder_adds_items_to_cart(self, mock_cart_add):
+    @patch('orders.cart.Cart.add_many')  # Мокаем метод add_many класса Cart
+    def test_reorder_adds_items_to_cart(self, mock_cart_add_many):
         """
         Проверяем, что повторный заказ добавляет товары в корзину.
         """
         response = self.client.get(reverse('reorder', args=[self.order.id]))
         self.assertRedirects(response, reverse('cart_detail'))
 
-        # Проверяем, что метод add был вызван для каждого доступного товара с правильными аргументами
-        expected_calls = [
-            call(product=self.product1, quantity=2),
-            call(product=self.product2, quantity=1),
-        ]
-        mock_cart_add.assert_has_calls(expected_calls, any_order=True)
-        self.assertEqual(mock_cart_add.call_count, 2)
+        # Проверяем, что все доступные товары добавлены одним вызовом с правильными аргументами
+        mock_cart_add_many.assert_called_once_with([(self.product1, 2), (self.product2, 1)])
 
         # Проверяем, что сообщение об успешном добавлении отображается
         messages = list(response.wsgi_request._messages)
         self.assertTrue(any('добавлены в корзину' in str(message) for message in messages))
 
-    @patch('orders.cart.Cart.add')  # Мокаем метод add класса Cart
-    def test_reorder_with_unavailable_product(self, mock_cart_add):
+    @patch('orders.cart.Cart.add_many')  # Мокаем метод add_many класса Cart
+    def test_reorder_with_unavailable_product(self, mock_cart_add_many):
         """
         Проверяем, что недоступные товары не добавляются в корзину при повторном заказе.
         """
@@ -322,17 +369,49 @@ class ReorderTest(TestCase):
         response = self.client.get(reverse('reorder', args=[self.order.id]))
         self.assertRedirects(response, reverse('cart_detail'))
 
-        # Проверяем, что метод add был вызван только для доступного товара с правильными аргументами
-        expected_calls = [
-            call(product=self.product1, quantity=2),
-        ]
-        mock_cart_add.assert_has_calls(expected_calls, any_order=True)
-        self.assertEqual(mock_cart_add.call_count, 1)
+        # Проверяем, что add_many получил только доступный товар
+        mock_cart_add_many.assert_called_once_with([(self.product1, 2)])
 
         # Проверяем, что сообщение о недоступном товаре отображается
         messages = list(response.wsgi_request._messages)
         self.assertTrue(any('недоступен и не был добавлен в корзину' in str(message) for message in messages))
 
+class OrderItemsQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.client.login(username='testuser', password='TestPassword123')
+
+    def create_order(self, size):
+        order = Order.objects.create(user=self.user, total_price=0, address='Address', phone='123')
+        products = [Product.objects.create(name=f'Букет {i}', price=100 + i) for i in range(size)]
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, price=product.price, quantity=2) for product in products
+        )
+        return order
+
+    def count_queries(self, url_name, order):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse(url_name, args=[order.id]))
+        return len(queries)
+
+    def test_order_detail_query_count_does_not_depend_on_items(self):
+        """
+        Страница заказа из 50 позиций выполняет столько же запросов, сколько заказ из одной.
+        """
+        small, large = self.create_order(1), self.create_order(50)
+        self.assertEqual(self.count_queries('order_detail', small), self.count_queries('order_detail', large))
+        response = self.client.get(reverse('order_detail', args=[large.id]))
+        self.assertContains(response, 'Букет 49 x 2')
+
+    def test_reorder_query_count_does_not_depend_on_items(self):
+        """
+        Повторный заказ из 50 позиций выполняет столько же запросов, сколько заказ из одной.
+        """
+        small, large = self.create_order(1), self.create_order(50)
+        self.assertEqual(self.count_queries('reorder', small), self.count_queries('reorder', large))
+        self.assertEqual(len(self.client.session['cart']), 51)
+
+
 class ReorderIntegrationTest(TestCase):
     def setUp(self):
         # Создаём пользователя и логинимся
@@ -380,10 +459,16 @@ class ReorderIntegrationTest(TestCase):
         response = self.client.get(reverse('reorder', args=[self.order.id]))
         self.assertRedirects(response, reverse('cart_detail'))
         # Проверяем содержимое корзины
-        session = self.client.session
-        cart = session.get('cart')
-        self.assertIsNotNone(cart)
-        self.assertIn(str(self.product1.id), cart)
-        self.assertIn(str(self.product2.id), cart)
-        self.assertEqual(cart[str(self.product1.id)]['quantity'], 2)
-        self.assertEqual(cart[str(self.product2.id)]['quantity'], 1)
+        cart = load_lines(self.client.session.get('cart'))
+        self.assertIn(self.product1.id, cart)
+        self.assertIn(self.product2.id, cart)
+        self.assertEqual(cart[self.product1.id].quantity, 2)
+        self.assertEqual(cart[self.product2.id].quantity, 1)
+
+
+class ProfileIndexTest(QueryPlanMixin, TestCase):
+    def test_telegram_id_lookup_uses_index(self):
+        """
+        Профиль по Telegram ID находится по индексу, без полного просмотра таблицы.
+        """
+        self.assertUsesIndex(Profile.objects.filter(telegram_id='12345'), 'profile_telegram_id_idx')
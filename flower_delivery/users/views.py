@@ -4,63 +4,91 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .forms import UserRegisterForm
 from django.contrib import messages
-from orders.models import Order
+from orders.models import Order, OrderItem
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from orders.cart import Cart
+from django.conf import settings
+from django.core.paginator import Paginator, Page
+
+def _order_with_items(request, order_id):
+    """Заказ пользователя вместе с позициями и их продуктами: два запроса при любом числе позиций"""
+    items = OrderItem.objects.select_related('product')
+    return get_object_or_404(
+        Order.objects.prefetch_related(Prefetch('items', queryset=items)), id=order_id, user=request.user
+    )
 
 @login_required
 def reorder(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = _order_with_items(request, order_id)
     cart = Cart(request)
+    available_items = []
     for item in order.items.all():
         product = item.product
-        quantity = item.quantity
         if product.available:
-            cart.add(product=product, quantity=quantity)
+            available_items.append((product, item.quantity))
         else:
             messages.warning(request, f'Товар "{product.name}" недоступен и не был добавлен в корзину.')
+    # Все позиции добавляются в корзину с одной записью сессии
+    cart.add_many(available_items)
     messages.success(request, f'Товары из заказа №{order.id} добавлены в корзину.')
     return redirect('cart_detail')
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = _order_with_items(request, order_id)
     return render(request, 'users/order_detail.html', {'order': order})
 
 @login_required
 def cancel_order(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user, status='pending')
-    order.status = 'canceled'
-    order.save()
-    messages.success(request, f'Заказ №{order.id} был успешно отменен.')
+    # Отменяем, только если заказ все еще в ожидании: его могли принять в работу параллельно
+    if order.transition_to('canceled'):
+        messages.success(request, f'Заказ №{order.id} был успешно отменен.')
+    else:
+        messages.error(request, f'Заказ №{order.id} уже принят в работу и не может быть отменен.')
     return HttpResponseRedirect(reverse('profile'))
 
 
 @login_required
 def profile(request):
-    # Получаем все заказы пользователя, отсортированные по дате создания
-    orders = request.user.orders.all().order_by('-created_at')
+    orders = request.user.orders.all()
+    per_page = settings.PROFILE_ORDERS_PAGE_SIZE
 
-    # Разделяем заказы по статусам
-    pending_orders = orders.filter(status='pending')
-    accepted_orders = orders.filter(status='accepted')
-    in_progress_orders = orders.filter(status='in_progress')
-    in_delivery_orders = orders.filter(status='in_delivery')
-    completed_orders = orders.filter(status='completed')
-    canceled_orders = orders.filter(status='canceled')
+    # Количество заказов по статусам одним GROUP BY, страницы всех статусов одним запросом
+    counts = orders.status_counts()
+    paginators = {}
+    offsets = {}
+    for status, _ in Order.STATUS_CHOICES:
+        if counts.get(status):
+            paginator = Paginator(range(counts[status]), per_page)
+            paginators[status] = paginator
+            number = paginator.get_page(request.GET.get(f'page_{status}')).number
+            offsets[status] = (number - 1) * per_page
+    pages = orders.status_pages(offsets, per_page)
 
-    context = {
-        'pending_orders': pending_orders,
-        'accepted_orders': accepted_orders,
-        'in_progress_orders': in_progress_orders,
-        'in_delivery_orders': in_delivery_orders,
-        'completed_orders': completed_orders,
-        'canceled_orders': canceled_orders,
-    }
+    order_groups = []
+    for status, label in Order.STATUS_CHOICES:
+        if status not in paginators:
+            continue
+        # Ссылки на страницы одного статуса сохраняют страницы остальных
+        query = request.GET.copy()
+        query.pop(f'page_{status}', None)
+        query[f'page_{status}'] = ''
+        paginator = paginators[status]
+        order_groups.append({
+            'status': status,
+            'label': label,
+            'page': Page(pages[status], offsets[status] // per_page + 1, paginator),
+            'page_query': query.urlencode(),
+            'is_open': f'page_{status}' in request.GET,
+        })
+    if order_groups and not any(group['is_open'] for group in order_groups):
+        order_groups[0]['is_open'] = True
 
-    return render(request, 'users/profile.html', context)
+    return render(request, 'users/profile.html', {'order_groups': order_groups})
 
 
 def register(request):